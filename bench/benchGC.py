@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""Latency of the query method with and without tuning the garbage collector
+
+A synthetic routing table (dictionaries of namedtuples, as read from a pickled
+routing.xml.bin) is built in memory and queries are processed as the service
+does for /query. The last responses are kept to have objects surviving the
+requests, as the caches of a running service do. Each mode runs in its own
+process and the percentiles of the latencies are reported.
+
+    default  thresholds of the interpreter, nothing frozen
+    tuned    thresholds from --thresholds and routing table frozen (gcfreeze)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import gc
+import cgi
+import json
+import time
+import random
+import argparse
+import datetime
+from collections import deque
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+import routing
+from routeutils.wsgicomm import build_environ
+from routeutils.routing import applyFormat
+from routeutils.utils import RoutingCache
+from routeutils.utils import RoutingSnapshot
+from routeutils.utils import Stream
+from routeutils.utils import TW
+from routeutils.utils import Route
+from routeutils.utils import Station
+from benchutils import percentile
+from benchutils import runisolated
+
+
+def buildSnapshot(networks: int, stations: int) -> RoutingSnapshot:
+    """Build a routing table with one stream per station and its station cache."""
+    ptRT = dict()
+    ptST = dict()
+    start = datetime.datetime(1993, 1, 1)
+    for net in range(networks):
+        host = 'dc%d.eida.org' % (net % 12)
+        for sta in range(stations):
+            st = Stream('N%d' % net, 'S%d' % sta, '*', '*')
+            ptRT[st] = [Route('dataselect', 'https://%s/fdsnws/dataselect/1/query' % host, TW(start, None), 1),
+                        Route('station', 'https://%s/fdsnws/station/1/query' % host, TW(start, None), 1),
+                        Route('wfcatalog', 'https://%s/eidaws/wfcatalog/1/query' % host, TW(start, None), 2)]
+            ptST.setdefault(host, dict())[st] = [Station('S%d' % sta, 45.0, 10.0, start + datetime.timedelta(days=d),
+                                                         None) for d in range(5)]
+    return RoutingSnapshot(ptRT, ptST)
+
+
+def run(mode: str, args) -> dict:
+    """Process the queries in this process and return the latencies (ms)."""
+    if mode == 'tuned':
+        gc.set_threshold(*[int(x) for x in args.thresholds.split(',')])
+
+    rc = RoutingCache(gcfreeze=(mode == 'tuned'))
+    # As RoutingCache._install does, without preparing the global configuration
+    rc.snapshot = buildSnapshot(args.networks, args.stations)
+    if rc.gcFreeze:
+        gc.collect()
+        gc.freeze()
+    routing.routes = rc
+
+    collections = [0, 0, 0]
+
+    def count(phase, info):
+        if phase == 'start':
+            collections[info['generation']] += 1
+    gc.callbacks.append(count)
+
+    rnd = random.Random(1)
+    kept = deque(maxlen=args.keep)
+    latencies = list()
+    for _ in range(args.queries):
+        qs = 'net=N%d&sta=S%d&format=post' % (rnd.randrange(args.networks), rnd.randrange(args.stations))
+        startTime = time.perf_counter()
+        form = cgi.FieldStorage(environ=build_environ('/query', qs))
+        result = routing.makeQueryGET(form)
+        applyFormat(result, 'post')
+        kept.append(result)
+        latencies.append((time.perf_counter() - startTime) * 1000)
+
+    gc.callbacks.remove(count)
+    latencies.sort()
+    return {'mode': mode, 'queries': len(latencies), 'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99), 'p99.9': percentile(latencies, 99.9), 'max': latencies[-1],
+            'collections': collections, 'frozen': gc.get_freeze_count()}
+
+
+def main():
+    msg = 'Measure the latency of /query with and without tuning the garbage collector.'
+    parser = argparse.ArgumentParser(description=msg)
+    parser.add_argument('-n', '--networks', type=int, default=200, help='Networks in the routing table.')
+    parser.add_argument('-s', '--stations', type=int, default=100, help='Stations per network.')
+    parser.add_argument('-q', '--queries', type=int, default=10000, help='Queries to process.')
+    parser.add_argument('-k', '--keep', type=int, default=2000, help='Responses kept alive (f.i. in caches).')
+    parser.add_argument('-t', '--thresholds', default='50000,20,100', help='Thresholds for the tuned mode.')
+    parser.add_argument('--mode', choices=['default', 'tuned'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run(args.mode, args)))
+        return
+
+    print('%-8s %8s %8s %8s %8s %8s  %s' % ('mode', 'queries', 'p50', 'p99', 'p99.9', 'max', 'collections'))
+    for mode in ('default', 'tuned'):
+        r = runisolated(__file__, ['--mode', mode] + sys.argv[1:])
+        print('%-8s %8d %8.3f %8.3f %8.3f %8.3f  %s (%d objects frozen)' %
+              (r['mode'], r['queries'], r['p50'], r['p99'], r['p99.9'], r['max'],
+               '/'.join(str(c) for c in r['collections']), r['frozen']))
+    print('Latencies in milliseconds. Collections per generation (0/1/2).')
+
+
+if __name__ == '__main__':
+    main()
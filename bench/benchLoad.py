@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+
+"""Load test of the WSGI application with concurrent requests
+
+The routing information (the sample in data/routing.sample.xml or a table
+built with :class:`routeutils.synthetic.RoutingGenerator`) is compiled in a
+temporary directory (with invented stations for the sample, as the station-WS
+cannot be queried off-line) and loaded by a :class:`routeutils.utils.RoutingCache`,
+as the service does with the files of updateAll.py. A pool of threads sends
+a mix of requests:
+
+    query       GET and POST in all formats (xml, json, get, post, fdsn), with
+                exact streams, virtual networks, geographic limits,
+                alternative routes and unknown networks
+    others      virtualnets, endpoints, globalconfig, localconfig, version,
+                info and application.wadl
+
+The requests are passed directly to ``routing.application`` with a WSGI
+environment built in memory, or sent over the loopback interface to a
+``wsgiref`` server running the application in threads. Every group of
+requests (function, method and format) is first sent alone, so that the
+memory growth can be attributed to it, and then all of them mixed.
+
+Every configuration (routing data, transport and concurrency) runs in its own
+process. Nothing is sent to the network apart from the loopback interface.
+The results are printed and saved in JSON format.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import gc
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+import resource
+import shutil
+import tempfile
+import itertools
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from urllib.parse import urlencode
+from urllib.parse import urlparse
+from wsgiref.simple_server import make_server
+from wsgiref.simple_server import WSGIServer
+from wsgiref.simple_server import WSGIRequestHandler
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+import routing
+from routeutils.wsgicomm import build_environ
+from routeutils.utils import RoutingCache
+from routeutils.utils import RoutingTransaction
+from routeutils.utils import parserouting
+from routeutils.utils import savecompiled
+from routeutils.utils import replacelast
+from routeutils.utils import Station
+from routeutils.synthetic import RoutingGenerator
+from benchutils import percentile
+from benchutils import runisolated
+
+SAMPLE = os.path.join(here, '..', 'data', 'routing.sample.xml')
+FORMATS = ('xml', 'json', 'get', 'post', 'fdsn')
+# Share of the requests which are not queries
+OTHERS = [('virtualnets', '', 4), ('endpoints', '', 2), ('globalconfig', 'format=fdsn', 2),
+          ('localconfig', '', 2), ('version', '', 4), ('info', '', 3), ('application.wadl', '', 3)]
+# Share of the queries with GET and POST
+QUERIES = [('GET', 55), ('POST', 25)]
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """WSGI server processing every connection in a thread"""
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Handler of the requests which does not log them"""
+
+    def log_message(self, *args):
+        pass
+
+
+def sampleTables(seed: int = 1) -> tuple:
+    """Return the tables built from the sample routing file.
+
+    The station-WS cannot be queried off-line. Stations called S000 to S019,
+    the ones in the virtual networks or the one of the route are placed at
+    random in Europe instead.
+    """
+    rnd = random.Random(seed)
+    ptRT = dict()
+    ptVN = dict()
+    transaction = RoutingTransaction(ptRT, ptVN)
+    routes, vnets = parserouting(SAMPLE)
+    transaction.stage(routes, vnets, filename=SAMPLE)
+    transaction.commit()
+    with open(replacelast(SAMPLE, '.xml', '.json')) as fin:
+        eidaDCs = [json.load(fin)]
+
+    # Stations in the virtual networks
+    members = dict()
+    for streams in ptVN.values():
+        for vst, _ in streams:
+            members.setdefault(vst.n, set()).add(vst.s)
+
+    ptST = dict()
+    for st, rts in ptRT.items():
+        start = min((rt.tw.start for rt in rts if rt.tw.start is not None), default=datetime.datetime(1980, 1, 1))
+        names = ['S%03d' % i for i in range(20)] + sorted(members.get(st.n, ())) if '*' in st.s else [st.s]
+        stations = [Station(name, rnd.uniform(35, 70), rnd.uniform(-10, 40), start, None) for name in names]
+        for netloc in set(urlparse(rt.address).netloc for rt in rts):
+            ptST.setdefault(netloc, dict())[st] = stations
+    return ptRT, ptST, ptVN, eidaDCs
+
+
+def buildRequests(ptRT: dict, ptVN: dict, requests: int, seed: int = 1) -> list:
+    """Return the requests to send as tuples (group, method, path, query string, body).
+
+    :param ptRT: Routing table
+    :type ptRT: dict
+    :param ptVN: Virtual networks
+    :type ptVN: dict
+    :param requests: Number of requests
+    :type requests: int
+    :param seed: Seed of the random choices
+    :type seed: int
+    :returns: Requests in the order to send them
+    :rtype: list
+    """
+    rnd = random.Random(seed)
+    streams = list(ptRT.keys())
+    vnets = list(ptVN.keys())
+
+    def params() -> dict:
+        """Parameters selecting one day of a stream, a virtual network, a region or nothing."""
+        kind = rnd.choices(['exact', 'vn', 'geo', 'alternative', 'nodata'], [60, 15, 10, 10, 5])[0]
+        if kind == 'nodata':
+            return {'net': 'ZZ', 'sta': 'NONE', 'start': '2021-01-01', 'end': '2021-01-02'}
+        if kind == 'vn' and len(vnets):
+            code = rnd.choice(vnets)
+            start = rnd.choice(ptVN[code])[1].start or datetime.datetime(2000, 1, 1)
+            return {'net': code, 'start': start.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'end': (start + datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S')}
+        if kind == 'geo':
+            lat = rnd.uniform(35, 65)
+            lon = rnd.uniform(-10, 35)
+            return {'net': rnd.choice(streams).n[:-1] + '?', 'minlat': '%.1f' % lat, 'maxlat': '%.1f' % (lat + 5),
+                    'minlon': '%.1f' % lon, 'maxlon': '%.1f' % (lon + 5),
+                    'start': '2021-01-01', 'end': '2021-01-02'}
+
+        st = rnd.choice(streams)
+        start = min((rt.tw.start for rt in ptRT[st] if rt.tw.start is not None),
+                    default=datetime.datetime(2000, 1, 1)) + datetime.timedelta(days=10)
+        # Real codes for the components with wildcards
+        result = {'net': st.n, 'sta': st.s if st.s != '*' else 'S%03d' % rnd.randrange(20),
+                  'loc': st.l if st.l != '*' else '00', 'cha': st.c if '*' not in st.c else 'HHZ',
+                  'start': start.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'end': (start + datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S')}
+        if kind == 'alternative':
+            result['alternative'] = 'true'
+        return result
+
+    names = ['query'] + [name for name, _, _ in OTHERS]
+    weights = [sum(w for _, w in QUERIES)] + [w for _, _, w in OTHERS]
+    queries = dict((name, qs) for name, qs, _ in OTHERS)
+
+    result = list()
+    for name in rnd.choices(names, weights, k=requests):
+        if name != 'query':
+            result.append(('%s/GET/%s' % (name, 'fdsn' if name == 'globalconfig' else 'xml'), 'GET',
+                           '/' + name, queries[name], b''))
+            continue
+
+        method = rnd.choices([m for m, _ in QUERIES], [w for _, w in QUERIES])[0]
+        outform = rnd.choice(FORMATS)
+        group = 'query/%s/%s' % (method, outform)
+        if method == 'GET':
+            p = params()
+            # Alternative routes cannot be returned in the format get
+            while outform == 'get' and 'alternative' in p:
+                p = params()
+            p['format'] = outform
+            result.append((group, method, '/query', urlencode(p, safe='*'), b''))
+            continue
+
+        # Header with the format and one line per stream
+        lines = ['format=%s' % outform]
+        for _ in range(rnd.randint(1, 10)):
+            p = params()
+            if 'minlat' in p or 'alternative' in p:
+                p = params()
+            lines.append(' '.join([p.get('net', '*'), p.get('sta', '*'), p.get('loc', '*'), p.get('cha', '*'),
+                                   p['start'], p['end']]))
+        result.append((group, method, '/query', '', '\n'.join(lines).encode()))
+    return result
+
+
+def callApplication(method: str, path: str, query: str, body: bytes) -> tuple:
+    """Pass a request directly to the WSGI application and return the status and size of the response."""
+    status = list()
+
+    def startResponse(st, headers, *args):
+        status.append(st)
+
+    environ = build_environ(path, query, method, body)
+    response = routing.application(environ, startResponse)
+    try:
+        size = sum(len(chunk) for chunk in response)
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    return int(status[0].split()[0]), size
+
+
+def httpCaller(port: int):
+    """Return a function sending a request to the WSGI server on the loopback interface."""
+    def call(method: str, path: str, query: str, body: bytes) -> tuple:
+        # wsgiref speaks HTTP/1.0 and closes the connection after every response
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+        try:
+            headers = {'Content-Type': 'text/plain'} if method == 'POST' else dict()
+            conn.request(method, path + ('?' + query if query else ''), body=body if method == 'POST' else None,
+                         headers=headers)
+            response = conn.getresponse()
+            return response.status, len(response.read())
+        finally:
+            conn.close()
+    return call
+
+
+def rss() -> float:
+    """Return the memory (MB) used by this process now."""
+    with open('/proc/self/statm') as fin:
+        return int(fin.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def summary(samples: list, seconds: float) -> dict:
+    """Return the throughput, percentiles of the latency (ms) and status of a list of (latency, status, size)."""
+    latencies = sorted(lat for lat, _, _ in samples)
+    errors = sum(1 for _, status, _ in samples if status is None or status >= 500)
+    return {'requests': len(samples), 'rps': len(samples) / seconds if seconds else 0.0,
+            'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99), 'max': latencies[-1],
+            'errors': errors, 'errorrate': errors / len(samples),
+            'client': sum(1 for _, status, _ in samples if status is not None and 400 <= status < 500),
+            'nodata': sum(1 for _, status, _ in samples if status == 204),
+            'bytes': sum(size for _, _, size in samples)}
+
+
+def load(call, todo: list, concurrency: int, duration: float) -> dict:
+    """Send the requests with a pool of threads and return the summary of every group.
+
+    :param call: Function sending a request and returning its status and size
+    :type call: function
+    :param todo: Requests as returned by :func:`buildRequests`
+    :type todo: list
+    :param concurrency: Number of requests sent at the same time
+    :type concurrency: int
+    :param duration: Maximum seconds sending requests
+    :type duration: float
+    :returns: Summary of all the requests and of every group, and memory used
+    :rtype: dict
+    """
+    # Shared by all the threads. next() on a counter is atomic in CPython.
+    counter = itertools.count()
+    stopTime = time.perf_counter() + duration
+    failures = list()
+
+    def worker() -> list:
+        samples = list()
+        while True:
+            idx = next(counter)
+            if idx >= len(todo) or time.perf_counter() > stopTime:
+                return samples
+            group, method, path, query, body = todo[idx]
+            startTime = time.perf_counter()
+            try:
+                status, size = call(method, path, query, body)
+            except Exception as e:
+                status, size = None, 0
+                failures.append('%s: %s' % (group, e))
+            samples.append((group, (time.perf_counter() - startTime) * 1000, status, size))
+
+    gc.collect()
+    before = rss()
+    startTime = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(worker) for _ in range(concurrency)]
+    seconds = time.perf_counter() - startTime
+    gc.collect()
+
+    samples = [s for f in futures for s in f.result()]
+    groups = dict()
+    for group, lat, status, size in samples:
+        groups.setdefault(group, list()).append((lat, status, size))
+    result = {'seconds': seconds, 'rss': rss(), 'growth': rss() - before,
+              'total': summary([s[1:] for s in samples], seconds),
+              'groups': dict((g, summary(groups[g], seconds)) for g in sorted(groups)),
+              'failures': failures[:10]}
+    return result
+
+
+def run(source: str, transport: str, concurrency: int, requests: int, storage: str, seed: int,
+        duration: float = 60) -> dict:
+    """Load the routing data, send the requests in this process and return the results."""
+    startTime = time.perf_counter()
+    # As the service does with the files of updateAll.py (localconfig returns routing.xml)
+    tmpdir = tempfile.TemporaryDirectory()
+    routesFile = os.path.join(tmpdir.name, 'routing.xml')
+    if source == 'sample':
+        ptRT, ptST, ptVN, eidaDCs = sampleTables(seed)
+        shutil.copyfile(SAMPLE, routesFile)
+    else:
+        generator = RoutingGenerator(int(source), seed=seed)
+        ptRT, ptST, ptVN, eidaDCs = generator.tables()
+        generator.writerouting(routesFile, 0)
+        del generator
+    todo = buildRequests(ptRT, ptVN, requests, seed)
+
+    savecompiled(routesFile + '.bin', ptRT, ptST, ptVN, eidaDCs, storage, generations=1)
+    del ptRT, ptST, ptVN
+    routing.routes = RoutingCache(routesFile, os.path.join(here, '..', 'routing.cfg'))
+    gc.collect()
+    ready = time.perf_counter() - startTime
+
+    server = None
+    if transport == 'wsgiref':
+        server = make_server('127.0.0.1', 0, routing.application, ThreadingWSGIServer, QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        call = httpCaller(server.server_port)
+    else:
+        call = callApplication
+
+    # One request of every group to fill the caches of the responses
+    seen = dict()
+    for req in todo:
+        seen.setdefault(req[0], req)
+    warmup = load(call, sorted(seen.values()), 1, duration)
+
+    # Every group alone and then all the groups mixed
+    phases = dict()
+    for group in sorted(seen):
+        phases[group] = load(call, [req for req in todo if req[0] == group], concurrency, duration)
+    phases['mixed'] = load(call, todo, concurrency, duration)
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+    tmpdir.cleanup()
+    return {'source': source, 'transport': transport, 'concurrency': concurrency, 'storage': storage,
+            'ready': ready, 'warmup': warmup['growth'], 'rss': rss(),
+            'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024, 'phases': phases}
+
+
+def main():
+    msg = 'Send concurrent requests to the WSGI application and measure throughput, latency, errors and memory.'
+    parser = argparse.ArgumentParser(description=msg)
+    parser.add_argument('-n', '--routes', default='sample,10000',
+                        help='Comma-separated routing data to load: "sample" (data/routing.sample.xml) '
+                             'or the size of a synthetic routing table (routes).')
+    parser.add_argument('-t', '--transport', default='inprocess',
+                        help='Comma-separated ways to send the requests (inprocess, wsgiref).')
+    parser.add_argument('-c', '--concurrency', default='1,4,16', help='Comma-separated numbers of concurrent clients.')
+    parser.add_argument('-r', '--requests', type=int, default=2000, help='Requests sent in the mixed phase.')
+    parser.add_argument('-s', '--storage', default='artifact', help='Storage of the compiled routing data.')
+    parser.add_argument('-d', '--duration', type=float, default=60,
+                        help='Maximum seconds sending requests in every phase.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random tables and requests.')
+    parser.add_argument('-o', '--output', default='benchLoad.json', help='File where the results are saved.')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        source, transport, concurrency = args.run.split(',')
+        print(json.dumps(run(source, transport, int(concurrency), args.requests, args.storage, args.seed,
+                             args.duration)))
+        return
+
+    results = list()
+    print('%-8s %-9s %4s %-24s %7s %9s %8s %8s %8s %7s %6s %6s %7s' %
+          ('routes', 'transport', 'conc', 'phase', 'reqs', 'rps', 'p50', 'p90', 'p99', 'err%', '4xx', '204',
+           'MB'))
+    for source in args.routes.split(','):
+        for transport in args.transport.split(','):
+            for concurrency in args.concurrency.split(','):
+                r = runisolated(__file__, ['--run', '%s,%s,%s' % (source, transport, concurrency),
+                                           '--requests', str(args.requests), '--storage', args.storage,
+                                           '--seed', str(args.seed), '--duration', str(args.duration)])
+                results.append(r)
+                for name, p in r['phases'].items():
+                    s = p['total']
+                    print('%-8s %-9s %4d %-24s %7d %9.1f %8.3f %8.3f %8.3f %7.2f %6d %6d %+7.1f' %
+                          (source, transport, r['concurrency'], name, s['requests'], s['rps'], s['p50'], s['p90'],
+                           s['p99'], s['errorrate'] * 100, s['client'], s['nodata'], p['growth']))
+                    for failure in p['failures']:
+                        print('    %s' % failure)
+                print('%-8s %-9s %4d ready in %.1f s, %+.1f MB in the warmup, %d MB in use (%d MB peak)' %
+                      (source, transport, r['concurrency'], r['ready'], r['warmup'], r['rss'], r['maxrss']))
+    print('Latencies in milliseconds. MB is the growth of the memory in use during the phase.')
+
+    with open(args.output, 'w') as fout:
+        json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'seed': args.seed,
+                   'requests': args.requests, 'duration': args.duration, 'storage': args.storage,
+                   'date': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'results': results},
+                  fout, indent=2)
+    print('Results saved in %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
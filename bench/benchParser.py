@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""Time and memory needed to parse a large routing file
+
+A synthetic routing file is written with the requested number of routes (and
+some virtual networks) and it is read with both parsers of the routing files.
+Each parser runs in its own process, so that the peak memory reported is only
+the one needed by the parser.
+
+    expat     routeutils.utils.parserouting (routeutils.expatparser)
+    tree      parserET.parseroutingET (ElementTree.iterparse)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import json
+import time
+import hashlib
+import argparse
+import resource
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from routeutils.utils import parserouting
+from parserET import parseroutingET
+from routeutils.synthetic import RoutingGenerator
+from benchutils import runisolated
+
+parsers = {'expat': parserouting, 'tree': parseroutingET}
+
+
+def writeRouting(filename: str, routes: int, seed: int = 1):
+    """Write a synthetic routing file (see :class:`routeutils.synthetic.RoutingGenerator`)."""
+    RoutingGenerator(routes, seed=seed).writerouting(filename)
+
+
+def run(name: str, filename: str) -> dict:
+    """Parse the file in this process and return the time and the peak memory."""
+    startTime = time.perf_counter()
+    routes, vnets = parsers[name](filename)
+    elapsed = time.perf_counter() - startTime
+    # A digest of the result to check that both parsers agree
+    digest = hashlib.sha1(repr((routes, vnets)).encode()).hexdigest()
+    return {'parser': name, 'seconds': elapsed, 'routes': len(routes), 'vnets': len(vnets),
+            'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024, 'digest': digest}
+
+
+def main():
+    msg = 'Compare the time and memory needed by the parsers of routing files.'
+    parser = argparse.ArgumentParser(description=msg)
+    parser.add_argument('-n', '--routes', type=int, default=1000000, help='Routes in the synthetic file.')
+    parser.add_argument('-f', '--file', default=None,
+                        help='Routing file to parse. A synthetic one is created if not given.')
+    parser.add_argument('--parser', choices=sorted(parsers), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.parser is not None:
+        print(json.dumps(run(args.parser, args.file)))
+        return
+
+    tmpdir = None
+    if args.file is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        args.file = os.path.join(tmpdir.name, 'routing.xml')
+        writeRouting(args.file, args.routes)
+
+    print('%s (%d MB)' % (args.file, os.path.getsize(args.file) // 2**20))
+    print('%-8s %10s %10s %8s %10s' % ('parser', 'seconds', 'routes', 'vnets', 'maxrss MB'))
+    digests = set()
+    try:
+        for name in ('tree', 'expat'):
+            r = runisolated(__file__, ['--parser', name, '--file', args.file])
+            digests.add(r['digest'])
+            print('%-8s %10.2f %10d %8d %10d' % (r['parser'], r['seconds'], r['routes'], r['vnets'], r['maxrss']))
+    finally:
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    if len(digests) > 1:
+        print('The parsers returned different results!')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
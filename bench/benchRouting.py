@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+"""Latency and throughput of the routing lookups on large synthetic routing tables
+
+Routing tables with the requested number of routes are built with
+:class:`routeutils.synthetic.RoutingGenerator`: whole networks, temporary
+networks with a few epochs, single stations and stations with only some
+channels in twelve data centres, with stations and virtual networks.
+
+A mix of queries is sent to :meth:`routeutils.utils.RoutingCache.getRoute`:
+
+    exact        N.S.L.C without wildcards
+    netwildcard  network with a wildcard (f.i. B? for BA ... B9)
+    allnet       net=* and a station code
+    geo          network with a wildcard and a rectangle (minlat, maxlat, ...)
+    vn           virtual network
+    alternative  N.S.L.C without wildcards and alternative=true
+
+Every table size (and storage) runs in its own process, so that the peak memory
+reported is only the one needed by that table. No more queries are sent when
+the time given for every table is over, so that huge tables still finish (a
+single net=* query can take minutes with 1M routes). The results are printed and
+saved in JSON format, so that different runs can be compared.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import gc
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+import resource
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from routeutils.utils import RoutingCache
+from routeutils.utils import RoutingSnapshot
+from routeutils.utils import RoutingException
+from routeutils.utils import GeoRectangle
+from routeutils.utils import Stream
+from routeutils.utils import TW
+from routeutils.utils import savecompiled
+from routeutils.synthetic import RoutingGenerator
+from benchutils import percentile
+from benchutils import runisolated
+
+# Query shapes and their share of the queries
+SHAPES = [('exact', 40), ('netwildcard', 15), ('allnet', 5), ('geo', 10), ('vn', 15), ('alternative', 15)]
+
+
+def buildQueries(generator: RoutingGenerator, queries: int, seed: int = 1) -> list:
+    """Return the queries to send as tuples (shape, stream, time window, geolocation, alternative)."""
+    rnd = random.Random(seed)
+    networks = list(generator.stations.keys())
+    vnets = list(generator.vnets.keys())
+    names = [name for name, _ in SHAPES]
+    weights = [w for _, w in SHAPES]
+    tw = TW(datetime.datetime(2021, 1, 1), datetime.datetime(2021, 1, 2))
+
+    result = list()
+    for shape in rnd.choices(names, weights, k=queries):
+        st, rts, _ = rnd.choice(generator.streams)
+        # Real codes for the components with wildcards
+        exact = Stream(st.n, st.s if st.s != '*' else rnd.choice(generator.stations[st.n]).name,
+                       st.l if st.l != '*' else '', st.c if '*' not in st.c else 'HHZ')
+        if shape in ('exact', 'alternative'):
+            # One day in the first epoch of the stream
+            start = rnd.choice(rts).tw.start + datetime.timedelta(days=10)
+            result.append((shape, exact, TW(start, start + datetime.timedelta(days=1)), None,
+                           shape == 'alternative'))
+        elif shape == 'netwildcard':
+            result.append((shape, Stream(rnd.choice(networks)[:-1] + '?', '*', '*', '*'), tw, None, False))
+        elif shape == 'allnet':
+            result.append((shape, Stream('*', exact.s, '*', '*'), tw, None, False))
+        elif shape == 'geo':
+            lat = rnd.uniform(35, 65)
+            lon = rnd.uniform(-10, 35)
+            result.append((shape, Stream(rnd.choice(networks)[:-1] + '?', '*', '*', '*'), tw,
+                           GeoRectangle(lat, lat + 5, lon, lon + 5), False))
+        else:
+            result.append((shape, Stream(rnd.choice(vnets), '*', '*', '*'), tw, None, False))
+    return result
+
+
+def rss() -> int:
+    """Return the memory (MB) used by this process now."""
+    with open('/proc/self/statm') as fin:
+        return int(fin.read().split()[1]) * resource.getpagesize() // 2**20
+
+
+def summary(latencies: list, seconds: float, empty: int) -> dict:
+    """Return the percentiles (ms) and the throughput of a list of latencies (ms)."""
+    latencies.sort()
+    return {'queries': len(latencies), 'empty': empty, 'qps': len(latencies) / seconds if seconds else 0.0,
+            'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99), 'max': latencies[-1]}
+
+
+def run(routes: int, storage: str, queries: int, seed: int, duration: float = 60) -> dict:
+    """Build the table, send the queries in this process and return the results."""
+    startTime = time.perf_counter()
+    generator = RoutingGenerator(routes, seed=seed)
+    ptRT, ptST, ptVN, eidaDCs = generator.tables()
+    build = time.perf_counter() - startTime
+    # The queries are built before measuring anything
+    todo = buildQueries(generator, queries, seed)
+    del generator
+
+    rc = RoutingCache()
+    tmpdir = tempfile.TemporaryDirectory()
+    startTime = time.perf_counter()
+    if storage == 'memory':
+        # As RoutingCache._install does, without preparing the global configuration
+        rc.snapshot = RoutingSnapshot(ptRT, ptST, ptVN, eidaDCs)
+    else:
+        binfile = os.path.join(tmpdir.name, 'routing.xml.bin')
+        savecompiled(binfile, ptRT, ptST, ptVN, eidaDCs, storage, generations=1)
+        rc.snapshot = rc.loadbin(binfile)
+    del ptRT, ptST, ptVN
+    gc.collect()
+    load = time.perf_counter() - startTime
+    stats = rc.snapshot.stats()
+
+    latencies = dict((name, list()) for name, _ in SHAPES)
+    seconds = dict((name, 0.0) for name, _ in SHAPES)
+    empty = dict((name, 0) for name, _ in SHAPES)
+    stopTime = time.perf_counter() + duration
+    for shape, st, tw, geoloc, alternative in todo:
+        startTime = time.perf_counter()
+        if startTime > stopTime:
+            break
+        try:
+            rc.getRoute(st, tw, 'dataselect', geoloc, alternative)
+        except RoutingException:
+            empty[shape] += 1
+        elapsed = time.perf_counter() - startTime
+        latencies[shape].append(elapsed * 1000)
+        seconds[shape] += elapsed
+
+    everything = [lat for name, _ in SHAPES for lat in latencies[name]]
+    result = {'routes': routes, 'storage': storage, 'build': build, 'load': load, 'stats': stats,
+              'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024, 'rss': rss(),
+              'total': summary(everything, sum(seconds.values()), sum(empty.values())),
+              'shapes': dict((name, summary(latencies[name], seconds[name], empty[name]))
+                             for name, _ in SHAPES if len(latencies[name]))}
+    tmpdir.cleanup()
+    return result
+
+
+def main():
+    msg = 'Measure the latency and throughput of the routing lookups on synthetic routing tables.'
+    parser = argparse.ArgumentParser(description=msg)
+    parser.add_argument('-n', '--routes', default='10000,100000,1000000',
+                        help='Comma-separated sizes of the routing tables (routes).')
+    parser.add_argument('-q', '--queries', type=int, default=5000, help='Queries sent to every table.')
+    parser.add_argument('-s', '--storage', default='memory',
+                        help='Comma-separated storages to test (memory, artifact, sqlite).')
+    parser.add_argument('-d', '--duration', type=float, default=60,
+                        help='Maximum seconds sending queries to every table.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random tables and queries.')
+    parser.add_argument('-o', '--output', default='benchRouting.json', help='File where the results are saved.')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        routes, storage = args.run.split(',')
+        print(json.dumps(run(int(routes), storage, args.queries, args.seed, args.duration)))
+        return
+
+    results = list()
+    print('%-8s %8s %-12s %8s %10s %8s %8s %8s %8s' % ('storage', 'routes', 'shape', 'queries', 'qps', 'p50',
+                                                     'p90', 'p99', 'max'))
+    for storage in args.storage.split(','):
+        for routes in args.routes.split(','):
+            r = runisolated(__file__, ['--run', '%s,%s' % (routes, storage), '--queries', str(args.queries),
+                                       '--seed', str(args.seed), '--duration', str(args.duration)])
+            results.append(r)
+            for name, s in list(r['shapes'].items()) + [('total', r['total'])]:
+                print('%-8s %8d %-12s %8d %10.1f %8.3f %8.3f %8.3f %8.3f' %
+                      (storage, r['routes'], name, s['queries'], s['qps'], s['p50'], s['p90'], s['p99'], s['max']))
+            print('%-8s %8d built in %.1f s, loaded in %.1f s, %d MB in use (%d MB peak)' %
+                  (storage, r['routes'], r['build'], r['load'], r['rss'], r['maxrss']))
+    print('Latencies in milliseconds.')
+
+    with open(args.output, 'w') as fout:
+        json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'seed': args.seed,
+                   'queries': args.queries, 'duration': args.duration,
+                   'date': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'results': results},
+                  fout, indent=2)
+    print('Results saved in %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+"""Functions shared by the benchmarks of the Routing Service
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import json
+import subprocess
+
+
+def percentile(values: list, p: float) -> float:
+    """Return the percentile p (0-100) of a sorted list."""
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def runisolated(script: str, args: list) -> dict:
+    """Run a benchmark script in a new process and return the JSON printed in its last line.
+
+    Every measurement runs in its own process, so that they do not affect each
+    other (memory in use, garbage collector, caches).
+
+    :param script: Benchmark script (f.i. __file__)
+    :type script: str
+    :param args: Command line arguments of the script
+    :type args: list
+    :returns: Result of the measurement
+    :rtype: dict
+    :raises: subprocess.CalledProcessError if the script fails
+    """
+    out = subprocess.run([sys.executable, os.path.abspath(script)] + args,
+                         check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out.decode().splitlines()[-1])
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+"""Parser of routing files based on ElementTree
+
+This is how the routing files were read before :mod:`routeutils.expatparser`.
+It is kept out of the service, only to compare the results
+(test/testRoute.py) and the performance (bench/benchParser.py) of both
+parsers.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import logging
+import xml.etree.cElementTree as ET
+from typing import List, Tuple, Union
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from routeutils.utils import Stream
+from routeutils.utils import Route
+from routeutils.utils import TW
+from routeutils.utils import str2date
+
+
+def parseroutingET(filename: str) -> Tuple[List[Tuple[Stream, Route]], List[Tuple[Union[str, None], Stream, TW]]]:
+    """Read the routing file in XML format and return its routes and VNs in order.
+
+    Reference implementation of :func:`~routeutils.utils.parserouting` based
+    on ElementTree.iterparse.
+
+    :param filename: File with routes and virtual networks in XML format
+    :type filename: str
+    :returns: Tuples (:class:`~routeutils.utils.Stream`, :class:`~routeutils.utils.Route`) and tuples (code, :class:`~routeutils.utils.Stream`, :class:`~routeutils.utils.TW`) in the order they were found
+    :rtype: tuple
+    :raises Exception: An exception is raised to signal a higher level that data should be read from somewhere else.
+    """
+    logs = logging.getLogger('addroutes')
+    logs.debug('Entering parseroutingET(%s)\n' % filename)
+    vnlogs = logging.getLogger('addvirtualnets')
+
+    result = list()
+    vnets = list()
+
+    with open(filename, 'r', encoding='utf-8') as testFile:
+        # Parse the routing file
+        # Traverse through the networks
+        # get an iterable
+        try:
+            context = ET.iterparse(testFile, events=("start", "end"))
+        except IOError:
+            msg = 'Error: %s could not be parsed. Skipping it!\n' % filename
+            logs.error(msg)
+            raise Exception(msg)
+
+        # turn it into an iterator
+        context = iter(context)
+
+        try:
+            # get the root element
+            # More Python 3 compatibility
+            if hasattr(context, 'next'):
+                event, root = context.next()
+            else:
+                event, root = next(context)
+        except Exception:
+            msg = 'Error: %s could not be parsed. Reading backup!\n' % filename
+            logs.error(msg)
+            testFile.close()
+            os.replace(filename, filename + '.wrong')
+            try:
+                os.replace(filename + '.bck', filename)
+                testFile = open(filename, 'r', encoding='utf-8')
+                context = ET.iterparse(testFile, events=("start", "end"))
+                context = iter(context)
+                # get the root element
+                # More Python 3 compatibility
+                if hasattr(context, 'next'):
+                    event, root = context.next()
+                else:
+                    event, root = next(context)
+            except Exception:
+                raise Exception('Error: %s and even its backup version could not be loaded!\n' % filename)
+
+        # Check that it is really an inventory
+        try:
+            assert root.tag[-len('routing'):] == 'routing'
+        except Exception:
+            msg = '%s seems not to be a routing file (XML). Skipping it!\n' \
+                  % filename
+            logs.error(msg)
+            raise Exception(msg)
+
+        # Extract the namespace from the root node
+        namesp = root.tag[:-len('routing')]
+
+        for event, route in context:
+            # The tag of this node should be "route".
+            # Now it is not being checked because
+            # we need all the data, but if we need to filter, this
+            # is the place.
+            #
+            if event == "end":
+                if route.tag == namesp + 'route':
+
+                    # Extract the location code
+                    try:
+                        locationCode = route.get('locationCode', default='*')
+                        if len(locationCode) == 0:
+                            locationCode = '*'
+
+                        # Do not allow "?" wildcard in the input, because it
+                        # will be impossible to match with the user input if
+                        # this also has a mixture of "*" and "?"
+                        if '?' in locationCode:
+                            logs.error('Wildcard "?" is not allowed!')
+                            continue
+
+                    except Exception:
+                        locationCode = '*'
+
+                    # Extract the network code
+                    try:
+                        networkCode = route.get('networkCode', default='*')
+                        if len(networkCode) == 0:
+                            networkCode = '*'
+
+                        # Do not allow "?" wildcard in the input, because it
+                        # will be impossible to match with the user input if
+                        # this also has a mixture of "*" and "?"
+                        if '?' in networkCode:
+                            logs.error('Wildcard "?" is not allowed!')
+                            continue
+
+                    except Exception:
+                        networkCode = '*'
+
+                    # Extract the station code
+                    try:
+                        stationCode = route.get('stationCode', default='*')
+                        if len(stationCode) == 0:
+                            stationCode = '*'
+
+                        # Do not allow "?" wildcard in the input, because it
+                        # will be impossible to match with the user input if
+                        # this also has a mixture of "*" and "?"
+                        if '?' in stationCode:
+                            logs.error('Wildcard "?" is not allowed!')
+                            continue
+
+                    except Exception:
+                        stationCode = '*'
+
+                    # Extract the stream code
+                    try:
+                        streamCode = route.get('streamCode', default='*')
+                        if len(streamCode) == 0:
+                            streamCode = '*'
+
+                        # Do not allow "?" wildcard in the input, because it
+                        # will be impossible to match with the user input if
+                        # this also has a mixture of "*" and "?"
+                        if '?' in streamCode:
+                            logs.error('Wildcard "?" is not allowed!')
+                            continue
+
+                    except Exception:
+                        streamCode = '*'
+
+                    # Traverse through the sources
+                    for serv in route:
+                        assert serv.tag[:len(namesp)] == namesp
+
+                        service = serv.tag[len(namesp):]
+                        att = serv.attrib
+
+                        # Extract the address (mandatory)
+                        try:
+                            address = att.get('address')
+                            if len(address) == 0:
+                                logs.error('Could not add %s' % att)
+                                continue
+                        except Exception:
+                            logs.error('Could not add %s' % att)
+                            continue
+
+                        try:
+                            auxStart = att.get('start', None)
+                            startD = str2date(auxStart)
+                        except Exception:
+                            startD = None
+
+                        # Extract the end datetime
+                        try:
+                            auxEnd = att.get('end', None)
+                            endD = str2date(auxEnd)
+                        except Exception:
+                            endD = None
+
+                        # Check that the time window is reasonable
+                        if (startD is not None) and (endD is not None) and (startD > endD):
+                            logs.error('Starttime is later than the endtime! %s.%s %s %s' % (networkCode,
+                                                                                             stationCode,
+                                                                                             startD, endD))
+                            continue
+
+                        # Extract the priority
+                        try:
+                            priority = att.get('priority', '99')
+                            if len(priority) == 0:
+                                priority = 99
+                            else:
+                                priority = int(priority)
+                        except Exception:
+                            priority = 99
+
+                        # Append the network to the list of networks
+                        st = Stream(networkCode, stationCode, locationCode,
+                                    streamCode)
+                        tw = TW(startD, endD)
+                        result.append((st, Route(service, address, tw, priority)))
+                        serv.clear()
+
+                    route.clear()
+
+                elif route.tag == namesp + 'vnetwork':
+                    # Virtual network in the same pass
+                    vnet = route
+                    # Extract the network code
+                    try:
+                        vnCode = vnet.get('networkCode')
+                        if len(vnCode) == 0:
+                            vnCode = None
+                    except Exception:
+                        vnCode = None
+
+                    # Traverse through the sources
+                    for stream in vnet:
+                        # Extract the networkCode
+                        msg = 'Only the * wildcard is allowed in virtual nets.'
+                        try:
+                            net = stream.get('networkCode')
+                            if (('?' in net) or
+                                    (('*' in net) and (len(net) > 1))):
+                                vnlogs.warning(msg)
+                                continue
+                        except Exception:
+                            net = '*'
+
+                        # Extract the stationCode
+                        try:
+                            sta = stream.get('stationCode')
+                            if (('?' in sta) or
+                                    (('*' in sta) and (len(sta) > 1))):
+                                vnlogs.warning(msg)
+                                continue
+                        except Exception:
+                            sta = '*'
+
+                        # Extract the locationCode
+                        try:
+                            loc = stream.get('locationCode')
+                            if (('?' in loc) or
+                                    (('*' in loc) and (len(loc) > 1))):
+                                vnlogs.warning(msg)
+                                continue
+                        except Exception:
+                            loc = '*'
+
+                        # Extract the streamCode
+                        try:
+                            cha = stream.get('streamCode')
+                            if (('?' in cha) or
+                                    (('*' in cha) and (len(cha) > 1))):
+                                vnlogs.warning(msg)
+                                continue
+                        except Exception:
+                            cha = '*'
+
+                        try:
+                            auxStart = stream.get('start', None)
+                            startD = str2date(auxStart)
+                        except Exception:
+                            startD = None
+                            msg = 'Error while converting START attribute.\n'
+                            vnlogs.warning(msg)
+
+                        try:
+                            auxEnd = stream.get('end', None)
+                            endD = str2date(auxEnd)
+                        except Exception:
+                            endD = None
+                            msg = 'Error while converting END attribute.\n'
+                            vnlogs.warning(msg)
+
+                        vnets.append((vnCode, Stream(net, sta, loc, cha),
+                                      TW(startD, endD)))
+
+                        stream.clear()
+
+                    vnet.clear()
+
+                root.clear()
+
+    return result, vnets
@@ -2,6 +2,9 @@
 
 """Retrieve data from a Routing WS (or Arclink server) to be used locally
 
+With the command ``compile`` the routing files already downloaded are
+compiled without contacting any server and a report in JSON format is printed.
+
 This program is free software: you can redistribute it and/or modify
 it under the terms of the GNU General Public License as published by
 the Free Software Foundation, either version 3 of the License, or
@@ -23,7 +26,6 @@ import sys
 import argparse
 import logging
 import configparser
-import pickle
 import json
 import datetime
 from pprint import pprint
@@ -32,9 +34,8 @@ from urllib.parse import urlparse
 sys.path.append('..')
 
 try:
-    from routeutils.utils import addremote
-    from routeutils.utils import addroutes
-    from routeutils.utils import addvirtualnets
+    from routeutils.utils import addremotes
+    from routeutils.utils import RoutingTransaction
     from routeutils.utils import cachestations
     from routeutils.utils import Route
     from routeutils.utils import RoutingCache
@@ -43,15 +44,42 @@ try:
     from routeutils.utils import TW
     from routeutils.utils import Stream
     from routeutils.utils import replacelast
+    from routeutils.utils import savecompiled
+    from routeutils.utils import routingreport
+    from routeutils.timing import PhaseTimer
+    from routeutils.fragments import FragmentCache
+    from routeutils.stationws import StationCache
 except Exception:
     raise
 
 
-def mergeRoutes(fileroutes: str, synchrolist: str, allowOverlaps: bool = False):
+def mergeRoutes(fileroutes: str, synchrolist: str, allowOverlaps: bool = False, storage: str = 'artifact',
+                cachedir: str = 'cache', full: bool = False, workers: int = 4, timeout: float = 60,
+                stationttl: float = 86400, stationmaxage: float = 7 * 86400, parseworkers: int = 4,
+                generations: int = 3):
     """Retrieve routes from different sources and merge them with the local
 ones in the routing tables. The configuration file is checked to see whether
-overlapping routes are allowed or not. A pickled version of the routing
-table is saved under the same filename plus ``.bin`` (e.g. routing.xml.bin).
+overlapping routes are allowed or not. A compiled version of the routing
+table (see :mod:`routeutils.artifact` and :mod:`routeutils.sqlitestore`) is
+published as a new generation under the same filename plus ``.bin`` (e.g.
+routing.xml.bin, see :mod:`routeutils.generations`).
+
+Every source is parsed only if its content changed since the last run (see
+:mod:`routeutils.fragments`). The stations are kept between runs and only
+the changes are requested to the station-WS (see
+:class:`routeutils.stationws.StationCache`).
+
+The files of the remote data centres are downloaded in parallel (see
+:func:`~routeutils.utils.addremotes`).
+
+The files which changed are parsed in parallel by a pool of processes (see
+:meth:`~routeutils.fragments.FragmentCache.prefetch`) and merged afterwards in
+the order given by *synchrolist*.
+
+All the routes of a data centre are checked before modifying the routing
+table (see :class:`~routeutils.utils.RoutingTransaction`). If the file cannot
+be parsed or its routes cannot be added, the version parsed in the last run
+is used (see :meth:`~routeutils.fragments.FragmentCache.previous`).
 
 :param fileroutes: File containing the local routing table. Based on this name the JSON file containing the data centre information is derived.
 :type fileroutes: str
@@ -59,17 +87,33 @@ table is saved under the same filename plus ``.bin`` (e.g. routing.xml.bin).
 :type synchrolist: str
 :param allowOverlaps: Specify if overlapping streams should be allowed or not
 :type allowOverlaps: bool
+:param storage: Format of the compiled routing table ('artifact' or 'sqlite')
+:type storage: str
+:param cachedir: Directory with the sources already parsed
+:type cachedir: str
+:param full: Parse all sources and query all station-WS again
+:type full: bool
+:param workers: Maximum number of remote data centres contacted at the same time
+:type workers: int
+:param timeout: Timeout in seconds of the connections to every remote data centre
+:type timeout: float
+:param stationttl: Seconds during which the stations of a query are not requested again
+:type stationttl: float
+:param stationmaxage: Seconds after which all stations of a query are requested again (not only the changes)
+:type stationmaxage: float
+:param parseworkers: Maximum number of routing files parsed at the same time (in different processes)
+:type parseworkers: int
+:param generations: Number of generations of the compiled routing table kept (see :mod:`routeutils.generations`)
+:type generations: int
 
 """
 
     logs = logging.getLogger('mergeRoutes')
     logs.info('Synchronizing with: %s' % synchrolist)
 
-    ptRT = addroutes(fileroutes, allowOverlaps=allowOverlaps)
-    ptVN = addvirtualnets(fileroutes)
-    eidaDCs = list()
-    eidaDCs.append(json.load(open(replacelast(fileroutes, '.xml', '.json'))))
+    fragments = FragmentCache(cachedir, full=full)
 
+    sources = list()
     for line in synchrolist.splitlines():
         if not len(line):
             break
@@ -84,50 +128,148 @@ table is saved under the same filename plus ``.bin`` (e.g. routing.xml.bin).
                       % (dcid, dcid)
                 logs.error(msg)
                 raise Exception('File must be called "routing-%s.xml"' % dcid)
-        else:
+        sources.append((dcid, url, parts.scheme not in ('file', '')))
+
+    # Download the files of all remote data centres at the same time
+    failures = addremotes(dict((dcid.strip(), url) for dcid, url, remote in sources if remote),
+                          workers=workers, timeout=timeout)
+    for dcid, url, remote in sources:
+        if remote and failures[dcid.strip()] is not None:
+            msg = 'Failure updating routing information from %s (%s)' % \
+                  (dcid, url)
+            logs.error(msg)
+
+    # Parse at the same time all the files which changed. They are merged in order afterwards.
+    remotes = [(dcid.strip(), './routing-%s.xml' % dcid.strip()) for dcid, _, _ in sources]
+    timer = PhaseTimer()
+    with timer.phase('parse'):
+        fragments.prefetch([fileroutes] + [f for _, f in remotes if os.path.exists(f)], workers=parseworkers)
+
+    ptRT, ptVN, eidaDCs = mergeSources(fragments, fileroutes, remotes, allowOverlaps, timer)
+
+    with timer.phase('rules'):
+        checkRules(ptRT, eidaDCs)
+
+    # Stations from the previous runs. With a full rebuild all of them are requested again.
+    stationCache = StationCache(os.path.join(cachedir, 'stations.pickle'), ttl=0 if full else stationttl,
+                                maxage=0 if full else stationmaxage)
+    stationTable = dict()
+    with timer.phase('stations'):
+        cachestations(ptRT, stationTable, stationCache)
+
+    result = dict()
+    for dc in stationTable:
+        for st in stationTable[dc]:
             try:
-                addremote('./routing-%s.xml' % dcid.strip(), url.strip())
-                addremote('./routing-%s.json' % dcid.strip(), url.strip(), method='dc')
-            except Exception:
-                msg = 'Failure updating routing information from %s (%s)' % \
-                      (dcid, url)
-                logs.error(msg)
+                result[dc] += len(stationTable[dc][st])
+            except KeyError:
+                result[dc] = len(stationTable[dc][st])
+    pprint(result)
 
-        if os.path.exists('./routing-%s.xml' % dcid.strip()):
+    # If in DEBUG logging level
+    if logs.getEffectiveLevel() <= logging.DEBUG:
+        # pprint(ptRT)
+        pprint(ptVN)
+        pprint(eidaDCs)
+
+    # The routing table in use is only replaced when the new one is complete
+    with timer.phase('save'):
+        savecompiled('./%s.bin' % fileroutes, ptRT, stationTable, ptVN, eidaDCs, storage, generations)
+    fragments.commit()
+    stationCache.save()
+    logs.info('Routes in main Routing Table: %s\n' % len(ptRT))
+    logs.info('Stations cached: %s\n' %
+              sum([len(stationTable[dc][st]) for dc in stationTable
+                   for st in stationTable[dc]]))
+    logs.info('Virtual Networks defined: %s\n' % len(ptVN))
+    logs.info('Information from data centers: %s\n' % len(eidaDCs))
+    logs.info('Seconds per phase: %s' % ', '.join('%s %.2f' % ph for ph in timer.phases.items()))
+
+
+def mergeSources(fragments: FragmentCache, fileroutes: str, remotes: list, allowOverlaps: bool = False,
+                 timer: PhaseTimer = None) -> tuple:
+    """Merge the routes of the local routing file and of the remote data centres in this order.
+
+All the routes of a data centre are checked before modifying the routing
+table. If its file cannot be parsed or its routes cannot be added, the
+version parsed in the last run (or its backup) is used.
+
+:param fragments: Routing files already parsed
+:type fragments: :class:`~routeutils.fragments.FragmentCache`
+:param fileroutes: File containing the local routing table
+:type fileroutes: str
+:param remotes: Pairs (data centre, routing file) of the remote data centres
+:type remotes: list
+:param allowOverlaps: Specify if overlapping streams should be allowed or not
+:type allowOverlaps: bool
+:param timer: Timer measuring the phases 'parse' and 'merge'
+:type timer: :class:`~routeutils.timing.PhaseTimer`
+:returns: Routing table, virtual networks and information of the data centres
+:rtype: tuple
+
+"""
+    logs = logging.getLogger('mergeRoutes')
+    if timer is None:
+        timer = PhaseTimer()
+
+    ptRT = dict()
+    ptVN = dict()
+    transaction = RoutingTransaction(ptRT, ptVN, allowOverlaps=allowOverlaps)
+    with timer.phase('parse'):
+        local = fragments.get(fileroutes)
+    with timer.phase('merge'):
+        transaction.stage(local.routes, local.vnets, filename=fileroutes)
+        transaction.commit()
+    eidaDCs = list()
+    eidaDCs.append(json.load(open(replacelast(fileroutes, '.xml', '.json'))))
+
+    for dcid, remoteFile in remotes:
+        if os.path.exists(remoteFile):
             # FIXME addroutes should return no Exception ever and skip a
             # problematic file returning a coherent version of the routes
-            print('Adding REMOTE %s' % dcid)
+            logs.info('Adding REMOTE %s' % dcid)
             try:
-                # Do a dryrun first to validate tha tall modifications can be done
-                addroutes('./routing-%s.xml' % dcid.strip(), dryrun=True,
-                          routingtable=ptRT, allowOverlaps=allowOverlaps)
-                addvirtualnets('./routing-%s.xml' % dcid.strip(), dryrun=True,
-                               vnTable=ptVN)
-                # Do the real update
-                ptRT = addroutes('./routing-%s.xml' % dcid.strip(),
-                                 routingtable=ptRT, allowOverlaps=allowOverlaps)
-                ptVN = addvirtualnets('./routing-%s.xml' % dcid.strip(),
-                                      vnTable=ptVN)
-            except Exception:
-                msg = 'Failure updating routing information from %s. Recovering from backup.' % (dcid,)
+                # The file is parsed once and all its routes are checked before modifying the tables
+                with timer.phase('parse'):
+                    remote = fragments.get(remoteFile)
+                with timer.phase('merge'):
+                    transaction.stage(remote.routes, remote.vnets, filename=remoteFile)
+                    transaction.commit()
+            except Exception as e:
+                transaction.discard()
+                msg = 'Failure updating routing information from %s (%s). Recovering from the last version.' % \
+                      (dcid, e)
                 logs.error(msg)
-                shutil.copy('./routing-%s.xml.bck' % dcid.strip(), './routing-%s.xml' % dcid.strip())
-                # Do the real update
-                ptRT = addroutes('./routing-%s.xml' % dcid.strip(),
-                                 routingtable=ptRT, allowOverlaps=allowOverlaps)
-                ptVN = addvirtualnets('./routing-%s.xml' % dcid.strip(),
-                                      vnTable=ptVN)
+                with timer.phase('parse'):
+                    remote = fragments.previous(remoteFile)
+                    if remote is None:
+                        # Nothing parsed in previous runs
+                        shutil.copy(remoteFile + '.bck', remoteFile)
+                        remote = fragments.get(remoteFile)
+                with timer.phase('merge'):
+                    transaction.stage(remote.routes, remote.vnets, filename=remoteFile)
+                    transaction.commit()
 
-        if os.path.exists('./routing-%s.json' % dcid.strip()):
-            print('Adding REMOTE data center information from %s' % dcid)
-            eidaDCs.append(json.load(open('./routing-%s.json' % dcid.strip())))
+        dcFile = replacelast(remoteFile, '.xml', '.json')
+        if os.path.exists(dcFile):
+            logs.info('Adding REMOTE data center information from %s' % dcid)
+            eidaDCs.append(json.load(open(dcFile)))
 
-    try:
-        os.remove('./%s.bin' % fileroutes)
-    except Exception:
-        pass
+    return ptRT, ptVN, eidaDCs
+
+
+def checkRules(ptRT: dict, eidaDCs: list):
+    """Check that the FDSNRules object can be created from the routing table.
+
+:param ptRT: Routing table
+:type ptRT: dict
+:param eidaDCs: Information about the data centres
+:type eidaDCs: list
+:raises Exception: If the routes cannot be exported in the FDSN format
+
+"""
+    logs = logging.getLogger('mergeRoutes')
 
-    # Check that the FDSNRules object can be created
     rm = RequestMerge()
     for st, routes in ptRT.items():
         for ro in routes:
@@ -147,32 +289,84 @@ table is saved under the same filename plus ``.bin`` (e.g. routing.xml.bin).
             if 'datasets' in repo:
                 logs.info('%s %s: %d datasets' % (dc['name'], repo['name'], len(repo['datasets'])))
 
-    stationTable = dict()
-    cachestations(ptRT, stationTable)
 
-    result = dict()
-    for dc in stationTable:
-        for st in stationTable[dc]:
-            try:
-                result[dc] += len(stationTable[dc][st])
-            except KeyError:
-                result[dc] = len(stationTable[dc][st])
-    pprint(result)
+def compileRoutes(sources: list, binfile: str = None, allowOverlaps: bool = False, storage: str = 'artifact',
+                  cachedir: str = 'cache', full: bool = False, parseworkers: int = 4, generations: int = 3) -> dict:
+    """Compile the routing files already downloaded and return a report of the routing table.
 
-    # If in DEBUG logging level
-    if logs.getEffectiveLevel() <= logging.DEBUG:
-        # pprint(ptRT)
-        pprint(ptVN)
-        pprint(eidaDCs)
+Nothing is downloaded. The routing files are merged in the order given and
+the stations are taken only from the cache of the previous runs of
+updateAll.py (see :class:`routeutils.stationws.StationCache`). A new
+generation of the compiled routing table is published as in
+:func:`mergeRoutes`.
+
+The report includes the statistics of :func:`~routeutils.utils.routingreport`,
+the sources merged, the generation published and the seconds spent in every
+phase (parse, merge, rules, stations and save).
+
+:param sources: Routing files in XML format. The first one is the local one and the rest are called routing-<DC>.xml
+:type sources: list
+:param binfile: File to create (by default the first source plus ``.bin``)
+:type binfile: str
+:param allowOverlaps: Specify if overlapping streams should be allowed or not
+:type allowOverlaps: bool
+:param storage: Format of the compiled routing table ('artifact' or 'sqlite')
+:type storage: str
+:param cachedir: Directory with the sources already parsed and the stations
+:type cachedir: str
+:param full: Parse all sources again
+:type full: bool
+:param parseworkers: Maximum number of routing files parsed at the same time (in different processes)
+:type parseworkers: int
+:param generations: Number of generations of the compiled routing table kept (see :mod:`routeutils.generations`)
+:type generations: int
+:returns: Report which can be serialised as JSON
+:rtype: dict
+
+"""
+    fileroutes = sources[0]
+    if binfile is None:
+        binfile = fileroutes + '.bin'
+
+    remotes = list()
+    for filename in sources[1:]:
+        dcid = os.path.basename(filename)
+        if dcid.startswith('routing-') and dcid.endswith('.xml'):
+            dcid = dcid[len('routing-'):-len('.xml')]
+        remotes.append((dcid, filename))
+
+    timer = PhaseTimer()
+    fragments = FragmentCache(cachedir, full=full)
+    with timer.phase('parse'):
+        fragments.prefetch([f for f in sources if os.path.exists(f)], workers=parseworkers)
 
-    with open('./%s.bin' % fileroutes, 'wb') as finalRoutes:
-        pickle.dump((ptRT, stationTable, ptVN, eidaDCs), finalRoutes)
-        logs.info('Routes in main Routing Table: %s\n' % len(ptRT))
-        logs.info('Stations cached: %s\n' %
-                  sum([len(stationTable[dc][st]) for dc in stationTable
-                       for st in stationTable[dc]]))
-        logs.info('Virtual Networks defined: %s\n' % len(ptVN))
-        logs.info('Information from data centers: %s\n' % len(eidaDCs))
+    ptRT, ptVN, eidaDCs = mergeSources(fragments, fileroutes, remotes, allowOverlaps, timer)
+
+    with timer.phase('rules'):
+        checkRules(ptRT, eidaDCs)
+
+    # Only the stations cached. No query is sent.
+    stationCache = StationCache(os.path.join(cachedir, 'stations.pickle'), offline=True)
+    stationTable = dict()
+    with timer.phase('stations'):
+        cachestations(ptRT, stationTable, stationCache)
+
+    with timer.phase('save'):
+        entry = savecompiled(binfile, ptRT, stationTable, ptVN, eidaDCs, storage, generations)
+    fragments.commit()
+
+    report = routingreport(ptRT, stationTable, ptVN)
+    report['output'] = binfile
+    report['storage'] = storage
+    report['generation'] = entry['generation']
+    report['checksum'] = entry['checksum']
+    report['sources'] = [{'file': f, 'sha1': e['sha1'], 'parsed': f in fragments.changed}
+                         for f, e in fragments.used.items()]
+    report['datacenters'] = [dc.get('name') for dc in eidaDCs]
+    report['stationqueries'] = dict(stationCache.counters)
+    report['phases'] = dict((name, round(seconds, 6)) for name, seconds in timer.phases.items())
+    report['seconds'] = round(timer.total(), 6)
+    return report
 
 
 def main():
@@ -187,6 +381,24 @@ def main():
     parser.add_argument('-c', '--config',
                         help='Config file to use.',
                         default='../routing.cfg')
+    parser.add_argument('--cache',
+                        help='Directory with the sources already parsed.',
+                        default='cache')
+    parser.add_argument('--full', action='store_true',
+                        help='Parse all sources and request all stations again.')
+    subparsers = parser.add_subparsers(dest='command', title='commands',
+                                       description='Without a command the routing information is updated.')
+    compileParser = subparsers.add_parser('compile', help='Compile the routing files already downloaded and print '
+                                                          'a report in JSON format.')
+    compileParser.add_argument('sources', nargs='*',
+                               help='Routing files merged in this order. The first one is the local one. '
+                                    'By default routing.xml and routing-<DC>.xml of the data centres to synchronize.')
+    compileParser.add_argument('-o', '--output', default=None,
+                               help='Compiled routing table (default: first source plus .bin).')
+    compileParser.add_argument('-r', '--report', default='-',
+                               help='File where the report is saved (default: standard output).')
+    compileParser.add_argument('--storage', choices=['artifact', 'sqlite'], default=None,
+                               help='Format of the compiled routing table (default: from the config file).')
     args = parser.parse_args()
 
     config = configparser.RawConfigParser()
@@ -210,14 +422,6 @@ def main():
     if not len(config.read(args.config)):
         logs.error('Configuration file %s could not be read' % args.config)
 
-    print('Skipping routing information. Config file does not allow to '
-          + 'overwrite the information. (%s)' % args.config)
-
-    try:
-        os.remove('routing-tmp.xml.bin')
-    except Exception:
-        pass
-
     # Otherwise, default value
     synchroList = ''
     try:
@@ -226,7 +430,45 @@ def main():
     except Exception:
         pass
 
-    mergeRoutes('routing.xml', synchroList)
+    storage = config.get('Service', 'storage', fallback='artifact')
+    workers = config.getint('Service', 'synchronizeworkers', fallback=4)
+    timeout = config.getfloat('Service', 'synchronizetimeout', fallback=60)
+    stationttl = config.getfloat('Service', 'stationcachettl', fallback=86400)
+    stationmaxage = config.getfloat('Service', 'stationcachemaxage', fallback=7 * 86400)
+    parseworkers = config.getint('Service', 'parseworkers', fallback=4)
+    generations = config.getint('Service', 'generations', fallback=3)
+    allowOverlaps = config.getboolean('Service', 'allowoverlap', fallback=False)
+
+    if args.command == 'compile':
+        sources = args.sources
+        if not len(sources):
+            sources = ['routing.xml']
+            for line in synchroList.splitlines():
+                if not len(line):
+                    break
+                sources.append('./routing-%s.xml' % line.split(',')[0].strip())
+
+        report = compileRoutes(sources, args.output, allowOverlaps, args.storage or storage,
+                               cachedir=args.cache, full=args.full, parseworkers=parseworkers, generations=generations)
+        if args.report == '-':
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.report, 'w') as fout:
+                json.dump(report, fout, indent=2)
+        return
+
+    print('Skipping routing information. Config file does not allow to '
+          + 'overwrite the information. (%s)' % args.config)
+
+    try:
+        os.remove('routing-tmp.xml.bin')
+    except Exception:
+        pass
+
+    mergeRoutes('routing.xml', synchroList, allowOverlaps, storage=storage, cachedir=args.cache, full=args.full,
+                workers=workers, timeout=timeout, stationttl=stationttl, stationmaxage=stationmaxage,
+                parseworkers=parseworkers, generations=generations)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+
+"""Compiled routing table which can be memory-mapped by many processes
+
+The routing table, the station cache, the virtual networks and the data
+centre information are saved in a versioned binary file. The file contains a
+header, a directory of sections and the sections themselves. Routes and
+stations are stored as fixed-width records which refer to a table of strings,
+so that they can be decoded only when they are needed, directly from a
+read-only memory map shared by all the worker processes.
+
+Layout of the file (little endian)::
+
+    header     magic (8s) | version (I) | number of sections (I) | SHA-1 (20s) | reserved (4x)
+    directory  offset (Q) | size (Q) | records (Q)   (one per section)
+    sections   strings offsets, strings data, streams, routes, groups,
+               stations, metadata (JSON)
+
+The SHA-1 checksum covers everything after the header.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import json
+import mmap
+import struct
+import hashlib
+import datetime
+from collections.abc import Mapping
+from typing import List, Union
+from .utils import Stream
+from .utils import TW
+from .utils import Route
+from .utils import Station
+
+MAGIC = b'EIDARTBL'
+VERSION = 1
+
+_header = struct.Struct('<8sII20s4x')
+_section = struct.Struct('<QQQ')
+_offset = struct.Struct('<I')
+# n, s, l, c, first route, number of routes
+_stream = struct.Struct('<IIIIII')
+# service, address, start, end, priority
+_route = struct.Struct('<IIqqi4x')
+# netloc, n, s, l, c, first station, number of stations
+_group = struct.Struct('<IIIIIII')
+# name, latitude, longitude, start, end
+_station = struct.Struct('<I4xddqq')
+
+# Order of the sections in the directory
+STROFFSETS, STRDATA, STREAMS, ROUTES, GROUPS, STATIONS, METADATA = range(7)
+NUMSECTIONS = 7
+
+# Datetimes are saved as microseconds since the epoch. None is saved as NODATE.
+EPOCH = datetime.datetime(1970, 1, 1)
+NODATE = -2 ** 63
+# Routes without priority
+NOPRIORITY = -2 ** 31
+
+
+def date2int(dt: Union[datetime.datetime, None]) -> int:
+    """Convert a (naive) datetime to the integer saved in the file."""
+    if dt is None:
+        return NODATE
+    if dt.tzinfo is not None:
+        raise ValueError('Only naive datetimes can be saved (%s)' % dt)
+    return (dt - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def int2date(value: int) -> Union[datetime.datetime, None]:
+    """Convert an integer read from the file to a datetime."""
+    if value == NODATE:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=value)
+
+
+def isartifact(filename: str) -> bool:
+    """Check whether a file is a compiled routing table in this format."""
+    with open(filename, 'rb') as fin:
+        return fin.read(len(MAGIC)) == MAGIC
+
+
+def artifactdigest(filename: str) -> Union[str, None]:
+    """Return the checksum of the content saved in the header of a compiled routing table.
+
+    Only the header is read. None is returned if the file is not in this format.
+    """
+    with open(filename, 'rb') as fin:
+        header = fin.read(_header.size)
+    if len(header) < _header.size:
+        return None
+    magic, version, numsections, checksum = _header.unpack(header)
+    return checksum.hex() if magic == MAGIC else None
+
+
+class _StringTable(object):
+    """Assign a number to each different string while writing an artifact."""
+
+    def __init__(self):
+        self.ids = dict()
+        self.offsets = bytearray()
+        self.data = bytearray()
+
+    def __call__(self, s: str) -> int:
+        try:
+            return self.ids[s]
+        except KeyError:
+            pass
+        self.ids[s] = len(self.ids)
+        self.offsets.extend(_offset.pack(len(self.data)))
+        self.data.extend(s.encode('utf-8'))
+        return self.ids[s]
+
+    def finish(self) -> bytes:
+        return bytes(self.offsets + _offset.pack(len(self.data)))
+
+
+def writeartifact(filename: str, routingtable: dict, stationtable: dict, vntable: dict, eidadcs: list):
+    """Save the routing information in a compiled file.
+
+    The file is written under a temporary name, synced to disk and renamed at
+    the end, so that processes which have the previous version mapped in memory
+    are not affected.
+
+    :param filename: Name of the file to create
+    :type filename: str
+    :param routingtable: Routes indexed by :class:`~routeutils.utils.Stream`
+    :type routingtable: dict
+    :param stationtable: Cache of stations indexed by netloc and :class:`~routeutils.utils.Stream`
+    :type stationtable: dict
+    :param vntable: Virtual networks
+    :type vntable: dict
+    :param eidadcs: Information about the data centres
+    :type eidadcs: list
+    """
+    strings = _StringTable()
+
+    streams = bytearray()
+    routes = bytearray()
+    numroutes = 0
+    for st, lr in routingtable.items():
+        streams.extend(_stream.pack(strings(st.n), strings(st.s), strings(st.l), strings(st.c),
+                                    numroutes, len(lr)))
+        for ro in lr:
+            routes.extend(_route.pack(strings(ro.service), strings(ro.address), date2int(ro.tw.start),
+                                      date2int(ro.tw.end), ro.priority if ro.priority is not None else NOPRIORITY))
+        numroutes += len(lr)
+
+    groups = bytearray()
+    stations = bytearray()
+    numgroups = 0
+    numstations = 0
+    # The same list of stations is usually shared by many data centres
+    saved = dict()
+    for netloc, dcst in stationtable.items():
+        for st, lsta in dcst.items():
+            try:
+                first, count = saved[id(lsta)]
+            except KeyError:
+                first, count = numstations, len(lsta)
+                saved[id(lsta)] = (first, count)
+                for sta in lsta:
+                    stations.extend(_station.pack(strings(sta.name), sta.latitude, sta.longitude,
+                                                  date2int(sta.start), date2int(sta.end)))
+                numstations += count
+            groups.extend(_group.pack(strings(netloc), strings(st.n), strings(st.s), strings(st.l),
+                                      strings(st.c), first, count))
+            numgroups += 1
+
+    vnets = [[code, [[st.n, st.s, st.l, st.c, date2int(tw.start), date2int(tw.end)] for st, tw in lst]]
+             for code, lst in vntable.items()]
+    metadata = json.dumps({'vnets': vnets, 'eidadcs': eidadcs}).encode('utf-8')
+
+    numstrings = len(strings.ids)
+    sections = [(strings.finish(), numstrings), (bytes(strings.data), numstrings),
+                (bytes(streams), len(routingtable)), (bytes(routes), numroutes),
+                (bytes(groups), numgroups), (bytes(stations), numstations), (metadata, 1)]
+
+    directory = bytearray()
+    offset = _header.size + _section.size * len(sections)
+    for data, records in sections:
+        directory.extend(_section.pack(offset, len(data), records))
+        offset += len(data)
+
+    checksum = hashlib.sha1(directory)
+    for data, records in sections:
+        checksum.update(data)
+
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as fout:
+        fout.write(_header.pack(MAGIC, VERSION, len(sections), checksum.digest()))
+        fout.write(directory)
+        for data, records in sections:
+            fout.write(data)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmpfile, filename)
+
+
+class _Records(object):
+    """Decode routes and stations from the memory map.
+
+    Kept apart from :class:`RoutingArtifact` so that the tables do not refer
+    back to it. Without reference cycles the memory map is released as soon as
+    the last table is not used, even if the objects were frozen (gc.freeze).
+    """
+
+    def __init__(self, mm: mmap.mmap, strings: List[str], routes: int, stations: int):
+        self.mm = mm
+        self.strings = strings
+        # Offsets of the sections with routes and stations
+        self.routesOffset = routes
+        self.stationsOffset = stations
+        # (first, count) of the routes of each stream
+        self.routeIndex = list()
+
+    def routes(self, pos: int) -> List[Route]:
+        """Decode the routes of the stream in the given position."""
+        first, count = self.routeIndex[pos]
+        base = self.routesOffset + first * _route.size
+        s = self.strings
+        result = list()
+        for i in range(count):
+            service, address, start, end, priority = _route.unpack_from(self.mm, base + i * _route.size)
+            result.append(Route(s[service], s[address], TW(int2date(start), int2date(end)),
+                                priority if priority != NOPRIORITY else None))
+        return result
+
+    def stations(self, first: int, count: int) -> List[Station]:
+        """Decode a number of stations starting at the given position."""
+        base = self.stationsOffset + first * _station.size
+        s = self.strings
+        result = list()
+        for i in range(count):
+            name, lat, lon, start, end = _station.unpack_from(self.mm, base + i * _station.size)
+            result.append(Station(s[name], lat, lon, int2date(start), int2date(end)))
+        return result
+
+
+class _RouteTable(Mapping):
+    """Routes indexed by Stream decoded from the memory map when requested."""
+
+    def __init__(self, records: _Records, streams: List[Stream], index: dict):
+        self.records = records
+        self.streams = streams
+        self.index = index
+
+    def __getitem__(self, stream: Stream) -> List[Route]:
+        return self.records.routes(self.index[stream])
+
+    def __contains__(self, stream) -> bool:
+        return stream in self.index
+
+    def __iter__(self):
+        return iter(self.streams)
+
+    def __len__(self) -> int:
+        return len(self.streams)
+
+
+class _StationGroup(Mapping):
+    """Stations of one data centre indexed by Stream decoded from the memory map when requested."""
+
+    def __init__(self, records: _Records):
+        self.records = records
+        # (first, count) of the stations of each Stream
+        self.index = dict()
+
+    def __getitem__(self, stream: Stream) -> List[Station]:
+        return self.records.stations(*self.index[stream])
+
+    def __contains__(self, stream) -> bool:
+        return stream in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class RoutingArtifact(object):
+    """Read-only view of a compiled routing table mapped in memory.
+
+    Only the strings, the streams and the indexes are decoded when the file is
+    opened. Routes and stations are decoded from the memory map every time they
+    are requested, so that the pages are shared by all processes using the
+    same file.
+
+    :platform: Linux
+
+    """
+
+    def __init__(self, filename: str, verify: bool = True):
+        """Constructor of RoutingArtifact.
+
+        :param filename: Compiled routing table
+        :type filename: str
+        :param verify: Check the checksum of the file
+        :type verify: bool
+        :raises: ValueError if the file is not valid
+        """
+        self.filename = filename
+        with open(filename, 'rb') as fin:
+            self.mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self._read(verify)
+        except Exception:
+            self.mm.close()
+            raise
+
+    def _read(self, verify: bool):
+        mm = self.mm
+        if len(mm) < _header.size:
+            raise ValueError('%s is too short' % self.filename)
+        magic, version, numsections, checksum = _header.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a compiled routing table' % self.filename)
+        if version != VERSION:
+            raise ValueError('Version %d of %s is not supported' % (version, self.filename))
+        if numsections != NUMSECTIONS:
+            raise ValueError('Wrong number of sections in %s' % self.filename)
+
+        self.checksum = checksum.hex()
+        if verify:
+            with memoryview(mm) as buf:
+                if hashlib.sha1(buf[_header.size:]).digest() != checksum:
+                    raise ValueError('Wrong checksum in %s' % self.filename)
+
+        self.sections = [_section.unpack_from(mm, _header.size + _section.size * i) for i in range(numsections)]
+        for offset, size, records in self.sections:
+            if offset + size > len(mm):
+                raise ValueError('%s is truncated' % self.filename)
+
+        # Strings
+        offset, size, numstrings = self.sections[STROFFSETS]
+        offsets = [x[0] for x in _offset.iter_unpack(mm[offset:offset + size])]
+        data = mm[self.sections[STRDATA][0]:self.sections[STRDATA][0] + self.sections[STRDATA][1]]
+        self.strings = [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(numstrings)]
+
+        s = self.strings
+        self.records = _Records(mm, s, self.sections[ROUTES][0], self.sections[STATIONS][0])
+
+        # Streams and position of their routes
+        offset, size, numstreams = self.sections[STREAMS]
+        streams = list()
+        index = dict()
+        for pos, (n, sta, loc, cha, first, count) in enumerate(_stream.iter_unpack(mm[offset:offset + size])):
+            st = Stream(s[n], s[sta], s[loc], s[cha])
+            streams.append(st)
+            self.records.routeIndex.append((first, count))
+            index[st] = pos
+        self.routingTable = _RouteTable(self.records, streams, index)
+
+        # Stations indexed by netloc and Stream
+        offset, size, numgroups = self.sections[GROUPS]
+        self.stationTable = dict()
+        self.numStations = 0
+        for netloc, n, sta, loc, cha, first, count in _group.iter_unpack(mm[offset:offset + size]):
+            try:
+                group = self.stationTable[s[netloc]]
+            except KeyError:
+                group = _StationGroup(self.records)
+                self.stationTable[s[netloc]] = group
+            group.index[Stream(s[n], s[sta], s[loc], s[cha])] = (first, count)
+            self.numStations += count
+
+        # Virtual networks and data centres
+        offset, size, records = self.sections[METADATA]
+        metadata = json.loads(mm[offset:offset + size].decode('utf-8'))
+        self.vnTable = dict()
+        for code, lst in metadata['vnets']:
+            self.vnTable[code] = [(Stream(n, sta, loc, cha), TW(int2date(start), int2date(end)))
+                                  for n, sta, loc, cha, start, end in lst]
+        self.eidaDCs = metadata['eidadcs']
+
+    def routes(self, pos: int) -> List[Route]:
+        """Decode the routes of the stream in the given position."""
+        return self.records.routes(pos)
+
+    def stations(self, first: int, count: int) -> List[Station]:
+        """Decode a number of stations starting at the given position."""
+        return self.records.stations(first, count)
+
+    def stats(self) -> dict:
+        """Return the number of streams, routes, stations and virtual networks without decoding them."""
+        return {'streams': self.sections[STREAMS][2],
+                'routes': self.sections[ROUTES][2],
+                'stations': self.numStations,
+                'vnets': len(self.vnTable)}
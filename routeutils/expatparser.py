@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""Fast parser of routing files based on expat
+
+The routes and the virtual networks are created directly from the events of
+the expat parser. No Element objects are built. Only the attributes of the
+services of a route (or the streams of a virtual network) are kept until the
+route (or virtual network) is closed. The checks of every route and stream are
+the same as in the previous parser based on ElementTree (bench/parserET.py).
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import logging
+from typing import BinaryIO
+from xml.parsers import expat
+from xml.etree.ElementTree import ParseError
+from .utils import Stream
+from .utils import Route
+from .utils import TW
+from .utils import str2date
+
+# Separator used by expat between the namespace and the local name
+NSSEP = '}'
+
+
+class RoutingHandler(object):
+    """Handler of the expat events of a routing file
+
+    After :meth:`parse` the routes are in :attr:`routes` and the virtual
+    networks in :attr:`vnets`, as returned by :func:`~routeutils.utils.parserouting`.
+    :attr:`root` is None if the root element could not be read.
+
+    :param filename: Name of the file parsed (only used in the messages)
+    :type filename: str
+    """
+
+    def __init__(self, filename: str = ''):
+        self.logs = logging.getLogger('addroutes')
+        self.vnlogs = logging.getLogger('addvirtualnets')
+        self.filename = filename
+
+        # Names as given by expat (namespace}name)
+        self.root = None
+        self.namesp = ''
+
+        self.routes = list()
+        self.vnets = list()
+        # Name of the service indexed by the name of its element
+        self.services = dict()
+
+    def service(self, tag: str) -> str:
+        """Return the name of the service of an element inside a route."""
+        try:
+            return self.services[tag]
+        except KeyError:
+            pass
+
+        namesp = self.namesp
+        assert tag[:len(namesp)] == namesp
+
+        service = tag[len(namesp):]
+        # Namespace of the service but not of the root
+        if NSSEP in service:
+            service = '{' + service
+        self.services[tag] = service
+        return service
+
+    def parse(self, fin: BinaryIO):
+        """Parse a routing file opened in binary mode.
+
+        :param fin: Routing file
+        :type fin: file
+        :returns: Routes and virtual networks found
+        :rtype: tuple
+        :raises ParseError: If the file is not well formed (as ElementTree does)
+        :raises Exception: If it is not a routing file
+        """
+        # Open elements. Only routes and virtual networks keep their
+        # attributes and children as (attributes, children).
+        stack = list()
+        push = stack.append
+        pop = stack.pop
+        tags = dict()
+
+        def start(name, attrib):
+            if stack:
+                top = stack[-1]
+                if top is not None:
+                    top[1].append((name, attrib))
+                push((attrib, list()) if name in tags else None)
+                return
+
+            # Root element
+            self.root = name
+            # Check that it is really an inventory
+            if name[-len('routing'):] != 'routing':
+                msg = '%s seems not to be a routing file (XML). Skipping it!\n' % self.filename
+                self.logs.error(msg)
+                raise Exception(msg)
+
+            # Extract the namespace from the root node
+            self.namesp = name[:-len('routing')]
+            tags[self.namesp + 'route'] = self.route
+            tags[self.namesp + 'vnetwork'] = self.vnetwork
+            push(None)
+
+        def end(name):
+            top = pop()
+            if top is not None:
+                tags[name](*top)
+
+        parser = expat.ParserCreate(namespace_separator=NSSEP)
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        try:
+            parser.ParseFile(fin)
+        except expat.ExpatError as e:
+            err = ParseError(str(e))
+            err.code = e.code
+            err.position = (e.lineno, e.offset)
+            raise err from None
+        return self.routes, self.vnets
+
+    def route(self, attrib: dict, services: list):
+        """Append the routes of a route element and its services."""
+        logs = self.logs
+        append = self.routes.append
+
+        codes = list()
+        for key in ('networkCode', 'stationCode', 'locationCode', 'streamCode'):
+            code = attrib.get(key, '*')
+            if len(code) == 0:
+                code = '*'
+
+            # Do not allow "?" wildcard in the input, because it
+            # will be impossible to match with the user input if
+            # this also has a mixture of "*" and "?"
+            if '?' in code:
+                logs.error('Wildcard "?" is not allowed!')
+                return
+            codes.append(code)
+
+        st = Stream(*codes)
+
+        # Traverse through the sources
+        for tag, att in services:
+            service = self.service(tag)
+
+            # Extract the address (mandatory)
+            address = att.get('address')
+            if not address:
+                logs.error('Could not add %s' % att)
+                continue
+
+            try:
+                startD = str2date(att.get('start', None))
+            except Exception:
+                startD = None
+
+            # Extract the end datetime
+            try:
+                endD = str2date(att.get('end', None))
+            except Exception:
+                endD = None
+
+            # Check that the time window is reasonable
+            if (startD is not None) and (endD is not None) and (startD > endD):
+                logs.error('Starttime is later than the endtime! %s.%s %s %s' % (st.n, st.s, startD, endD))
+                continue
+
+            # Extract the priority
+            try:
+                priority = att.get('priority', '99')
+                priority = int(priority) if len(priority) else 99
+            except Exception:
+                priority = 99
+
+            append((st, Route(service, address, TW(startD, endD), priority)))
+
+    def vnetwork(self, attrib: dict, streams: list):
+        """Append the streams of a virtual network."""
+        vnlogs = self.vnlogs
+
+        vnCode = attrib.get('networkCode') or None
+
+        msg = 'Only the * wildcard is allowed in virtual nets.'
+        for tag, att in streams:
+            codes = list()
+            for key in ('networkCode', 'stationCode', 'locationCode', 'streamCode'):
+                code = att.get(key)
+                if code is None:
+                    code = '*'
+                elif ('?' in code) or (('*' in code) and (len(code) > 1)):
+                    vnlogs.warning(msg)
+                    break
+                codes.append(code)
+            else:
+                try:
+                    startD = str2date(att.get('start', None))
+                except Exception:
+                    startD = None
+                    vnlogs.warning('Error while converting START attribute.\n')
+
+                try:
+                    endD = str2date(att.get('end', None))
+                except Exception:
+                    endD = None
+                    vnlogs.warning('Error while converting END attribute.\n')
+
+                self.vnets.append((vnCode, Stream(*codes), TW(startD, endD)))
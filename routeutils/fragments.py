@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+"""Cache of the routing files already parsed to rebuild the routing table incrementally
+
+Every source of routing information (the local routing.xml and the
+routing-<DC>.xml files of the other data centres) is parsed into a fragment,
+a list of routes and a list of virtual network streams. The fragments are
+saved in a directory together with a manifest holding the SHA-1 checksum of
+the file they were parsed from. A source whose checksum did not change is not
+parsed again.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import json
+import pickle
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import BrokenExecutor
+from typing import List, Tuple, Union
+from .utils import filechecksum
+from .utils import filesignature
+from .utils import parserouting
+
+# Format of the manifest. Fragments from other versions are discarded.
+VERSION = 1
+MANIFEST = 'manifest.json'
+
+Fragment = namedtuple('Fragment', ['routes', 'vnets', 'checksum'])
+"""Routes and virtual networks parsed from a routing file.
+
+:param routes: Tuples (Stream, Route) as returned by :func:`~routeutils.utils.parserouting`
+:type routes: list
+:param vnets: Tuples (code, Stream, TW) as returned by :func:`~routeutils.utils.parserouting`
+:type vnets: list
+:param checksum: SHA-1 of the file parsed
+:type checksum: str
+"""
+
+
+def _dump(obj, filename: str):
+    """Pickle an object in a temporary file and move it to its final name."""
+    with open(filename + '.tmp', 'wb') as fout:
+        pickle.dump(obj, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + '.tmp', filename)
+
+
+def fragmentname(filename: str, checksum: str) -> str:
+    """Name of the file where the fragment parsed from *filename* is saved."""
+    return '%s.%s.fragment' % (os.path.basename(filename), checksum[:12])
+
+
+def parsefragment(filename: str, directory: str) -> Tuple[dict, Fragment]:
+    """Parse a routing file and save its fragment in *directory*.
+
+    :param filename: Routing file in XML format
+    :type filename: str
+    :param directory: Directory where the fragment is saved
+    :type directory: str
+    :returns: Entry of the manifest and fragment
+    :rtype: tuple
+    :raises Exception: If the file cannot be parsed (see :func:`~routeutils.utils.parserouting`)
+    """
+    routes, vnets = parserouting(filename)
+    # The file could have been replaced by its backup while parsing it
+    checksum = filechecksum(filename)
+    fragment = Fragment(routes, vnets, checksum)
+    entry = {'sha1': checksum, 'fragment': fragmentname(filename, checksum)}
+    _dump(fragment, os.path.join(directory, entry['fragment']))
+    return entry, fragment
+
+
+def _parseentry(filename: str, directory: str) -> dict:
+    """Parse a routing file in a process of the pool and return only the entry of the manifest."""
+    return parsefragment(filename, directory)[0]
+
+
+class FragmentCache(object):
+    """Fragments parsed from the routing files and indexed by their filename
+
+    :param directory: Directory where the fragments and the manifest are saved
+    :type directory: str
+    :param full: Discard the fragments already saved and parse everything again
+    :type full: bool
+    """
+
+    def __init__(self, directory: str = 'cache', full: bool = False):
+        self.logs = logging.getLogger('FragmentCache')
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.sources = dict()
+        # Sources used in this run
+        self.used = dict()
+        # Fragments which had to be parsed in this run
+        self.changed = dict()
+        # Entries replaced by the ones parsed in this run
+        self.replaced = dict()
+        # Entries (or exceptions) of the files parsed by prefetch
+        self.prefetched = dict()
+        # Checksums already calculated with the signature of the file
+        self.checksums = dict()
+
+        if full:
+            return
+
+        try:
+            with open(os.path.join(directory, MANIFEST)) as fin:
+                manifest = json.load(fin)
+            if manifest.get('version') == VERSION:
+                self.sources = manifest['sources']
+            else:
+                self.logs.warning('Manifest version %s not supported. Parsing all sources.' % manifest.get('version'))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logs.warning('Manifest could not be read (%s). Parsing all sources.' % e)
+
+    def checksum(self, filename: str) -> str:
+        """Return the SHA-1 of a routing file calculating it only once while the file does not change.
+
+        :param filename: Routing file in XML format
+        :type filename: str
+        :returns: SHA-1 of the file
+        :rtype: str
+        """
+        signature = filesignature(filename)
+        try:
+            saved, checksum = self.checksums[filename]
+            if saved == signature:
+                return checksum
+        except KeyError:
+            pass
+
+        checksum = filechecksum(filename)
+        self.checksums[filename] = (signature, checksum)
+        return checksum
+
+    def unchanged(self, filename: str, checksum: str = None) -> Union[Fragment, None]:
+        """Return the fragment saved for a routing file if the file did not change.
+
+        :param filename: Routing file in XML format
+        :type filename: str
+        :param checksum: SHA-1 of the file (calculated if not given)
+        :type checksum: str
+        :returns: Fragment or None if the file must be parsed
+        :rtype: :class:`~Fragment`
+        """
+        if checksum is None:
+            checksum = self.checksum(filename)
+        entry = self.sources.get(filename)
+        if entry is None or entry['sha1'] != checksum:
+            return None
+
+        try:
+            with open(os.path.join(self.directory, entry['fragment']), 'rb') as fin:
+                fragment = pickle.load(fin)
+            if fragment.checksum == checksum:
+                return fragment
+        except Exception as e:
+            self.logs.warning('Fragment for %s could not be read (%s)' % (filename, e))
+        return None
+
+    def prefetch(self, filenames: List[str], workers: int = 4):
+        """Parse in parallel the routing files which changed since the last run.
+
+        Every file is parsed in a process of a pool and its fragment is saved.
+        :meth:`get` returns it afterwards (or raises the exception found while
+        parsing), so the result is the same as when parsing one file after
+        the other. Nothing is done with less than two files to parse or with
+        a single core.
+
+        :param filenames: Routing files in XML format
+        :type filenames: list
+        :param workers: Maximum number of files parsed at the same time
+        :type workers: int
+        """
+        pending = list()
+        for filename in filenames:
+            entry = self.sources.get(filename)
+            if filename not in self.prefetched and (entry is None or entry['sha1'] != self.checksum(filename)):
+                pending.append(filename)
+        # More processes than cores would only add the cost of passing the fragments
+        workers = min(workers, len(pending), os.cpu_count() or 1)
+        if workers <= 1:
+            return
+
+        self.logs.info('Parsing %d files with %d processes' % (len(pending), workers))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = dict((f, pool.submit(_parseentry, f, self.directory)) for f in pending)
+
+        for filename, future in futures.items():
+            error = future.exception()
+            if isinstance(error, BrokenExecutor):
+                # The file will be parsed by get()
+                self.logs.warning('%s could not be parsed in parallel (%s)' % (filename, error))
+            else:
+                self.prefetched[filename] = error if error is not None else future.result()
+
+    def get(self, filename: str) -> Fragment:
+        """Return the routes and virtual networks of a routing file.
+
+        The file is only parsed if its checksum differs from the one saved
+        in the manifest or if the fragment cannot be read.
+
+        :param filename: Routing file in XML format
+        :type filename: str
+        :returns: Fragment with the routes and virtual networks of the file
+        :rtype: :class:`~Fragment`
+        :raises Exception: If the file cannot be parsed (see :func:`~routeutils.utils.parserouting`)
+        """
+        if filename in self.prefetched:
+            result = self.prefetched.pop(filename)
+            if isinstance(result, Exception):
+                raise result
+            with open(os.path.join(self.directory, result['fragment']), 'rb') as fin:
+                fragment = pickle.load(fin)
+            return self._add(filename, result, fragment)
+
+        fragment = self.unchanged(filename)
+        if fragment is not None:
+            self.logs.info('%s did not change. Using its fragment.' % filename)
+            self.used[filename] = self.sources[filename]
+            return fragment
+
+        self.logs.info('Parsing %s' % filename)
+        entry, fragment = parsefragment(filename, self.directory)
+        return self._add(filename, entry, fragment)
+
+    def _add(self, filename: str, entry: dict, fragment: Fragment) -> Fragment:
+        """Use the fragment just parsed from a file."""
+        # The previous fragment is kept until the manifest is saved
+        if filename in self.sources and filename not in self.replaced:
+            self.replaced[filename] = self.sources[filename]
+        self.sources[filename] = entry
+        self.used[filename] = entry
+        self.changed[filename] = fragment
+        return fragment
+
+    def previous(self, filename: str) -> Union[Fragment, None]:
+        """Return the fragment saved the last time that a routing file could be parsed.
+
+        This is the fragment of a previous run if the file was parsed again in
+        this one (or it could not be parsed). The fragment is kept with its old
+        checksum, so that the file is parsed again in the next run.
+
+        :param filename: Routing file in XML format
+        :type filename: str
+        :returns: Fragment with the routes and virtual networks of the file or None if there is none
+        :rtype: :class:`~Fragment`
+        """
+        entry = self.replaced.get(filename)
+        # The file could not be parsed. The fragment in the manifest is the last one.
+        if entry is None and filename not in self.used:
+            entry = self.sources.get(filename)
+        if entry is None:
+            return None
+
+        try:
+            with open(os.path.join(self.directory, entry['fragment']), 'rb') as fin:
+                fragment = pickle.load(fin)
+        except Exception as e:
+            self.logs.warning('Fragment for %s could not be read (%s)' % (filename, e))
+            return None
+
+        self.logs.info('Using the last fragment of %s (%s)' % (filename, entry['sha1']))
+        self.sources[filename] = entry
+        self.used[filename] = entry
+        self.changed.pop(filename, None)
+        self.replaced.pop(filename, None)
+        return fragment
+
+    def commit(self):
+        """Save the manifest with the sources used in this run and remove the fragments not needed."""
+        manifest = {'version': VERSION, 'sources': self.used}
+        with open(os.path.join(self.directory, MANIFEST + '.tmp'), 'w') as fout:
+            json.dump(manifest, fout, indent=2, sort_keys=True)
+        os.replace(os.path.join(self.directory, MANIFEST + '.tmp'), os.path.join(self.directory, MANIFEST))
+
+        keep = set(entry['fragment'] for entry in self.used.values())
+        for name in os.listdir(self.directory):
+            if name.endswith('.fragment') and name not in keep:
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""Generations of the compiled routing data published by updateAll.py
+
+Every time that the routing data is compiled a new generation is written
+(f.i. routing.xml.bin.42). The file is written under a temporary name, synced
+to disk and renamed. Only then the symbolic link routing.xml.bin is replaced to
+point to it and it is added to the manifest (routing.xml.bin.manifest). The last
+generations are kept, so that the service can still start with the previous
+one if the newest cannot be read.
+
+The manifest is a JSON file with the generations from the newest to the oldest::
+
+    {"version": 1,
+     "generations": [{"generation": 42, "file": "routing.xml.bin.42",
+                      "checksum": "<SHA-1>", "built": "2023-05-02T03:52:00Z",
+                      "storage": "artifact", "streams": 10342, "routes": 30110,
+                      "stations": 61234, "vnets": 12}, ...]}
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import json
+import logging
+import datetime
+from typing import Callable, List, Tuple, Union
+from .utils import filechecksum
+from .utils import date2str
+
+# Format of the manifest
+VERSION = 1
+
+
+def manifestname(binfile: str) -> str:
+    """Name of the manifest with the generations of *binfile*."""
+    return binfile + '.manifest'
+
+
+def syncfile(filename: str):
+    """Flush the content of a file to disk."""
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def syncdir(filename: str):
+    """Flush to disk the directory entry of a file just created or renamed."""
+    fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def readmanifest(binfile: str) -> List[dict]:
+    """Return the generations of the compiled routing data from the newest to the oldest.
+
+    :param binfile: Compiled routing data (f.i. routing.xml.bin)
+    :type binfile: str
+    :returns: Entries of the manifest (empty if there is no manifest or it cannot be read)
+    :rtype: list
+    """
+    try:
+        with open(manifestname(binfile)) as fin:
+            manifest = json.load(fin)
+        if manifest.get('version') != VERSION:
+            raise ValueError('version %s not supported' % manifest.get('version'))
+        return manifest['generations']
+    except FileNotFoundError:
+        return list()
+    except Exception as e:
+        logging.getLogger('generations').warning('Manifest of %s could not be read (%s)' % (binfile, e))
+        return list()
+
+
+def candidates(binfile: str) -> List[Tuple[str, Union[dict, None]]]:
+    """Return the files with compiled routing data which could be loaded, from the newest to the oldest.
+
+    A regular file (not a link) called *binfile* was written without
+    generations and it is returned first. It has no entry in the manifest. The
+    same happens with the generation pointed by *binfile* if it is not in the
+    manifest yet (it is being published).
+
+    :param binfile: Compiled routing data (f.i. routing.xml.bin)
+    :type binfile: str
+    :returns: Tuples (filename, entry of the manifest or None)
+    :rtype: list
+    """
+    result = list()
+    directory = os.path.dirname(binfile)
+    entries = readmanifest(binfile)
+    if os.path.islink(binfile):
+        current = os.readlink(binfile)
+        if current not in [e['file'] for e in entries] and os.path.exists(binfile):
+            result.append((os.path.join(directory, current), None))
+    elif os.path.exists(binfile):
+        result.append((binfile, None))
+
+    for entry in entries:
+        result.append((os.path.join(directory, entry['file']), entry))
+
+    if not len(result):
+        result.append((binfile, None))
+    return result
+
+
+def lastgeneration(binfile: str, entries: List[dict]) -> int:
+    """Return the highest generation in the manifest or on disk.
+
+    A generation can be on disk (and even pointed by *binfile*) but not in the
+    manifest if the process publishing it was interrupted.
+
+    :param binfile: Compiled routing data (f.i. routing.xml.bin)
+    :type binfile: str
+    :param entries: Entries of the manifest
+    :type entries: list
+    :returns: Highest generation found (0 if there is none)
+    :rtype: int
+    """
+    generations = [e['generation'] for e in entries]
+
+    prefix = os.path.basename(binfile) + '.'
+    names = os.listdir(os.path.dirname(os.path.abspath(binfile)))
+    if os.path.islink(binfile):
+        names.append(os.path.basename(os.readlink(binfile)))
+    for name in names:
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            generations.append(int(name[len(prefix):]))
+    return max(generations, default=0)
+
+
+def publish(binfile: str, write: Callable[[str], None], stats: dict = None, keep: int = 3) -> dict:
+    """Write a new generation of the compiled routing data and make *binfile* point to it.
+
+    The previous generations are still available while the new one is being
+    written. The oldest ones are removed once *binfile* points to the new
+    generation and it is in the manifest.
+
+    :param binfile: Compiled routing data (f.i. routing.xml.bin)
+    :type binfile: str
+    :param write: Function writing the compiled data in the file given (and syncing it to disk)
+    :type write: function
+    :param stats: Information added to the entry of the manifest (f.i. number of routes)
+    :type stats: dict
+    :param keep: Number of generations kept
+    :type keep: int
+    :returns: Entry of the manifest for the new generation
+    :rtype: dict
+    """
+    logs = logging.getLogger('generations')
+
+    entries = readmanifest(binfile)
+    generation = lastgeneration(binfile, entries) + 1
+    filename = '%s.%d' % (binfile, generation)
+
+    write(filename)
+    syncdir(filename)
+
+    # Replace the link (or the file from previous versions) in one step
+    tmplink = binfile + '.link'
+    if os.path.lexists(tmplink):
+        os.remove(tmplink)
+    os.symlink(os.path.basename(filename), tmplink)
+    os.replace(tmplink, binfile)
+    syncdir(binfile)
+
+    entry = {'generation': generation, 'file': os.path.basename(filename), 'checksum': filechecksum(filename),
+             'built': date2str(datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0))}
+    if stats is not None:
+        entry.update(stats)
+    entries.insert(0, entry)
+    keep = max(1, keep)
+    old = entries[keep:]
+    entries = entries[:keep]
+
+    tmpfile = manifestname(binfile) + '.tmp'
+    with open(tmpfile, 'w') as fout:
+        json.dump({'version': VERSION, 'generations': entries}, fout, indent=2)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmpfile, manifestname(binfile))
+    logs.info('Generation %d of %s published' % (generation, binfile))
+
+    for e in old:
+        try:
+            os.remove(os.path.join(os.path.dirname(binfile), e['file']))
+        except OSError:
+            pass
+    return entry
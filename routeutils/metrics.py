@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""Counters and histograms to monitor the Routing Service
+
+The metrics are kept in memory by each process and exported in the text
+format used by Prometheus (https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import datetime
+import threading
+from bisect import bisect_left
+from typing import List, Tuple
+
+# Upper bounds of the buckets for latencies (seconds)
+latencyBuckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the buckets for sizes (bytes)
+sizeBuckets = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    """Format the labels of a sample in the exposition format."""
+    pairs = ['%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+             for n, v in zip(names, values)]
+    if len(extra):
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if len(pairs) else ''
+
+
+class Counter(object):
+    """Monotonic counter with labels which can be safely used by many threads.
+
+    :platform: Any
+
+    """
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        """Constructor of Counter.
+
+        :param name: Name of the metric
+        :type name: str
+        :param description: Text to describe the metric
+        :type description: str
+        :param labels: Names of the labels
+        :type labels: tuple
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        """Increment the counter for the label values given."""
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        """Return the value of the counter for the label values given."""
+        return self.values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        """Export the counter in the exposition format."""
+        result = ['# HELP %s %s' % (self.name, self.description),
+                  '# TYPE %s counter' % self.name]
+        with self.lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            result.append('%s%s %s' % (self.name, _labels(self.labels, labels), value))
+        return result
+
+
+class Histogram(object):
+    """Distribution of observed values in buckets which can be safely used by many threads.
+
+    :platform: Any
+
+    """
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = latencyBuckets):
+        """Constructor of Histogram.
+
+        :param name: Name of the metric
+        :type name: str
+        :param description: Text to describe the metric
+        :type description: str
+        :param labels: Names of the labels
+        :type labels: tuple
+        :param buckets: Upper bounds of the buckets in increasing order
+        :type buckets: tuple
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # For each combination of labels: [counts per bucket (+Inf last), sum]
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        """Add one observation for the label values given."""
+        pos = bisect_left(self.buckets, value)
+        with self.lock:
+            try:
+                data = self.values[labels]
+            except KeyError:
+                data = [[0] * (len(self.buckets) + 1), 0]
+                self.values[labels] = data
+            data[0][pos] += 1
+            data[1] += value
+
+    def count(self, *labels) -> int:
+        """Return the number of observations for the label values given."""
+        try:
+            return sum(self.values[labels][0])
+        except KeyError:
+            return 0
+
+    def render(self) -> List[str]:
+        """Export the histogram in the exposition format."""
+        result = ['# HELP %s %s' % (self.name, self.description),
+                  '# TYPE %s histogram' % self.name]
+        with self.lock:
+            items = sorted((labels, (list(data[0]), data[1])) for labels, data in self.values.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, num in zip(self.buckets + ('+Inf',), counts):
+                cumulative += num
+                result.append('%s_bucket%s %d' % (self.name, _labels(self.labels, labels, 'le="%s"' % bound),
+                                                   cumulative))
+            result.append('%s_sum%s %s' % (self.name, _labels(self.labels, labels), total))
+            result.append('%s_count%s %d' % (self.name, _labels(self.labels, labels), cumulative))
+        return result
+
+
+def gauge(name: str, description: str, value: float) -> List[str]:
+    """Export a single value in the exposition format."""
+    return ['# HELP %s %s' % (name, description),
+            '# TYPE %s gauge' % name,
+            '%s %s' % (name, value)]
+
+
+requests = Counter('routing_requests_total', 'Requests processed by the service.',
+                   ('function', 'format', 'status'))
+requestDuration = Histogram('routing_request_duration_seconds', 'Time needed to process a request.',
+                            ('function', 'format'))
+responseSize = Histogram('routing_response_size_bytes', 'Size of the body of the responses.',
+                         ('function', 'format'), sizeBuckets)
+cacheRequests = Counter('routing_cache_requests_total', 'Lookups of responses cached by the service.',
+                        ('cache', 'result'))
+tableReloads = Counter('routing_table_reloads_total', 'Routing tables loaded by the service.')
+
+
+def render(routes=None) -> str:
+    """Export all metrics of this process in the exposition format.
+
+    :param routes: Routing cache of the service to include its size and age
+    :type routes: :class:`~routeutils.utils.RoutingCache`
+    :returns: Metrics in the text format used by Prometheus
+    :rtype: str
+    """
+    result = list()
+    for metric in (requests, requestDuration, responseSize, cacheRequests, tableReloads):
+        result.extend(metric.render())
+
+    if routes is not None:
+        snapshot = routes.snapshot
+        stats = snapshot.stats()
+        result.extend(gauge('routing_table_streams', 'Streams in the routing table.', stats['streams']))
+        result.extend(gauge('routing_table_routes', 'Routes in the routing table.', stats['routes']))
+        result.extend(gauge('routing_table_stations', 'Stations in the cache of the routing table.',
+                            stats['stations']))
+        result.extend(gauge('routing_table_virtual_networks', 'Virtual networks defined.', stats['vnets']))
+        # Only the generations published by updateAll.py are known
+        if 'generation' in snapshot.source:
+            built = datetime.datetime.strptime(snapshot.source['built'], '%Y-%m-%dT%H:%M:%SZ')
+            result.extend(gauge('routing_table_generation', 'Generation of the routing table in use.',
+                                snapshot.source['generation']))
+            result.extend(gauge('routing_table_build_timestamp_seconds',
+                                'Time when the routing table in use was compiled.',
+                                built.replace(tzinfo=datetime.timezone.utc).timestamp()))
+        if snapshot.loadTime is not None:
+            result.extend(gauge('routing_table_load_seconds', 'Time needed to load the routing table in use.',
+                                snapshot.loadTime))
+
+    return '\n'.join(result) + '\n'
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""Pre-fork server sharing the routing table among the worker processes
+
+The master process loads the routing information, moves all the objects
+created up to that moment out of the view of the garbage collector
+(``gc.freeze``) and only then forks the workers. The pages holding the
+routing table are shared copy-on-write and are not dirtied by the reference
+counts or the bookkeeping of the collector in the workers.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import gc
+import signal
+import logging
+from wsgiref.simple_server import make_server
+from wsgiref.simple_server import WSGIRequestHandler
+from typing import Callable, Union
+
+# Fields of /proc/<pid>/smaps_rollup reported by memoryusage (in kB)
+smapsFields = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def freeze() -> int:
+    """Collect the garbage and move all the objects left to the permanent generation.
+
+    Should be called in the master process just before forking. The objects
+    frozen are never examined again by the garbage collector, so that their
+    memory pages are not written in the workers.
+
+    :returns: Number of objects frozen
+    :rtype: int
+    """
+    gc.collect()
+    gc.freeze()
+    return gc.get_freeze_count()
+
+
+def memoryusage(pid: Union[int, str] = 'self') -> dict:
+    """Return the resident memory of a process split in shared and private pages.
+
+    :param pid: Process to check (default: the current one)
+    :type pid: int
+    :returns: Values (in kB) of the fields in :data:`smapsFields`
+    :rtype: dict
+    :raises: OSError if the information is not available (f.i. not in Linux)
+    """
+    result = dict.fromkeys(smapsFields, 0)
+    try:
+        fin = open('/proc/%s/smaps_rollup' % pid)
+    except FileNotFoundError:
+        # Kernels before 4.14
+        fin = open('/proc/%s/smaps' % pid)
+
+    with fin:
+        for line in fin:
+            key, _, value = line.partition(':')
+            if key in result:
+                result[key] += int(value.split()[0])
+    return result
+
+
+class _RequestHandler(WSGIRequestHandler):
+    """Send the access log to the logging system instead of stderr."""
+
+    def log_message(self, format, *args):
+        logging.getLogger('prefork').debug('%s - %s' % (self.address_string(), format % args))
+
+
+def serve(app: Callable, host: str = '', port: int = 8000, workers: int = 4,
+          preload: Callable = None):
+    """Run a pre-fork HTTP server for a WSGI application.
+
+    The listening socket is created and *preload* is called in the master
+    process. After freezing the objects created, *workers* processes are
+    forked and accept connections on the same socket. Workers which die are
+    replaced. SIGINT and SIGTERM stop all the processes.
+
+    :param app: WSGI application
+    :type app: callable
+    :param host: Address to listen on
+    :type host: str
+    :param port: Port to listen on
+    :type port: int
+    :param workers: Number of worker processes
+    :type workers: int
+    :param preload: Function to load everything needed before forking
+    :type preload: callable
+    """
+    logs = logging.getLogger('prefork')
+
+    server = make_server(host, port, app, handler_class=_RequestHandler)
+    if preload is not None:
+        preload()
+    logs.info('%d objects frozen before forking' % freeze())
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.add(pid)
+        logs.info('Worker %d started' % pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        spawn()
+    logs.info('Listening on %s:%d with %d workers (master %d)' % (host or '*', port, workers, os.getpid()))
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logs.warning('Worker %d finished unexpectedly (status %d). Starting a new one.' % (pid, status))
+            spawn()
+
+    server.server_close()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""Profiling of requests processed by the Routing Service
+
+A sample of the requests (and/or the slowest ones) are profiled with cProfile
+and the statistics saved in files which can be analysed with pstats.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import time
+import hashlib
+import logging
+import cProfile
+import itertools
+import threading
+from typing import Union
+
+
+class RequestProfiler(object):
+    """Decide which requests are profiled and save their statistics.
+
+    The sampling rate selects which requests are profiled (1 in N). The
+    threshold selects which profiles are saved (the ones of requests lasting
+    at least that amount of seconds). If only a threshold is given, all
+    requests are profiled, but only the slow ones are saved.
+
+    Only one request is profiled at a time. Requests arriving meanwhile are
+    processed without profiling.
+
+    :platform: Linux
+
+    """
+
+    def __init__(self, directory: str, sample: int = 0, threshold: float = 0.0):
+        """Constructor of RequestProfiler.
+
+        :param directory: Directory where the statistics must be saved
+        :type directory: str
+        :param sample: Profile one of every *sample* requests (0: sampling disabled)
+        :type sample: int
+        :param threshold: Save only the profiles of requests lasting at least these seconds
+        :type threshold: float
+        """
+        self.logs = logging.getLogger('RequestProfiler')
+        self.directory = directory
+        self.sample = sample
+        self.threshold = threshold
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def enabled(self) -> bool:
+        """Check whether some requests will be profiled."""
+        return (self.sample > 0) or (self.threshold > 0)
+
+    def start(self) -> Union[cProfile.Profile, None]:
+        """Start profiling the current request if it was selected.
+
+        :returns: The running profiler or None if the request is not profiled
+        :rtype: cProfile.Profile
+        """
+        if self.sample > 0:
+            if next(self.counter) % self.sample:
+                return None
+        elif self.threshold <= 0:
+            return None
+
+        # Only one request can be profiled at a time
+        if not self.lock.acquire(blocking=False):
+            return None
+
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except Exception:
+            # Another profiler is active
+            self.lock.release()
+            return None
+        return prof
+
+    def stop(self, prof: cProfile.Profile, duration: float, function: str, fmt: str,
+             query: Union[str, bytes]) -> Union[str, None]:
+        """Stop profiling the current request and save its statistics if needed.
+
+        :param prof: Profiler returned by :meth:`~RequestProfiler.start`
+        :type prof: cProfile.Profile
+        :param duration: Seconds needed to process the request
+        :type duration: float
+        :param function: Function called (f.i. query)
+        :type function: str
+        :param fmt: Format of the output
+        :type fmt: str
+        :param query: Parameters of the request (query string or body)
+        :type query: str
+        :returns: File where the statistics were saved (or None)
+        :rtype: str
+        """
+        try:
+            prof.disable()
+        finally:
+            self.lock.release()
+
+        if duration < self.threshold:
+            return None
+
+        if isinstance(query, str):
+            query = query.encode('utf-8')
+
+        filename = os.path.join(self.directory, '%s-%s-%s-%d-%d.pstats' %
+                                (function if len(function) else 'index', fmt if len(fmt) else 'none',
+                                 hashlib.sha1(query).hexdigest()[:12], int(time.time() * 1000), os.getpid()))
+        try:
+            prof.dump_stats(filename)
+        except Exception as e:
+            self.logs.error('Error saving %s: %s' % (filename, e))
+            return None
+
+        self.logs.info('Request profiled (%.3f seconds) in %s' % (duration, filename))
+        return filename
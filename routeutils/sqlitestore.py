@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+
+"""Routing table, station cache and virtual networks stored in SQLite
+
+An alternative to :mod:`~routeutils.artifact` for deployments with many small
+workers or many routing tables. Nothing is loaded in memory when the file is
+opened. Every worker opens the database read-only and the candidate streams,
+routes, stations and virtual networks are retrieved with indexed queries.
+The results are kept in a small in-process cache.
+
+The database is created by ``updateAll.py`` when the `storage` option of the
+configuration file is ``sqlite``. Datetimes are saved as microseconds since the
+epoch and None as NULL.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Callable, Hashable, List, Union
+from urllib.parse import quote
+from .utils import Stream
+from .utils import TW
+from .utils import Route
+from .utils import Station
+from .utils import RoutingSnapshot
+from .utils import haswildcard
+from .artifact import date2int
+from .artifact import int2date
+from .generations import syncfile
+
+MAGIC = b'SQLite format 3\x00'
+VERSION = 1
+
+# Maximum number of results kept in the cache of each database
+cacheSize = 4096
+
+schema = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE streams (id INTEGER PRIMARY KEY, n TEXT, s TEXT, l TEXT, c TEXT, wildcard INTEGER);
+CREATE TABLE routes (stream INTEGER, pos INTEGER, service TEXT, address TEXT, start INTEGER, end INTEGER,
+                     priority INTEGER, PRIMARY KEY (stream, pos)) WITHOUT ROWID;
+CREATE TABLE groups (id INTEGER PRIMARY KEY, netloc TEXT, n TEXT, s TEXT, l TEXT, c TEXT);
+CREATE TABLE stations (grp INTEGER, pos INTEGER, name TEXT, latitude REAL, longitude REAL, start INTEGER,
+                       end INTEGER, PRIMARY KEY (grp, pos)) WITHOUT ROWID;
+CREATE TABLE vnets (id INTEGER PRIMARY KEY, code TEXT, n TEXT, s TEXT, l TEXT, c TEXT, start INTEGER,
+                    end INTEGER);
+'''
+
+indexes = '''
+CREATE INDEX streams_nsc ON streams (n, s, c);
+CREATE INDEX streams_wildcard ON streams (wildcard) WHERE wildcard = 1;
+CREATE UNIQUE INDEX groups_stream ON groups (netloc, n, s, l, c);
+CREATE INDEX vnets_code ON vnets (code);
+'''
+
+
+def issqlite(filename: str) -> bool:
+    """Check whether a file is a SQLite database."""
+    with open(filename, 'rb') as fin:
+        return fin.read(len(MAGIC)) == MAGIC
+
+
+def writesqlite(filename: str, routingtable: dict, stationtable: dict, vntable: dict, eidadcs: list):
+    """Save the routing information in a SQLite database.
+
+    The database is created under a temporary name, synced to disk and renamed
+    at the end, so that workers which have the previous version open are not
+    affected.
+
+    :param filename: Name of the file to create
+    :type filename: str
+    :param routingtable: Routes indexed by :class:`~routeutils.utils.Stream`
+    :type routingtable: dict
+    :param stationtable: Cache of stations indexed by netloc and :class:`~routeutils.utils.Stream`
+    :type stationtable: dict
+    :param vntable: Virtual networks
+    :type vntable: dict
+    :param eidadcs: Information about the data centres
+    :type eidadcs: list
+    """
+    tmpfile = filename + '.tmp'
+    try:
+        os.remove(tmpfile)
+    except FileNotFoundError:
+        pass
+
+    conn = sqlite3.connect(tmpfile)
+    try:
+        conn.executescript(schema)
+        with conn:
+            conn.execute('INSERT INTO meta VALUES (?, ?)', ('version', str(VERSION)))
+            conn.execute('INSERT INTO meta VALUES (?, ?)', ('eidadcs', json.dumps(eidadcs)))
+
+            for ind, (st, lr) in enumerate(routingtable.items()):
+                conn.execute('INSERT INTO streams VALUES (?, ?, ?, ?, ?, ?)',
+                             (ind, st.n, st.s, st.l, st.c, int(haswildcard(st.n))))
+                conn.executemany('INSERT INTO routes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 [(ind, pos, ro.service, ro.address, _date2int(ro.tw.start), _date2int(ro.tw.end),
+                                   ro.priority) for pos, ro in enumerate(lr)])
+
+            grp = 0
+            for netloc, dcst in stationtable.items():
+                for st, lsta in dcst.items():
+                    conn.execute('INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?)', (grp, netloc, st.n, st.s, st.l, st.c))
+                    conn.executemany('INSERT INTO stations VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     [(grp, pos, sta.name, sta.latitude, sta.longitude, _date2int(sta.start),
+                                       _date2int(sta.end)) for pos, sta in enumerate(lsta)])
+                    grp += 1
+
+            conn.executemany('INSERT INTO vnets (code, n, s, l, c, start, end) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             [(code, st.n, st.s, st.l, st.c, _date2int(tw.start), _date2int(tw.end))
+                              for code, lst in vntable.items() for st, tw in lst])
+        conn.executescript(indexes)
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+    syncfile(tmpfile)
+    os.replace(tmpfile, filename)
+
+
+def _date2int(dt) -> int:
+    return None if dt is None else date2int(dt)
+
+
+def _int2date(value):
+    return None if value is None else int2date(value)
+
+
+def _inode(filename: str) -> tuple:
+    stat = os.stat(filename)
+    return stat.st_dev, stat.st_ino
+
+
+class LRUCache(object):
+    """Small cache with a maximum number of entries which can be used by many threads."""
+
+    def __init__(self, maxsize: int = cacheSize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable):
+        """Return the value for the key, calculating it with *compute* if it is not cached."""
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+                return self.data[key]
+            except KeyError:
+                pass
+
+        value = compute()
+        with self.lock:
+            self.data[key] = value
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return value
+
+
+class SQLiteTables(object):
+    """Read-only access to a routing database shared by all the threads of a process.
+
+    Each thread (and process, after a fork) uses its own connection. All of
+    them read the file which was opened first, even if a new generation of
+    the routing data is published in the meantime.
+
+    :platform: Any
+
+    """
+
+    def __init__(self, filename: str):
+        """Constructor of SQLiteTables.
+
+        :param filename: SQLite database created by :func:`writesqlite`
+        :type filename: str
+        :raises: ValueError if the database is not valid
+        """
+        self.filename = filename
+        # The generation and not the link to the newest one. Threads connecting
+        # later must read the same file, which is checked in connection().
+        self.path = os.path.realpath(filename)
+        self.inode = _inode(self.path)
+        self.uri = 'file:%s?mode=ro' % quote(self.path)
+        self.local = threading.local()
+        self.cache = LRUCache()
+
+        version = self.query('SELECT value FROM meta WHERE key = ?', ('version',))
+        if not len(version) or int(version[0][0]) != VERSION:
+            raise ValueError('Version of %s is not supported' % filename)
+        self.eidaDCs = json.loads(self.query('SELECT value FROM meta WHERE key = ?', ('eidadcs',))[0][0])
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the connection of this thread."""
+        conn = getattr(self.local, 'conn', None)
+        if (conn is None) or (self.local.pid != os.getpid()):
+            conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            # Once something was read the file stays open even if it is replaced
+            conn.execute('SELECT 1 FROM meta LIMIT 1').fetchall()
+            if _inode(self.path) != self.inode:
+                conn.close()
+                raise ValueError('%s was replaced after loading it' % self.path)
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        """Run a query and return all the rows."""
+        return self.connection().execute(sql, params).fetchall()
+
+    def cached(self, key: Hashable, sql: str, params: tuple, convert: Callable) -> list:
+        """Run a query (or take its result from the cache) and convert the rows."""
+        return self.cache.get(key, lambda: [convert(row) for row in self.query(sql, params)])
+
+    def streams(self) -> List[Stream]:
+        """Return all the streams in the routing table."""
+        return self.cached(('streams',), 'SELECT n, s, l, c FROM streams ORDER BY id', (),
+                           lambda row: Stream(*row))
+
+    def candidates(self, net: str) -> List[Stream]:
+        """Return the streams with the network code given or with wildcards in the network code."""
+        return self.cached(('candidates', net),
+                           'SELECT n, s, l, c FROM streams WHERE n = ? AND wildcard = 0 '
+                           'UNION ALL SELECT n, s, l, c FROM streams WHERE wildcard = 1', (net,),
+                           lambda row: Stream(*row))
+
+    def routes(self, stream: Stream) -> List[Route]:
+        """Return the routes of a stream (empty if it is not in the routing table)."""
+        return self.cached(('routes', stream),
+                           'SELECT service, address, r.start, r.end, priority FROM streams JOIN routes r '
+                           'ON r.stream = streams.id WHERE n = ? AND s = ? AND c = ? AND l = ? ORDER BY pos',
+                           (stream.n, stream.s, stream.c, stream.l),
+                           lambda row: Route(row[0], row[1], TW(_int2date(row[2]), _int2date(row[3])), row[4]))
+
+    def stations(self, netloc: str, stream: Stream) -> Union[List[Station], None]:
+        """Return the stations cached for a stream in a data centre (None if there is no cache for it)."""
+        def compute():
+            rows = self.query('SELECT name, latitude, longitude, st.start, st.end FROM groups LEFT JOIN stations st '
+                              'ON st.grp = groups.id WHERE netloc = ? AND n = ? AND s = ? AND l = ? AND c = ? '
+                              'ORDER BY pos', (netloc, stream.n, stream.s, stream.l, stream.c))
+            if not len(rows):
+                return None
+            return [Station(row[0], row[1], row[2], _int2date(row[3]), _int2date(row[4]))
+                    for row in rows if row[0] is not None]
+
+        return self.cache.get(('stations', netloc, stream), compute)
+
+    def hasnetloc(self, netloc: str) -> bool:
+        """Check whether there are stations cached for a data centre."""
+        return bool(self.cached(('netloc', netloc), 'SELECT 1 FROM groups WHERE netloc = ? LIMIT 1', (netloc,),
+                                lambda row: row[0]))
+
+    def groups(self, netloc: str) -> List[Stream]:
+        """Return the streams with stations cached in a data centre."""
+        return self.cached(('groups', netloc), 'SELECT n, s, l, c FROM groups WHERE netloc = ? ORDER BY id',
+                           (netloc,), lambda row: Stream(*row))
+
+    def vnet(self, code: str) -> list:
+        """Return the streams and timewindows of a virtual network (empty if it is not defined)."""
+        return self.cached(('vnet', code), 'SELECT n, s, l, c, start, end FROM vnets WHERE code IS ? ORDER BY id',
+                           (code,), lambda row: (Stream(*row[:4]), TW(_int2date(row[4]), _int2date(row[5]))))
+
+    def count(self, table: str) -> int:
+        """Return the number of rows in a table."""
+        return self.query('SELECT COUNT(*) FROM %s' % table)[0][0]
+
+
+class _RouteTable(Mapping):
+    """Routes indexed by Stream read from the database."""
+
+    def __init__(self, db: SQLiteTables):
+        self.db = db
+
+    def __getitem__(self, stream: Stream) -> List[Route]:
+        result = self.db.routes(stream)
+        if not len(result):
+            raise KeyError(stream)
+        return result
+
+    def __iter__(self):
+        return iter(self.db.streams())
+
+    def __len__(self) -> int:
+        return self.db.count('streams')
+
+
+class _StationGroup(Mapping):
+    """Stations of one data centre indexed by Stream read from the database."""
+
+    def __init__(self, db: SQLiteTables, netloc: str):
+        self.db = db
+        self.netloc = netloc
+
+    def __getitem__(self, stream: Stream) -> List[Station]:
+        result = self.db.stations(self.netloc, stream)
+        if result is None:
+            raise KeyError(stream)
+        return result
+
+    def __iter__(self):
+        return iter(self.db.groups(self.netloc))
+
+    def __len__(self) -> int:
+        return len(self.db.groups(self.netloc))
+
+
+class _StationTable(Mapping):
+    """Stations indexed by netloc and Stream read from the database."""
+
+    def __init__(self, db: SQLiteTables):
+        self.db = db
+
+    def __getitem__(self, netloc: str) -> _StationGroup:
+        if not self.db.hasnetloc(netloc):
+            raise KeyError(netloc)
+        return _StationGroup(self.db, netloc)
+
+    def __iter__(self):
+        return iter([row[0] for row in self.db.query('SELECT DISTINCT netloc FROM groups ORDER BY id')])
+
+    def __len__(self) -> int:
+        return self.db.query('SELECT COUNT(DISTINCT netloc) FROM groups')[0][0]
+
+
+class _VNTable(Mapping):
+    """Virtual networks read from the database."""
+
+    def __init__(self, db: SQLiteTables):
+        self.db = db
+
+    def __getitem__(self, code: str) -> list:
+        result = self.db.vnet(code)
+        if not len(result):
+            raise KeyError(code)
+        return result
+
+    def __iter__(self):
+        return iter(self.db.cached(('vnets',), 'SELECT code FROM vnets GROUP BY code ORDER BY MIN(id)', (),
+                                   lambda row: row[0]))
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+
+class SQLiteSnapshot(RoutingSnapshot):
+    """Snapshot of the routing information kept in a SQLite database.
+
+    The selection of the candidate streams is an indexed query instead of a
+    lookup in an index built in memory.
+
+    :platform: Any
+
+    """
+
+    def __init__(self, filename: str, source: dict = None):
+        """Constructor of SQLiteSnapshot.
+
+        :param filename: SQLite database created by :func:`writesqlite`
+        :type filename: str
+        :param source: Description of the file this snapshot was read from
+        :type source: dict
+        """
+        self.db = SQLiteTables(filename)
+        super().__init__(_RouteTable(self.db), _StationTable(self.db), _VNTable(self.db), self.db.eidaDCs, source)
+
+    def buildIndex(self):
+        """Nothing to do. The database has its own indexes."""
+        pass
+
+    def candidates(self, stream: Stream) -> list:
+        """Return the streams from the routing table which could overlap the one given.
+
+        :param stream: Stream requested (wildcards allowed)
+        :type stream: :class:`~routeutils.utils.Stream`
+        :returns: Streams in the routing table which may overlap the requested one
+        :rtype: list
+        """
+        if haswildcard(stream.n):
+            return self.db.streams()
+
+        return self.db.candidates(stream.n)
+
+    def stats(self) -> dict:
+        """Return the number of streams, routes, stations and virtual networks in the database."""
+        try:
+            return self.cache['stats']
+        except KeyError:
+            pass
+
+        self.cache['stats'] = {'streams': self.db.count('streams'),
+                               'routes': self.db.count('routes'),
+                               'stations': self.db.count('stations'),
+                               'vnets': len(self.vnTable)}
+        return self.cache['stats']
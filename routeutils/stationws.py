@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+"""Concurrent harvesting of station names and locations from the station-WS
+
+The queries needed to cache the stations of a routing table are deduplicated
+and sent in parallel. The connections to every host are kept open and
+reused, and only a limited number of them are opened at the same time to
+every host. The responses (format=text) are parsed while they are read.
+
+The stations can be kept on disk between runs (:class:`~StationCache`) and
+refreshed only with the changes since the last query.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import time
+import pickle
+import logging
+import datetime
+import threading
+import http.client
+from urllib.parse import urlsplit
+from urllib.error import URLError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Tuple
+from .utils import Stream
+from .utils import Route
+from .utils import Station
+from .utils import getStationCache
+from .utils import stationquery
+from .utils import parsestations
+from .utils import __version__
+
+# Errors of a connection closed by the server while it was idle
+_staleErrors = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class ConnectionPool(object):
+    """Persistent HTTP connections to many hosts
+
+    :param perhost: Maximum number of connections open at the same time to a host
+    :type perhost: int
+    :param timeout: Timeout in seconds of every connection
+    :type timeout: float
+    """
+
+    def __init__(self, perhost: int = 4, timeout: float = 15):
+        self.perhost = perhost
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # Idle connections and semaphores indexed by (scheme, netloc)
+        self.idle = dict()
+        self.slots = dict()
+
+    def _slot(self, key: tuple) -> threading.BoundedSemaphore:
+        with self.lock:
+            if key not in self.slots:
+                self.slots[key] = threading.BoundedSemaphore(self.perhost)
+                self.idle[key] = list()
+            return self.slots[key]
+
+    def _new(self, key: tuple) -> http.client.HTTPConnection:
+        if key[0] == 'https':
+            return http.client.HTTPSConnection(key[1], timeout=self.timeout)
+        return http.client.HTTPConnection(key[1], timeout=self.timeout)
+
+    def _connection(self, key: tuple) -> Tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            if len(self.idle[key]):
+                return self.idle[key].pop(), True
+        return self._new(key), False
+
+    def get(self, url: str, consume: Callable) -> tuple:
+        """Send a GET request and pass the response to *consume* if it is successful (200 or 204).
+
+        The whole response is always read, so that the connection can be reused.
+
+        :param url: URL to request
+        :type url: str
+        :param consume: Function reading the response (an iterable of lines in bytes)
+        :type consume: callable
+        :returns: HTTP status and the result of *consume* (None if it was not called)
+        :rtype: tuple
+        :raises: URLError if the request could not be sent (as urllib does), other exceptions while reading
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        headers = {'User-Agent': 'Routing Service/' + __version__}
+
+        with self._slot(key):
+            for attempt in range(2):
+                # Retry only once and with a new connection
+                conn, reused = self._connection(key) if not attempt else (self._new(key), False)
+                try:
+                    try:
+                        conn.request('GET', path, headers=headers)
+                    except OSError as e:
+                        if reused:
+                            # The server closed the idle connection
+                            conn.close()
+                            continue
+                        raise URLError(e)
+                    try:
+                        resp = conn.getresponse()
+                    except _staleErrors:
+                        if reused:
+                            conn.close()
+                            continue
+                        raise
+
+                    result = consume(resp) if resp.status in (200, 204) else None
+                    resp.read()
+                except Exception:
+                    conn.close()
+                    raise
+                break
+
+            if resp.will_close:
+                conn.close()
+            else:
+                with self.lock:
+                    self.idle[key].append(conn)
+        return resp.status, result
+
+    def close(self):
+        """Close all the idle connections."""
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+                conns.clear()
+
+
+def _lines(resp) -> Iterable[str]:
+    """Decode the lines of a response while they are read."""
+    for line in resp:
+        yield from line.decode('utf-8').splitlines()
+
+
+def _fetch(pool: ConnectionPool, st: Stream, rt: Route) -> Tuple[List[Station], bool]:
+    """Retrieve the stations and whether they were received without errors (200 or 204)."""
+    query = stationquery(st, rt)
+    logging.debug(query)
+
+    try:
+        status, result = pool.get(query, lambda resp: parsestations(_lines(resp), st, rt))
+    except URLError as e:
+        logging.warning('The URL does not seem to be a valid Station-WS')
+        logging.warning('%s - Reason: %s\n' % (rt.address, e.reason))
+        return list(), False
+    except Exception as e:
+        logging.warning('WATCH THIS! %s' % e)
+        return list(), False
+
+    if result is None:
+        return getStationCache(st, rt), False
+    return result, True
+
+
+def fetchstations(pool: ConnectionPool, st: Stream, rt: Route) -> List[Station]:
+    """Retrieve station name and location from a station-WS reusing the connections of a pool.
+
+    Behaves as :func:`~routeutils.utils.getStationCache`, which is used if
+    the server does not answer with 200 or 204 (f.i. a redirection).
+
+    :param pool: Connections to the station-WS
+    :type pool: :class:`~ConnectionPool`
+    :param st: Stream for which a cache should be saved.
+    :type st: Stream
+    :param rt: Route where this stream is archived.
+    :type rt: Route
+    :returns: Stations found in this route for this stream pattern.
+    :rtype: list
+    """
+    return _fetch(pool, st, rt)[0]
+
+
+def mergestations(stations: List[Station], updated: List[Station]) -> List[Station]:
+    """Replace the stations updated and append the new ones.
+
+    Stations are identified by their name and start time.
+
+    :param stations: Stations cached
+    :type stations: list
+    :param updated: Stations returned by a query with *updatedafter*
+    :type updated: list
+    :returns: New list of stations
+    :rtype: list
+    """
+    changes = dict(((sta.name, sta.start), sta) for sta in updated)
+    result = list()
+    for sta in stations:
+        result.append(changes.pop((sta.name, sta.start), sta))
+    result.extend(sta for sta in updated if (sta.name, sta.start) in changes)
+    return result
+
+
+class StationCache(object):
+    """Stations retrieved from the station-WS saved on disk between runs
+
+    Every query (station-WS, stream pattern and time window) is kept with the
+    time it was sent. A query younger than *ttl* is not sent again. An older
+    one is sent with the parameter *updatedafter* and only the stations
+    updated are merged. If the server does not support it, or the last full
+    query is older than *maxage* (to learn about the stations removed), the
+    whole query is sent again.
+
+    With *offline* no query is sent. The stations cached are used whatever
+    their age and queries not found in the cache return no stations.
+
+    :param filename: File where the cache is saved
+    :type filename: str
+    :param ttl: Seconds during which a query is not sent again
+    :type ttl: float
+    :param maxage: Seconds after which a query is always sent again without *updatedafter*
+    :type maxage: float
+    :param offline: Use only the stations cached
+    :type offline: bool
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename: str, ttl: float = 86400, maxage: float = 7 * 86400, offline: bool = False):
+        self.logs = logging.getLogger('StationCache')
+        self.filename = filename
+        self.ttl = ttl
+        self.maxage = maxage
+        self.offline = offline
+        self.lock = threading.Lock()
+        # Per query: time of the last query, time of the last full query and stations
+        self.entries = dict()
+        # Hosts which do not support updatedafter
+        self.nodelta = set()
+        # Queries needed in this run
+        self.used = set()
+        # Queries answered from the cache, with updatedafter, completely and not found offline
+        self.counters = {'cached': 0, 'delta': 0, 'full': 0, 'missing': 0}
+
+        try:
+            with open(filename, 'rb') as fin:
+                data = pickle.load(fin)
+            if isinstance(data, dict) and data.get('version') == self.VERSION:
+                self.entries = data['entries']
+                self.nodelta = set(data['nodelta'])
+            else:
+                self.logs.warning('Format of %s not supported. Requesting all stations.' % filename)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logs.warning('%s could not be read (%s). Requesting all stations.' % (filename, e))
+
+    def _count(self, key: str):
+        with self.lock:
+            self.counters[key] += 1
+
+    def _store(self, query: str, stations: List[Station], fetched: float, full: float):
+        with self.lock:
+            self.entries[query] = {'fetched': fetched, 'full': full, 'stations': stations}
+
+    def _delta(self, pool: ConnectionPool, query: str, st: Stream, rt: Route, entry: dict) -> List[Station]:
+        """Return the stations cached with the changes since the last query or None if not possible."""
+        since = datetime.datetime.fromtimestamp(entry['fetched'], datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+        try:
+            status, updated = pool.get(query + '&updatedafter=' + since,
+                                       lambda resp: parsestations(_lines(resp), st, rt, warn=False))
+        except Exception as e:
+            self.logs.warning('Stations updated after %s could not be requested (%s)' % (since, e))
+            return None
+
+        if status in (200, 204):
+            return mergestations(entry['stations'], updated)
+
+        self.logs.info('%s does not support updatedafter (status %d)' % (urlsplit(query).netloc, status))
+        with self.lock:
+            self.nodelta.add(urlsplit(query).netloc)
+        return None
+
+    def fetch(self, pool: ConnectionPool, st: Stream, rt: Route) -> List[Station]:
+        """Return the stations of a stream from the cache or from the station-WS.
+
+        :param pool: Connections to the station-WS
+        :type pool: :class:`~ConnectionPool`
+        :param st: Stream for which a cache should be saved.
+        :type st: Stream
+        :param rt: Route where this stream is archived.
+        :type rt: Route
+        :returns: Stations found in this route for this stream pattern.
+        :rtype: list
+        """
+        query = stationquery(st, rt)
+        with self.lock:
+            self.used.add(query)
+            entry = self.entries.get(query)
+
+        now = time.time()
+        if entry is not None and (self.offline or now - entry['fetched'] < self.ttl):
+            self._count('cached')
+            return entry['stations']
+
+        if self.offline:
+            self.logs.debug('%s not cached' % query)
+            self._count('missing')
+            return list()
+
+        if entry is not None and now - entry['full'] < self.maxage and urlsplit(query).netloc not in self.nodelta:
+            stations = self._delta(pool, query, st, rt, entry)
+            if stations is not None:
+                self._count('delta')
+                self._store(query, stations, now, entry['full'])
+                return stations
+
+        self._count('full')
+        stations, valid = _fetch(pool, st, rt)
+        if valid:
+            self._store(query, stations, now, now)
+        elif entry is not None:
+            # Better old stations than none
+            self.logs.warning('Using stations cached for %s' % query)
+            return entry['stations']
+        return stations
+
+    def save(self):
+        """Save the queries needed in this run. The rest are discarded."""
+        with self.lock:
+            data = {'version': self.VERSION, 'nodelta': sorted(self.nodelta),
+                    'entries': dict((q, e) for q, e in self.entries.items() if q in self.used)}
+        with open(self.filename + '.tmp', 'wb') as fout:
+            pickle.dump(data, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self.filename + '.tmp', self.filename)
+        self.logs.info('Stations: %(cached)d queries cached, %(delta)d updated, %(full)d requested' % self.counters)
+
+
+def harvest(streams: List[Tuple[Stream, Route]], workers: int = 16, perhost: int = 4,
+            timeout: float = 15, cache: StationCache = None) -> dict:
+    """Retrieve the stations of many streams from their station-WS in parallel.
+
+    Identical queries are sent only once.
+
+    :param streams: Pairs of :class:`~routeutils.utils.Stream` and a :class:`~routeutils.utils.Route` to a station-WS
+    :type streams: list
+    :param workers: Maximum number of requests in progress at the same time
+    :type workers: int
+    :param perhost: Maximum number of connections open at the same time to a host
+    :type perhost: int
+    :param timeout: Timeout in seconds of every connection
+    :type timeout: float
+    :param cache: Stations saved in previous runs
+    :type cache: :class:`~StationCache`
+    :returns: Stations indexed by query (see :func:`~routeutils.utils.stationquery`)
+    :rtype: dict
+    """
+    queries = dict()
+    for st, rt in streams:
+        queries.setdefault(stationquery(st, rt), (st, rt))
+
+    fetch = fetchstations if cache is None else cache.fetch
+    pool = ConnectionPool(perhost, timeout)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = dict((query, executor.submit(fetch, pool, st, rt))
+                           for query, (st, rt) in queries.items())
+            return dict((query, future.result()) for query, future in futures.items())
+    finally:
+        pool.close()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+
+"""Synthetic routing information for tests and benchmarks
+
+A :class:`RoutingGenerator` creates the networks of many data centres with
+the shapes found in the EIDA routing files: permanent networks routed as a
+whole, temporary networks with a few epochs, networks routed per station and
+stations routed only for some channels. Some streams have an alternative route
+(priority 2) to another data centre with an overlapping time window. Virtual
+networks group streams of random networks.
+
+The same parameters and seed produce always the same information, which can
+be obtained as tables in memory (as loaded by the service), written as
+routing files (routing.xml and routing-<DC>.xml) with the description of the
+data centres (routing.json and routing-<DC>.json), or answered as a station-WS
+would do (format=text).
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import json
+import random
+import datetime
+from fnmatch import fnmatch
+from urllib.parse import parse_qs
+from typing import List, Tuple
+from .utils import Stream
+from .utils import Route
+from .utils import TW
+from .utils import Station
+from .utils import str2date
+
+# Namespace of the routing files (see addroutes)
+NAMESPACE = 'http://geofon.gfz-potsdam.de/ns/Routing/1.0/'
+
+# Default weights of the shapes of the streams
+MIX = {'network': 40, 'temporary': 10, 'station': 30, 'channel': 20}
+
+# Services of every data centre with the path of their queries
+SERVICES = [('dataselect', 'fdsnws-dataselect-1', 'fdsnws/dataselect/1'),
+            ('station', 'fdsnws-station-1', 'fdsnws/station/1'),
+            ('wfcatalog', 'eidaws-wfcatalog', 'eidaws/wfcatalog/1')]
+
+_CODECHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+
+def networkcode(index: int) -> str:
+    """Return a unique network code with at least two characters for an index."""
+    code = ''
+    index += len(_CODECHARS)
+    while index:
+        index, r = divmod(index, len(_CODECHARS))
+        code = _CODECHARS[r] + code
+    return code
+
+
+def _date(d: datetime.datetime) -> str:
+    return d.strftime('%Y-%m-%dT%H:%M:%S') if d is not None else ''
+
+
+class RoutingGenerator(object):
+    """Deterministic routing information of many data centres
+
+    The data centres are called DC0, DC1, ... and their services are in
+    https://dc<N>.eida.org. Every stream has a dataselect, a station and a
+    wfcatalog route.
+
+    :param routes: Minimum number of routes to create
+    :type routes: int
+    :param datacentres: Number of data centres
+    :type datacentres: int
+    :param mix: Weights of the shapes of the streams ('network', 'temporary', 'station' and 'channel')
+    :type mix: dict
+    :param alternative: Share of the streams with an alternative route to another data centre
+    :type alternative: float
+    :param vnets: Number of virtual networks (by default one per 50 networks)
+    :type vnets: int
+    :param seed: Seed of the random generator
+    :type seed: int
+    """
+
+    def __init__(self, routes: int = 10000, datacentres: int = 12, mix: dict = None, alternative: float = 0.1,
+                 vnets: int = None, seed: int = 1):
+        rnd = random.Random(seed)
+        mix = MIX if mix is None else mix
+        shapes = sorted(mix)
+        weights = [mix[s] for s in shapes]
+
+        self.datacentres = ['DC%d' % d for d in range(datacentres)]
+        # Stations of every network
+        self.stations = dict()
+        # Tuples (Stream, routes, data centre) in the order they were created
+        self.streams = list()
+        # Streams and time windows of every virtual network
+        self.vnets = dict()
+
+        count = 0
+        net = 0
+        while count < routes:
+            code = networkcode(net)
+            dc = net % datacentres
+            backup = (dc + 1) % datacentres
+            shape = rnd.choices(shapes, weights)[0]
+
+            if shape == 'temporary':
+                epochs = list()
+                # Epochs of less than 900 days every five years do not overlap
+                for e in range(rnd.randint(2, 4)):
+                    start = datetime.datetime(1990 + 5 * e + rnd.randint(0, 1), rnd.randint(1, 12), 1)
+                    epochs.append(TW(start, start + datetime.timedelta(days=rnd.randint(300, 900))))
+                lifetime = TW(epochs[0].start, epochs[-1].end)
+            else:
+                epochs = [TW(datetime.datetime(rnd.randint(1980, 2020), 1, 1), None)]
+                lifetime = epochs[0]
+
+            stations = list()
+            for s in range(rnd.randint(5, 50)):
+                # Some stations were closed
+                end = lifetime.end
+                if end is None and rnd.random() < 0.1:
+                    end = datetime.datetime(2021, 1, 1)
+                stations.append(Station('S%03d' % s, round(rnd.uniform(35, 70), 4), round(rnd.uniform(-10, 40), 4),
+                                        lifetime.start, end))
+            self.stations[code] = stations
+
+            if shape in ('network', 'temporary'):
+                streams = [Stream(code, '*', '*', '*')]
+            elif shape == 'station':
+                streams = [Stream(code, sta.name, '*', '*') for sta in stations]
+            else:
+                streams = [Stream(code, sta.name, loc, cha) for sta in stations
+                           for loc, cha in (('*', 'HH*'), ('00', 'BHZ'))]
+
+            for st in streams:
+                rts = list()
+                for tw in epochs:
+                    rts.extend(Route(service, 'https://%s/%s/query' % (self.host(dc), path), tw, 1)
+                               for service, _, path in SERVICES)
+                    if datacentres > 1 and rnd.random() < alternative:
+                        # Alternative route overlapping the main one
+                        days = 365 if tw.end is None else (tw.end - tw.start).days // 2
+                        start = tw.start + datetime.timedelta(days=days)
+                        rts.append(Route('dataselect', 'https://%s/fdsnws/dataselect/1/query' % self.host(backup),
+                                         TW(start, tw.end), 2))
+                self.streams.append((st, rts, dc))
+                count += len(rts)
+
+            net += 1
+
+        if vnets is None:
+            vnets = max(1, net // 50)
+        for v in range(vnets):
+            members = list()
+            for _ in range(rnd.randint(5, 30)):
+                code = networkcode(rnd.randrange(net))
+                sta = rnd.choice(self.stations[code])
+                members.append((Stream(code, sta.name if rnd.random() < 0.5 else '*', '*', '*'),
+                                TW(sta.start, sta.end)))
+            self.vnets['_V%d' % v] = members
+
+    def host(self, dc: int) -> str:
+        """Return the host of the services of a data centre."""
+        return 'dc%d.eida.org' % dc
+
+    def routingtable(self) -> dict:
+        """Return the routes indexed by :class:`~routeutils.utils.Stream`."""
+        return dict((st, list(rts)) for st, rts, _ in self.streams)
+
+    def stationtable(self) -> dict:
+        """Return the stations indexed by data centre and stream.
+
+        The result is the same as the one of :func:`~routeutils.utils.cachestations`
+        with the station-WS answered by :meth:`stationapp`.
+        """
+        result = dict()
+        for st, rts, _ in self.streams:
+            stations = list()
+            for rt in rts:
+                if rt.service == 'station':
+                    stations.extend(sta for _, sta in self.querystations({'net': st.n, 'sta': st.s,
+                                                                          'start': _date(rt.tw.start),
+                                                                          'end': _date(rt.tw.end)}))
+            for netloc in set(rt.address.split('/')[2] for rt in rts):
+                result.setdefault(netloc, dict())[st] = stations
+        return result
+
+    def vntable(self) -> dict:
+        """Return the streams and time windows of every virtual network."""
+        return dict((code, list(members)) for code, members in self.vnets.items())
+
+    def datacentre(self, dc: int) -> dict:
+        """Return the description of a data centre as in routing-<DC>.json."""
+        host = self.host(dc)
+        services = [{'name': name, 'description': 'Synthetic %s service' % service,
+                     'url': 'https://%s/%s/' % (host, path)} for service, name, path in SERVICES]
+        return {'name': self.datacentres[dc], 'website': 'https://%s/' % host,
+                'fullName': 'Synthetic data centre %d' % dc, 'summary': 'Data centre for tests and benchmarks',
+                'repositories': [{'name': 'archive', 'description': 'Archive of continuous seismological data',
+                                  'website': 'https://%s/waveform/' % host, 'services': services,
+                                  'datasets': []}]}
+
+    def tables(self) -> tuple:
+        """Return the routing table, station cache, virtual networks and data centres as loaded by the service."""
+        return (self.routingtable(), self.stationtable(), self.vntable(),
+                [self.datacentre(dc) for dc in range(len(self.datacentres))])
+
+    def writerouting(self, filename: str, dc: int = None, vnets: bool = True):
+        """Write a routing file in XML format.
+
+        :param filename: Routing file to create
+        :type filename: str
+        :param dc: Only the routes of this data centre (all of them if None)
+        :type dc: int
+        :param vnets: Include the virtual networks
+        :type vnets: bool
+        """
+        with open(filename, 'w', encoding='utf-8') as fout:
+            fout.write('<?xml version="1.0" encoding="utf-8"?>\n')
+            fout.write('<ns0:routing xmlns:ns0="%s">\n' % NAMESPACE)
+            if vnets:
+                for code, members in self.vnets.items():
+                    fout.write(' <ns0:vnetwork networkCode="%s">\n' % code)
+                    for st, tw in members:
+                        fout.write('  <ns0:stream networkCode="%s" stationCode="%s" locationCode="%s" '
+                                   'streamCode="%s" start="%s" end="%s" />\n' %
+                                   (st.n, st.s, st.l, st.c, _date(tw.start), _date(tw.end)))
+                    fout.write(' </ns0:vnetwork>\n')
+            for st, rts, owner in self.streams:
+                if dc is not None and owner != dc:
+                    continue
+                fout.write(' <ns0:route networkCode="%s" stationCode="%s" locationCode="%s" streamCode="%s">\n' %
+                           (st.n, st.s, st.l, st.c))
+                for rt in rts:
+                    fout.write('  <ns0:%s address="%s" priority="%d" start="%s" end="%s" />\n' %
+                               (rt.service, rt.address, rt.priority, _date(rt.tw.start), _date(rt.tw.end)))
+                fout.write(' </ns0:route>\n')
+            fout.write('</ns0:routing>\n')
+
+    def write(self, directory: str, local: int = 0) -> str:
+        """Write the routing files of all data centres as updateAll.py expects them.
+
+        The routes of the local data centre and the virtual networks are written
+        in routing.xml and routing.json. The ones of the other data centres in
+        routing-<DC>.xml and routing-<DC>.json.
+
+        :param directory: Directory where the files are created
+        :type directory: str
+        :param local: Index of the local data centre
+        :type local: int
+        :returns: Value of the option *synchronize* to merge the files of the other data centres
+        :rtype: str
+        """
+        synchronize = list()
+        for dc, name in enumerate(self.datacentres):
+            base = 'routing' if dc == local else 'routing-%s' % name
+            self.writerouting(os.path.join(directory, base + '.xml'), dc, vnets=(dc == local))
+            with open(os.path.join(directory, base + '.json'), 'w') as fout:
+                json.dump(self.datacentre(dc), fout, indent=2)
+            if dc != local:
+                synchronize.append('%s, %s.xml' % (name, base))
+        return '\n'.join(synchronize)
+
+    def querystations(self, params: dict) -> List[Tuple[str, Station]]:
+        """Return the stations selected by the parameters of a query to a station-WS.
+
+        Only *net*, *sta*, *start* and *end* are considered.
+
+        :param params: Parameters of the query (values as strings)
+        :type params: dict
+        :returns: Pairs (network code, station) found
+        :rtype: list
+        """
+        net = params.get('net', params.get('network', '*'))
+        sta = params.get('sta', params.get('station', '*'))
+        start = str2date(params.get('start', params.get('starttime')) or None)
+        end = str2date(params.get('end', params.get('endtime')) or None)
+
+        result = list()
+        codes = [net] if net in self.stations else [c for c in self.stations if fnmatch(c, net)]
+        for code in codes:
+            for s in self.stations[code]:
+                if not fnmatch(s.name, sta):
+                    continue
+                if (end is not None and s.start >= end) or (start is not None and s.end is not None
+                                                             and s.end <= start):
+                    continue
+                result.append((code, s))
+        return result
+
+    def stationtext(self, params: dict) -> str:
+        """Return the response of a station-WS (format=text) to a query.
+
+        :param params: Parameters of the query (values as strings)
+        :type params: dict
+        :returns: Response or an empty string if no station was found (HTTP 204)
+        :rtype: str
+        """
+        lines = ['%s|%s|%s|%s|100|Synthetic station %s|%s|%s' %
+                 (code, s.name, s.latitude, s.longitude, s.name, _date(s.start), _date(s.end))
+                 for code, s in self.querystations(params)]
+        if not len(lines):
+            return ''
+        return '#Network|Station|Latitude|Longitude|Elevation|SiteName|StartTime|EndTime\n' + '\n'.join(lines) + '\n'
+
+    def stationapp(self, environ: dict, start_response) -> List[bytes]:
+        """WSGI application answering queries to the station-WS of all data centres (format=text).
+
+        It can be served with wsgiref to replace the station-WS in tests.
+        """
+        if not environ.get('PATH_INFO', '').endswith('/fdsnws/station/1/query'):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not found']
+
+        params = dict((k, v[0]) for k, v in parse_qs(environ.get('QUERY_STRING', '')).items())
+        try:
+            body = self.stationtext(params).encode('utf-8')
+        except Exception as e:
+            body = str(e).encode('utf-8')
+            start_response('400 Bad Request', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+            return [body]
+
+        status = '200 OK' if len(body) else '204 No Content'
+        start_response(status, [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+        return [body]
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""Timers to measure the phases of a request
+
+The timer of a request is kept per thread, so that the functions involved do
+not need to pass it around. If no timer was started, measuring a phase costs
+only one attribute lookup.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import threading
+from time import perf_counter
+
+
+class PhaseTimer(object):
+    """Accumulate the time spent in the phases of a request.
+
+    :platform: Any
+
+    """
+
+    def __init__(self):
+        """Constructor of PhaseTimer."""
+        self.startTime = perf_counter()
+        # Seconds spent in each phase (in the order they were first seen)
+        self.phases = dict()
+
+    def phase(self, name: str) -> '_Phase':
+        """Return a context manager measuring a phase with the given name."""
+        return _Phase(self, name)
+
+    def add(self, name: str, seconds: float):
+        """Add time to a phase. Phases can be measured many times."""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def total(self) -> float:
+        """Return the seconds since the timer was created."""
+        return perf_counter() - self.startTime
+
+    def header(self) -> str:
+        """Return the value of a Server-Timing header with all phases (in milliseconds)."""
+        metrics = ['%s;dur=%.3f' % (name, seconds * 1000) for name, seconds in self.phases.items()]
+        metrics.append('total;dur=%.3f' % (self.total() * 1000))
+        return ', '.join(metrics)
+
+
+class _Phase(object):
+    __slots__ = ('timer', 'name', 'startTime')
+
+    def __init__(self, timer: PhaseTimer, name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.startTime = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.add(self.name, perf_counter() - self.startTime)
+        return False
+
+
+class _NoPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+# Returned when there is no timer for the current request
+noPhase = _NoPhase()
+
+# Timer of the request being processed by each thread
+_local = threading.local()
+
+
+def start() -> PhaseTimer:
+    """Start a timer for the request processed by this thread."""
+    _local.timer = PhaseTimer()
+    return _local.timer
+
+
+def stop() -> PhaseTimer:
+    """Stop measuring the request processed by this thread and return its timer."""
+    timer = getattr(_local, 'timer', None)
+    _local.timer = None
+    return timer
+
+
+def current() -> PhaseTimer:
+    """Return the timer of the request processed by this thread (or None)."""
+    return getattr(_local, 'timer', None)
+
+
+def phase(name: str):
+    """Measure a phase of the current request.
+
+    To be used in a *with* statement. If no timer was started in this thread
+    nothing is measured.
+
+    :param name: Name of the phase (f.i. 'vn2real')
+    :type name: str
+    """
+    timer = getattr(_local, 'timer', None)
+    if timer is None:
+        return noPhase
+    return _Phase(timer, name)
+
+
+def mark() -> float:
+    """Return the time from which a phase is measured (see :func:`record`)."""
+    return perf_counter()
+
+
+def record(name: str, since: float) -> float:
+    """Add the time elapsed since *since* to a phase of the current request.
+
+    To measure long blocks without a *with* statement. If no timer was
+    started in this thread nothing is measured.
+
+    :param name: Name of the phase (f.i. 'match')
+    :type name: str
+    :param since: Value returned by :func:`mark` (or by a previous call)
+    :type since: float
+    :returns: Current time, from which the next phase can be measured
+    :rtype: float
+    """
+    now = perf_counter()
+    timer = getattr(_local, 'timer', None)
+    if timer is not None:
+        timer.add(name, now - since)
+    return now
@@ -16,20 +16,33 @@ any later version.
 """
 
 import os
+import gc
+import re
 import datetime
+import functools
 import fnmatch
 import json
-import xml.etree.cElementTree as ET
 from collections import namedtuple
+from collections import ChainMap
 import logging
 from copy import deepcopy
 import pickle
 import configparser
+import hashlib
+import zlib
+import codecs
+import threading
+import time
 import urllib.request as ul
 from urllib.parse import urlparse
 from urllib.error import URLError
 from numbers import Number
-from typing import List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import cacheRequests
+from .metrics import tableReloads
+from . import timing
+from .timing import phase
+from typing import Iterable, List, Tuple, Union
 
 
 __version__ = "1.2.3"
@@ -690,9 +703,32 @@ class FDSNRules(dict):
                 self['datacenters'].append(r)
 
 
+# Dates which can be read with datetime.fromisoformat giving the same result as
+# str2date. The fraction of a second must have 6 digits, because str2date reads
+# it as an integer number of microseconds.
+ISODATE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}([T ][0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]{6})?)?Z?')
+# Maximum number of strings kept by str2date with their datetime
+DATECACHE = 16384
+
+
+@functools.lru_cache(maxsize=DATECACHE)
+def _str2date(dstr: str) -> datetime.datetime:
+    """Transform a non empty string to a datetime and remember the last ones converted."""
+    if ISODATE.fullmatch(dstr):
+        return datetime.datetime.fromisoformat(dstr.rstrip('Z'))
+
+    dateparts = dstr.replace('-', ' ').replace('T', ' ')
+    dateparts = dateparts.replace(':', ' ').replace('.', ' ')
+    dateparts = dateparts.replace('Z', '').split()
+    return datetime.datetime(*map(int, dateparts))
+
+
 def str2date(dstr: Union[str, None]) -> Union[datetime.datetime, None]:
     """Transform a string to a datetime.
 
+    The same datetime instance is returned for a string converted recently.
+    Routing files and station epochs repeat the same dates very often.
+
     :param dstr: A datetime in ISO format.
     :type dstr: string
     :return: A datetime represented the converted input.
@@ -702,10 +738,7 @@ def str2date(dstr: Union[str, None]) -> Union[datetime.datetime, None]:
     if dstr is None or not len(dstr):
         return None
 
-    dateparts = dstr.replace('-', ' ').replace('T', ' ')
-    dateparts = dateparts.replace(':', ' ').replace('.', ' ')
-    dateparts = dateparts.replace('Z', '').split()
-    return datetime.datetime(*map(int, dateparts))
+    return _str2date(dstr)
 
 
 def date2str(dt: datetime.datetime) -> str:
@@ -746,20 +779,280 @@ def checkOverlap(str1: Stream, routelist: list, str2: Stream, route: Route) -> b
     return False
 
 
-def getStationCache(st: Stream, rt: Route) -> List[Station]:
-    """Retrieve station name and location from a particular station service.
+class OverlapIndex(object):
+    """Index of the streams of a routing table to find overlaps efficiently.
+
+    Streams are indexed by network and station code. The streams with a
+    wildcard in one of these codes are kept apart, as they could overlap
+    with any code. The candidates are returned in the same order as the
+    keys of the routing table, so that the first overlap found is always the
+    same as when checking all of them.
+
+    :param routingtable: Routing table to index
+    :type routingtable: dict
+    """
+
+    def __init__(self, routingtable: dict):
+        self.routingTable = routingtable
+        # Position of every stream in the routing table
+        self.order = dict()
+        self.last = 0
+        # Streams with a wildcard in the network code
+        self.netWildcard = list()
+        # Per network: streams indexed by station code and with a wildcard in the station code
+        self.netIndex = dict()
+        for st in routingtable.keys():
+            self.add(st)
+
+    @staticmethod
+    def _wildcard(code: Union[str, None]) -> bool:
+        return (code is None) or haswildcard(code)
+
+    def add(self, stream: Stream):
+        """Add a new stream to the index.
+
+        :param stream: Key just added to the routing table
+        :type stream: :class:`~Stream`
+        """
+        if stream in self.order:
+            return
+        self.order[stream] = self.last
+        self.last += 1
+
+        if self._wildcard(stream.n):
+            self.netWildcard.append(stream)
+            return
+
+        staIndex, staWildcard = self.netIndex.setdefault(stream.n, (dict(), list()))
+        if self._wildcard(stream.s):
+            staWildcard.append(stream)
+        else:
+            staIndex.setdefault(stream.s, list()).append(stream)
+
+    def remove(self, stream: Stream):
+        """Remove a stream from the index (f.i. if it was not finally added to the routing table).
+
+        :param stream: Key of the routing table
+        :type stream: :class:`~Stream`
+        """
+        if self.order.pop(stream, None) is None:
+            return
+
+        if self._wildcard(stream.n):
+            self.netWildcard.remove(stream)
+            return
+
+        staIndex, staWildcard = self.netIndex[stream.n]
+        if self._wildcard(stream.s):
+            staWildcard.remove(stream)
+        else:
+            staIndex[stream.s].remove(stream)
+
+    def candidates(self, stream: Stream) -> list:
+        """Return the streams which could overlap with *stream* in the order of the routing table.
+
+        :param stream: Stream to check
+        :type stream: :class:`~Stream`
+        :returns: Streams of the routing table
+        :rtype: list
+        """
+        if self._wildcard(stream.n):
+            return list(self.order)
+
+        result = list(self.netWildcard)
+        if stream.n in self.netIndex:
+            staIndex, staWildcard = self.netIndex[stream.n]
+            result.extend(staWildcard)
+            if self._wildcard(stream.s):
+                for streams in staIndex.values():
+                    result.extend(streams)
+            else:
+                result.extend(staIndex.get(stream.s, list()))
+
+        result.sort(key=self.order.__getitem__)
+        return result
+
+    def overlap(self, stream: Stream, route: Route, routingtable=None) -> Union[Stream, None]:
+        """Return the first stream in the routing table with a route overlapping with the one given.
+
+        :param stream: Stream of the route to check
+        :type stream: :class:`~Stream`
+        :param route: Route to check
+        :type route: :class:`~Route`
+        :param routingtable: Routes of the streams indexed if they are not the ones of the routing table
+        :type routingtable: dict
+        :returns: Stream which overlaps or None
+        :rtype: :class:`~Stream`
+        """
+        if routingtable is None:
+            routingtable = self.routingTable
+
+        for testStr in self.candidates(stream):
+            # This checks the overlap of Streams and also
+            # of timewindows and priority
+            if checkOverlap(testStr, routingtable[testStr], stream, route):
+                return testStr
+        return None
+
+
+class RoutingTransaction(object):
+    """Routes and virtual networks checked before modifying the routing tables.
+
+    The routes of a source are checked against the routing table and the
+    routes staged before. The tables are only modified by :meth:`commit`, so
+    that a source which cannot be added completely leaves no routes in the
+    tables. The :class:`OverlapIndex` of the routing table is kept between
+    transactions.
+
+    :param routingtable: Routing table where routes should be added to
+    :type routingtable: dict
+    :param vntable: Table with virtual networks where aliases should be added
+    :type vntable: dict
+    :param allowOverlaps: Specify if overlapping routes should be added anyway
+    :type allowOverlaps: bool
+    """
+
+    def __init__(self, routingtable: dict, vntable: dict = None, allowOverlaps: bool = False):
+        self.routingTable = routingtable
+        self.vnTable = vntable if vntable is not None else dict()
+        self.allowOverlaps = allowOverlaps
+        self.index = OverlapIndex(routingtable)
+
+        # New lists of routes and streams of the virtual networks
+        self.routes = dict()
+        self.vnets = dict()
+        # Streams not present in the routing table
+        self.new = list()
+
+    def stage(self, routes: List[Tuple[Stream, Route]], vnets: List[Tuple[Union[str, None], Stream, TW]] = (),
+              filename: str = ''):
+        """Check routes and virtual networks and keep them until :meth:`commit` is called.
+
+        :param routes: Tuples (:class:`~Stream`, :class:`~Route`) as returned by :func:`parserouting`
+        :type routes: list
+        :param vnets: Tuples (code, :class:`~Stream`, :class:`~TW`) as returned by :func:`parserouting`
+        :type vnets: list
+        :param filename: File where the routes were read from (for the log messages)
+        :type filename: str
+        :raises Exception: If the routes cannot be added. :meth:`discard` should be called then.
+        """
+        logs = logging.getLogger('addroutes')
+
+        staged = self.routes
+        view = ChainMap(staged, self.routingTable)
+
+        for st, rt in routes:
+            # Check the overlap between the routes to import
+            # and the ones already present in the main Routing
+            # table
+            addIt = True
+            logs.debug('[RT] Checking %s' % str(st))
+            testStr = self.index.overlap(st, rt, view)
+            if testStr is not None:
+                msg = '%s: Overlap between %s and %s!\n'\
+                    % (filename, st, testStr)
+                logs.error(msg)
+                if not self.allowOverlaps:
+                    logs.error('Skipping %s\n' % str(st))
+                    addIt = False
+
+            if not addIt:
+                logs.warning('Skip %s - %s\n' % (st, rt))
+            elif st not in view:
+                staged[st] = [rt]
+                self.new.append(st)
+                self.index.add(st)
+            else:
+                if st not in staged:
+                    staged[st] = list(self.routingTable[st])
+                staged[st].append(rt)
+
+        # Order the routes by priority
+        for routelist in staged.values():
+            routelist.sort()
+
+        for vnCode, st, tw in vnets:
+            if vnCode not in self.vnets:
+                self.vnets[vnCode] = list(self.vnTable.get(vnCode, list()))
+            self.vnets[vnCode].append((st, tw))
+
+    def commit(self):
+        """Add all routes and virtual networks staged to the tables."""
+        self.routingTable.update(self.routes)
+        self.vnTable.update(self.vnets)
+        self.routes = dict()
+        self.vnets = dict()
+        self.new = list()
+
+    def discard(self):
+        """Forget all routes and virtual networks staged. The tables are not modified."""
+        for st in self.new:
+            self.index.remove(st)
+        self.routes = dict()
+        self.vnets = dict()
+        self.new = list()
+
+
+def stationquery(st: Stream, rt: Route) -> str:
+    """Return the query to a station-WS for the stations of a stream.
 
     :param st: Stream for which a cache should be saved.
     :type st: Stream
     :param rt: Route where this stream is archived.
     :type rt: Route
-    :returns: Stations found in this route for this stream pattern.
-    :rtype: list
+    :returns: URL of the query (format=text)
+    :rtype: str
     """
     query = '%s?format=text&net=%s&sta=%s&start=%s' % \
             (rt.address, st.n, st.s, rt.tw.start.isoformat())
     if rt.tw.end is not None:
         query = query + '&end=%s' % rt.tw.end.isoformat()
+    return query
+
+
+def parsestations(lines: Iterable[str], st: Stream, rt: Route, warn: bool = True) -> List[Station]:
+    """Parse the lines of a response from a station-WS (format=text).
+
+    :param lines: Lines of the response
+    :type lines: iterable
+    :param st: Stream for which a cache should be saved.
+    :type st: Stream
+    :param rt: Route where this stream is archived.
+    :type rt: Route
+    :param warn: Log a warning if no stations are found
+    :type warn: bool
+    :returns: Stations found in this route for this stream pattern.
+    :rtype: list
+    """
+    result = list()
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        lsplit = line.split('|')
+        try:
+            start = str2date(lsplit[6])
+            endt = str2date(lsplit[7])
+            result.append(Station(lsplit[1], float(lsplit[2]),
+                          float(lsplit[3]), start, endt))
+        except Exception:
+            logging.error('Error trying to add station with this line (%s)' % (lsplit,))
+    if warn and not len(result):
+        logging.warning('No stations found for streams %s in %s' %
+                        (st, rt.address))
+    return result
+
+
+def getStationCache(st: Stream, rt: Route) -> List[Station]:
+    """Retrieve station name and location from a particular station service.
+
+    :param st: Stream for which a cache should be saved.
+    :type st: Stream
+    :param rt: Route where this stream is archived.
+    :type rt: Route
+    :returns: Stations found in this route for this stream pattern.
+    :rtype: list
+    """
+    query = stationquery(st, rt)
 
     logging.debug(query)
 
@@ -782,34 +1075,33 @@ def getStationCache(st: Stream, rt: Route) -> List[Station]:
         logging.warning('WATCH THIS! %s' % e)
         return list()
 
-    result = list()
-    for line in buf.splitlines():
-        if line.startswith('#'):
-            continue
-        lsplit = line.split('|')
-        try:
-            start = str2date(lsplit[6])
-            endt = str2date(lsplit[7])
-            result.append(Station(lsplit[1], float(lsplit[2]),
-                          float(lsplit[3]), start, endt))
-        except Exception:
-            logging.error('Error trying to add station with this line (%s)' % (lsplit,))
-    # print(result)
-    if not len(result):
-        logging.warning('No stations found for streams %s in %s' %
-                        (st, rt.address))
-    return result
+    return parsestations(buf.splitlines(), st, rt)
 
 
-def cachestations(routingtable: dict, stationtable: dict):
+def cachestations(routingtable: dict, stationtable: dict, cache=None, workers: int = 16, perhost: int = 4):
     """Loop for all station-WS and cache all station names and locations.
 
+    The station-WS are queried in parallel (see :func:`~routeutils.stationws.harvest`).
+
     :param routingtable: Routing table.
     :type routingtable: dict
     :param stationtable: Cache with names and locations of stations.
     :type stationtable: dict
+    :param cache: Stations saved in previous runs
+    :type cache: :class:`~routeutils.stationws.StationCache`
+    :param workers: Maximum number of queries in progress at the same time
+    :type workers: int
+    :param perhost: Maximum number of connections open at the same time to a station-WS
+    :type perhost: int
     """
+    # Imported here to avoid a circular import
+    from .stationws import harvest
+
     ptrt = routingtable
+
+    harvested = harvest([(st, rt) for st in ptrt.keys() for rt in ptrt[st] if rt.service == 'station'],
+                        workers, perhost, cache=cache)
+
     for st in ptrt.keys():
         # Set a default result
         result = None
@@ -818,10 +1110,11 @@ def cachestations(routingtable: dict, stationtable: dict):
         services = set(urlparse(rt.address).netloc for rt in ptrt[st])
         for rt in ptrt[st]:
             if rt.service == 'station':
+                # The same query could be needed by other streams
                 if result is None:
-                    result = getStationCache(st, rt)
+                    result = list(harvested[stationquery(st, rt)])
                 else:
-                    result.extend(getStationCache(st, rt))
+                    result.extend(harvested[stationquery(st, rt)])
 
         if result is None:
             logging.warning('No Station-WS defined for this stream! No cache!')
@@ -836,6 +1129,36 @@ def cachestations(routingtable: dict, stationtable: dict):
                 stationtable[service][st] = result
 
 
+def parsevirtualnets(filename: str) -> List[Tuple[Union[str, None], Stream, TW]]:
+    """Read the routing file in XML format and return its VNs in order.
+
+    :param filename: File with virtual networks in XML format
+    :type filename: str
+    :returns: Tuples (code, :class:`~Stream`, :class:`~TW`) in the order they were found
+    :rtype: list
+    :raises Exception: An exception is raised to signal a higher level that data should be read from somewhere else.
+    """
+    return parserouting(filename)[1]
+
+
+def insertvirtualnets(vnets: List[Tuple[Union[str, None], Stream, TW]], vntable: dict) -> dict:
+    """Add the streams of virtual networks to a table of VNs.
+
+    :param vnets: Tuples (code, :class:`~Stream`, :class:`~TW`) as returned by :func:`parsevirtualnets`
+    :type vnets: list
+    :param vntable: Table with virtual networks where aliases should be added
+    :type vntable: dict
+    :returns: Updated table of virtual networks
+    :rtype: dict
+    """
+    for vnCode, st, tw in vnets:
+        if vnCode not in vntable:
+            vntable[vnCode] = [(st, tw)]
+        else:
+            vntable[vnCode].append((st, tw))
+    return vntable
+
+
 def addvirtualnets(filename: str, dryrun: bool = False, **kwargs) -> dict:
     """Read the routing file in XML format and store its VNs in memory.
 
@@ -862,131 +1185,106 @@ def addvirtualnets(filename: str, dryrun: bool = False, **kwargs) -> dict:
     logs = logging.getLogger('addvirtualnets')
     logs.debug('Entering addvirtualnets()\n')
 
-    try:
-        vnHandle = open(filename, 'r', encoding='utf-8')
-    except Exception:
-        msg = 'Error: %s could not be opened.\n'
-        logs.error(msg % filename)
-        raise Exception(msg % filename)
+    vnets = parsevirtualnets(filename)
+    if not dryrun:
+        insertvirtualnets(vnets, ptvn)
 
-    # Traverse through the virtual networks
-    # get an iterable
-    try:
-        context = ET.iterparse(vnHandle, events=("start", "end"))
-    except IOError as e:
-        logs.error(str(e))
-        raise Exception(str(e))
+    return ptvn
 
-    # turn it into an iterator
-    context = iter(context)
 
-    # get the root element
-    if hasattr(context, 'next'):
-        event, root = context.next()
-    else:
-        event, root = next(context)
+def _parseexpat(filename: str):
+    """Parse a routing file with :class:`~routeutils.expatparser.RoutingHandler`.
+
+    :returns: The handler and the exception raised while parsing (or None)
+    :rtype: tuple
+    """
+    from .expatparser import RoutingHandler
+
+    handler = RoutingHandler(filename)
+    with open(filename, 'rb') as fin:
+        try:
+            handler.parse(fin)
+        except Exception as e:
+            return handler, e
+    return handler, None
+
+
+def parserouting(filename: str) -> Tuple[List[Tuple[Stream, Route]], List[Tuple[Union[str, None], Stream, TW]]]:
+    """Read the routing file in XML format and return its routes and VNs in order.
+
+    The file is read only once with expat and no tree of elements is built
+    (see :mod:`~routeutils.expatparser`). The result and the checks of every
+    route (wildcards, time window, address) are the same as in the previous
+    parser based on ElementTree (bench/parserET.py). The overlaps with other
+    routes are checked by :func:`insertroutes`.
 
-    # Check that it is really an inventory
-    if root.tag[-len('routing'):] != 'routing':
-        msg = 'The file parsed seems not to be a routing file (XML).\n'
+    :param filename: File with routes and virtual networks in XML format
+    :type filename: str
+    :returns: Tuples (:class:`~Stream`, :class:`~Route`) and tuples (code, :class:`~Stream`, :class:`~TW`) in the order they were found
+    :rtype: tuple
+    :raises Exception: An exception is raised to signal a higher level that data should be read from somewhere else.
+    """
+    logs = logging.getLogger('addroutes')
+    logs.debug('Entering parserouting(%s)\n' % filename)
+
+    handler, error = _parseexpat(filename)
+    # The root element could not even be read
+    if error is not None and handler.root is None:
+        msg = 'Error: %s could not be parsed. Reading backup!\n' % filename
         logs.error(msg)
-        raise Exception(msg)
+        os.replace(filename, filename + '.wrong')
+        try:
+            os.replace(filename + '.bck', filename)
+            handler, error = _parseexpat(filename)
+        except Exception:
+            handler = None
+        if handler is None or handler.root is None:
+            raise Exception('Error: %s and even its backup version could not be loaded!\n' % filename)
 
-    # Extract the namespace from the root node
-    namesp = root.tag[:-len('routing')]
+    if error is not None:
+        raise error
 
-    for event, vnet in context:
-        # The tag of this node should be "route".
-        # Now it is not being checked because
-        # we need all the data, but if we need to filter, this
-        # is the place.
-        #
-        if event == "end":
-            if vnet.tag == namesp + 'vnetwork':
+    return handler.routes, handler.vnets
 
-                # Extract the network code
-                try:
-                    vnCode = vnet.get('networkCode')
-                    if len(vnCode) == 0:
-                        vnCode = None
-                except Exception:
-                    vnCode = None
-
-                # Traverse through the sources
-                for stream in vnet:
-                    # Extract the networkCode
-                    msg = 'Only the * wildcard is allowed in virtual nets.'
-                    try:
-                        net = stream.get('networkCode')
-                        if (('?' in net) or
-                                (('*' in net) and (len(net) > 1))):
-                            logs.warning(msg)
-                            continue
-                    except Exception:
-                        net = '*'
-
-                    # Extract the stationCode
-                    try:
-                        sta = stream.get('stationCode')
-                        if (('?' in sta) or
-                                (('*' in sta) and (len(sta) > 1))):
-                            logs.warning(msg)
-                            continue
-                    except Exception:
-                        sta = '*'
-
-                    # Extract the locationCode
-                    try:
-                        loc = stream.get('locationCode')
-                        if (('?' in loc) or
-                                (('*' in loc) and (len(loc) > 1))):
-                            logs.warning(msg)
-                            continue
-                    except Exception:
-                        loc = '*'
-
-                    # Extract the streamCode
-                    try:
-                        cha = stream.get('streamCode')
-                        if (('?' in cha) or
-                                (('*' in cha) and (len(cha) > 1))):
-                            logs.warning(msg)
-                            continue
-                    except Exception:
-                        cha = '*'
-
-                    try:
-                        auxStart = stream.get('start', None)
-                        startD = str2date(auxStart)
-                    except Exception:
-                        startD = None
-                        msg = 'Error while converting START attribute.\n'
-                        logs.warning(msg)
-
-                    try:
-                        auxEnd = stream.get('end', None)
-                        endD = str2date(auxEnd)
-                    except Exception:
-                        endD = None
-                        msg = 'Error while converting END attribute.\n'
-                        logs.warning(msg)
-
-                    if not dryrun:
-                        if vnCode not in ptvn:
-                            ptvn[vnCode] = [(Stream(net, sta, loc, cha),
-                                             TW(startD, endD))]
-                        else:
-                            ptvn[vnCode].append((Stream(net, sta, loc, cha),
-                                                 TW(startD, endD)))
-
-                    stream.clear()
-
-                vnet.clear()
-
-            # FIXME Probably the indentation below is wrong.
-            root.clear()
 
-    return ptvn
+def parseroutes(filename: str) -> List[Tuple[Stream, Route]]:
+    """Read the routing file in XML format and return its routes in order.
+
+    All the checks of a single route (wildcards, time window, address) are done
+    here. The overlaps with other routes are checked by :func:`insertroutes`.
+
+    :param filename: File with routes in XML format
+    :type filename: str
+    :returns: Tuples (:class:`~Stream`, :class:`~Route`) in the order they were found
+    :rtype: list
+    :raises Exception: An exception is raised to signal a higher level that data should be read from somewhere else.
+    """
+    return parserouting(filename)[0]
+
+
+def insertroutes(routes: List[Tuple[Stream, Route]], routingtable: dict, dryrun: bool = False,
+                 allowOverlaps: bool = False, filename: str = '') -> dict:
+    """Add routes to a routing table checking the overlaps with the ones already present.
+
+    :param routes: Tuples (:class:`~Stream`, :class:`~Route`) as returned by :func:`parseroutes`
+    :type routes: list
+    :param routingtable: Routing Table where routes should be added to
+    :type routingtable: dict
+    :param dryrun: If this is set, do all the checks, but skip any modification
+    :type dryrun: bool
+    :param allowOverlaps: Specify if overlapping routes should be added anyway
+    :type allowOverlaps: bool
+    :param filename: File where the routes were read from (for the log messages)
+    :type filename: str
+    :returns: Updated routing table
+    :rtype: dict
+    """
+    transaction = RoutingTransaction(routingtable, allowOverlaps=allowOverlaps)
+    transaction.stage(routes, filename=filename)
+    if not dryrun:
+        transaction.commit()
+
+    return routingtable
 
 
 def addroutes(filename: str, dryrun: bool = False, **kwargs) -> dict:
@@ -1008,6 +1306,7 @@ def addroutes(filename: str, dryrun: bool = False, **kwargs) -> dict:
 
     :Keyword Arguments:
         * *routingtable* (``dict``) Routing Table where routes should be added to.
+        * *allowOverlaps* (``bool``) Add routes even if they overlap existing ones.
     """
     # Routing table is empty (default)
     ptrt = kwargs.get('routingtable', dict())
@@ -1021,224 +1320,7 @@ def addroutes(filename: str, dryrun: bool = False, **kwargs) -> dict:
     logs.debug('Overlaps between routes will ' +
                ('' if allowOverlaps else 'NOT ' + 'be allowed'))
 
-    with open(filename, 'r', encoding='utf-8') as testFile:
-        # Parse the routing file
-        # Traverse through the networks
-        # get an iterable
-        try:
-            context = ET.iterparse(testFile, events=("start", "end"))
-        except IOError:
-            msg = 'Error: %s could not be parsed. Skipping it!\n' % filename
-            logs.error(msg)
-            raise Exception(msg)
-
-        # turn it into an iterator
-        context = iter(context)
-
-        try:  
-            # get the root element
-            # More Python 3 compatibility
-            if hasattr(context, 'next'):
-                event, root = context.next()
-            else:
-                event, root = next(context)
-        except Exception:
-            msg = 'Error: %s could not be parsed. Reading backup!\n' % filename
-            logs.error(msg)
-            testFile.close()
-            os.replace(filename, filename + '.wrong')
-            try:
-                os.replace(filename + '.bck', filename)
-                testFile = open(filename, 'r', encoding='utf-8')
-                context = ET.iterparse(testFile, events=("start", "end"))
-                context = iter(context)
-                # get the root element
-                # More Python 3 compatibility
-                if hasattr(context, 'next'):
-                    event, root = context.next()
-                else:
-                    event, root = next(context)
-            except Exception:
-                raise Exception('Error: %s and even its backup version could not be loaded!\n' % filename)
-            
-        # Check that it is really an inventory
-        try:
-            assert root.tag[-len('routing'):] == 'routing'
-        except Exception:
-            msg = '%s seems not to be a routing file (XML). Skipping it!\n' \
-                  % filename
-            logs.error(msg)
-            raise Exception(msg)
-
-        # Extract the namespace from the root node
-        namesp = root.tag[:-len('routing')]
-
-        for event, route in context:
-            # The tag of this node should be "route".
-            # Now it is not being checked because
-            # we need all the data, but if we need to filter, this
-            # is the place.
-            #
-            if event == "end":
-                if route.tag == namesp + 'route':
-
-                    # Extract the location code
-                    try:
-                        locationCode = route.get('locationCode', default='*')
-                        if len(locationCode) == 0:
-                            locationCode = '*'
-
-                        # Do not allow "?" wildcard in the input, because it
-                        # will be impossible to match with the user input if
-                        # this also has a mixture of "*" and "?"
-                        if '?' in locationCode:
-                            logs.error('Wildcard "?" is not allowed!')
-                            continue
-
-                    except Exception:
-                        locationCode = '*'
-
-                    # Extract the network code
-                    try:
-                        networkCode = route.get('networkCode', default='*')
-                        if len(networkCode) == 0:
-                            networkCode = '*'
-
-                        # Do not allow "?" wildcard in the input, because it
-                        # will be impossible to match with the user input if
-                        # this also has a mixture of "*" and "?"
-                        if '?' in networkCode:
-                            logs.error('Wildcard "?" is not allowed!')
-                            continue
-
-                    except Exception:
-                        networkCode = '*'
-
-                    # Extract the station code
-                    try:
-                        stationCode = route.get('stationCode', default='*')
-                        if len(stationCode) == 0:
-                            stationCode = '*'
-
-                        # Do not allow "?" wildcard in the input, because it
-                        # will be impossible to match with the user input if
-                        # this also has a mixture of "*" and "?"
-                        if '?' in stationCode:
-                            logs.error('Wildcard "?" is not allowed!')
-                            continue
-
-                    except Exception:
-                        stationCode = '*'
-
-                    # Extract the stream code
-                    try:
-                        streamCode = route.get('streamCode', default='*')
-                        if len(streamCode) == 0:
-                            streamCode = '*'
-
-                        # Do not allow "?" wildcard in the input, because it
-                        # will be impossible to match with the user input if
-                        # this also has a mixture of "*" and "?"
-                        if '?' in streamCode:
-                            logs.error('Wildcard "?" is not allowed!')
-                            continue
-
-                    except Exception:
-                        streamCode = '*'
-
-                    # Traverse through the sources
-                    for serv in route:
-                        assert serv.tag[:len(namesp)] == namesp
-
-                        service = serv.tag[len(namesp):]
-                        att = serv.attrib
-
-                        # Extract the address (mandatory)
-                        try:
-                            address = att.get('address')
-                            if len(address) == 0:
-                                logs.error('Could not add %s' % att)
-                                continue
-                        except Exception:
-                            logs.error('Could not add %s' % att)
-                            continue
-
-                        try:
-                            auxStart = att.get('start', None)
-                            startD = str2date(auxStart)
-                        except Exception:
-                            startD = None
-
-                        # Extract the end datetime
-                        try:
-                            auxEnd = att.get('end', None)
-                            endD = str2date(auxEnd)
-                        except Exception:
-                            endD = None
-
-                        # Check that the time window is reasonable
-                        if (startD is not None) and (endD is not None) and (startD > endD):
-                            logs.error('Starttime is later than the endtime! %s.%s %s %s' % (networkCode,
-                                                                                             stationCode,
-                                                                                             startD, endD))
-                            continue
-
-                        # Extract the priority
-                        try:
-                            priority = att.get('priority', '99')
-                            if len(priority) == 0:
-                                priority = 99
-                            else:
-                                priority = int(priority)
-                        except Exception:
-                            priority = 99
-
-                        # Append the network to the list of networks
-                        st = Stream(networkCode, stationCode, locationCode,
-                                    streamCode)
-                        tw = TW(startD, endD)
-                        rt = Route(service, address, tw, priority)
-
-                        try:
-                            # Check the overlap between the routes to import
-                            # and the ones already present in the main Routing
-                            # table
-                            addIt = True
-                            logs.debug('[RT] Checking %s' % str(st))
-                            for testStr in ptrt.keys():
-                                # This checks the overlap of Streams and also
-                                # of timewindows and priority
-                                if checkOverlap(testStr, ptrt[testStr], st,
-                                                rt):
-                                    msg = '%s: Overlap between %s and %s!\n'\
-                                        % (filename, st, testStr)
-                                    logs.error(msg)
-                                    if not allowOverlaps:
-                                        logs.error('Skipping %s\n' % str(st))
-                                        addIt = False
-                                    break
-
-                            if not dryrun:
-                                if addIt:
-                                    ptrt[st].append(rt)
-                                else:
-                                    logs.warning('Skip %s - %s\n' % (st, rt))
-
-                        except KeyError:
-                            if not dryrun:
-                                ptrt[st] = [rt]
-                        serv.clear()
-
-                    route.clear()
-
-                root.clear()
-
-    # Order the routes by priority
-    if not dryrun:
-        for keyDict in ptrt:
-            ptrt[keyDict] = sorted(ptrt[keyDict])
-
-    return ptrt
+    return insertroutes(parseroutes(filename), ptrt, dryrun, allowOverlaps, filename)
 
 
 def replacelast(s: str, old: str, new: str):
@@ -1246,7 +1328,7 @@ def replacelast(s: str, old: str, new: str):
 
 
 # FIXME It is probably better to swap the first two parameters
-def addremote(filename: str, url: str, method: str = 'localconfig'):
+def addremote(filename: str, url: str, method: str = 'localconfig', timeout: float = None):
     """Read the routing file from a remote datacenter and store it in memory.
 
     All the routing information is read into a dictionary. Only the
@@ -1258,6 +1340,8 @@ def addremote(filename: str, url: str, method: str = 'localconfig'):
     :type url: str
     :param method: Method from the remote RS to be called
     :type method: str
+    :param timeout: Timeout in seconds of the connection to the remote datacenter
+    :type timeout: float
     :raise: Exception
 
     """
@@ -1282,6 +1366,12 @@ def addremote(filename: str, url: str, method: str = 'localconfig'):
     else:
         pass
 
+    # Validators of the version downloaded the last time from this URL
+    meta = remotemeta(filename) if os.path.exists(filename) else dict()
+    if meta.get('url') != url:
+        meta = dict()
+    validators = None
+
     # Connect to the proper Routing-WS or file
     try:
         if url.startswith('http://') or url.startswith('https://'):
@@ -1289,28 +1379,49 @@ def addremote(filename: str, url: str, method: str = 'localconfig'):
             req = ul.Request(url)
             # Customize the default User-Agent header value:
             req.add_header('User-Agent', 'RoutingService/' + __version__)
-            u = ul.urlopen(req)
+            req.add_header('Accept-Encoding', 'gzip')
+            # Ask only for a new version
+            if meta.get('etag') is not None:
+                req.add_header('If-None-Match', meta['etag'])
+            if meta.get('lastmodified') is not None:
+                req.add_header('If-Modified-Since', meta['lastmodified'])
+            u = ul.urlopen(req, timeout=timeout)
+            validators = {'url': url, 'etag': u.headers.get('ETag'),
+                          'lastmodified': u.headers.get('Last-Modified')}
+            gzipped = u.headers.get('Content-Encoding', '').lower() == 'gzip'
         else:
             u = open(url, 'r')
+            gzipped = False
+
+        # Data compressed by the server is decompressed while it is read
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        # Characters can be split between blocks
+        decoder = codecs.getincrementaldecoder('utf-8')()
 
         with open(dwld_file, 'w', encoding='utf-8') as routeExt:
             logs.debug('%s opened\n%s:' % (dwld_file, url))
             # Read the data in blocks of predefined size
             buf = u.read(blockSize)
-            if isinstance(buf, bytes):
-                buf = buf.decode('utf-8')
             while len(buf):
                 logs.debug('.')
+                if isinstance(buf, bytes):
+                    if inflater is not None:
+                        buf = inflater.decompress(buf)
+                    buf = decoder.decode(buf)
                 # Return one block of data
                 routeExt.write(buf)
                 buf = u.read(blockSize)
-                if isinstance(buf, bytes):
-                    buf = buf.decode('utf-8')
+            routeExt.write(decoder.decode(inflater.flush() if inflater is not None else b'', final=True))
 
             # Close the connection to avoid overloading the server
             u.close()
 
     except URLError as e:
+        if getattr(e, 'code', None) == 304:
+            # Not Modified. Keep the current version (and its backup)
+            logs.info('%s not modified since the last download' % url)
+            return
+
         if hasattr(e, 'reason'):
             logs.warning('URL non valid: %s/%s - Reason: %s' % (url, method, e.reason))
         elif hasattr(e, 'code'):
@@ -1336,11 +1447,286 @@ def addremote(filename: str, url: str, method: str = 'localconfig'):
         raise Exception('Could not create the final version of %s.xml' %
                         os.path.basename(filename))
 
+    if validators is not None:
+        savemeta(filename, validators)
+
+
+def remotemeta(filename: str) -> dict:
+    """Return the URL, ETag and Last-Modified of the last version of a file downloaded by :func:`~addremote`.
+
+    :param filename: File downloaded
+    :type filename: str
+    :returns: Values saved with the file or an empty dictionary
+    :rtype: dict
+    """
+    try:
+        with open(filename + '.meta') as fin:
+            return json.load(fin)
+    except Exception:
+        return dict()
+
+
+def savemeta(filename: str, validators: dict):
+    """Save the URL, ETag and Last-Modified of a file downloaded next to it (*filename*.meta).
+
+    :param filename: File downloaded
+    :type filename: str
+    :param validators: Values to save (keys url, etag, lastmodified)
+    :type validators: dict
+    """
+    with open(filename + '.meta.tmp', 'w') as fout:
+        json.dump(validators, fout)
+    os.replace(filename + '.meta.tmp', filename + '.meta')
+
+
+def addremotes(remotes: dict, directory: str = '.', workers: int = 4, timeout: float = 60) -> dict:
+    """Download the routes and data centre information from many remote datacenters at the same time.
+
+    For every datacenter the routes are saved in routing-<DCID>.xml and the
+    information about the data centre in routing-<DCID>.json (see
+    :func:`~addremote`). The files of a datacenter are downloaded one after
+    the other, but up to *workers* datacenters are contacted in parallel.
+
+    :param remotes: Base URL of the Routing Service indexed by datacenter ID
+    :type remotes: dict
+    :param directory: Directory where the files should be saved
+    :type directory: str
+    :param workers: Maximum number of datacenters contacted at the same time
+    :type workers: int
+    :param timeout: Timeout in seconds of the connections to every datacenter
+    :type timeout: float
+    :returns: Exception raised while downloading the files of each datacenter or None
+    :rtype: dict
+    """
+    def download(dcid: str, url: str):
+        addremote(os.path.join(directory, 'routing-%s.xml' % dcid), url, timeout=timeout)
+        addremote(os.path.join(directory, 'routing-%s.json' % dcid), url, method='dc', timeout=timeout)
+
+    result = dict()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = dict((dcid, executor.submit(download, dcid, url)) for dcid, url in remotes.items())
+        for dcid, future in futures.items():
+            result[dcid] = future.exception()
+    return result
+
 
 # Define this just to shorten the notation
 defRectangle = GeoRectangle(-90, 90, -180, 180)
 
 
+def filesignature(filename: str) -> Tuple[int, int]:
+    """Return a cheap signature (modification time and size) of a file.
+
+    :param filename: File to check
+    :type filename: str
+    :returns: Modification time in nanoseconds and size in bytes
+    :rtype: tuple
+    :raises: OSError if the file cannot be accessed
+    """
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
+
+
+def filechecksum(filename: str, blocksize: int = 1024 * 1024) -> str:
+    """Calculate the SHA-1 checksum of a file reading it in blocks.
+
+    :param filename: File to check
+    :type filename: str
+    :param blocksize: Size of the blocks to read
+    :type blocksize: int
+    :returns: Hexadecimal representation of the checksum
+    :rtype: str
+    """
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fin:
+        buf = fin.read(blocksize)
+        while len(buf):
+            h.update(buf)
+            buf = fin.read(blocksize)
+    return h.hexdigest()
+
+
+def savecompiled(binfile: str, routingtable: dict, stationtable: dict, vntable: dict, eidadcs: list,
+                 storage: str = 'artifact', generations: int = 3) -> dict:
+    """Save the routing information compiled to be read by the service.
+
+    A new generation of the file is published and *binfile* points to it
+    afterwards (see :mod:`~routeutils.generations`).
+
+    :param binfile: File to create (f.i. routing.xml.bin)
+    :type binfile: str
+    :param routingtable: Routes indexed by :class:`~Stream`
+    :type routingtable: dict
+    :param stationtable: Cache of stations indexed by netloc and :class:`~Stream`
+    :type stationtable: dict
+    :param vntable: Virtual networks
+    :type vntable: dict
+    :param eidadcs: Information about the data centres
+    :type eidadcs: list
+    :param storage: Format of the file ('artifact' to map it in memory or 'sqlite')
+    :type storage: str
+    :param generations: Number of generations kept
+    :type generations: int
+    :returns: Entry of the new generation in the manifest
+    :rtype: dict
+    :raises: ValueError if the storage is not known
+    """
+    from .generations import publish
+
+    if storage == 'artifact':
+        from .artifact import writeartifact as writer
+    elif storage == 'sqlite':
+        from .sqlitestore import writesqlite as writer
+    else:
+        raise ValueError('Unknown storage for the routing table: %s' % storage)
+
+    # As in RoutingSnapshot.stats
+    stats = {'storage': storage, 'streams': len(routingtable),
+             'routes': sum(len(r) for r in routingtable.values()),
+             'stations': sum(len(sts) for dc in stationtable.values() for sts in dc.values()),
+             'vnets': len(vntable)}
+    return publish(binfile, lambda filename: writer(filename, routingtable, stationtable, vntable, eidadcs),
+                   stats, keep=generations)
+
+
+def haswildcard(code: str) -> bool:
+    """Check whether a code includes a wildcard which fnmatch would expand."""
+    return ('*' in code) or ('?' in code) or ('[' in code)
+
+
+def routingreport(routingtable: dict, stationtable: dict, vntable: dict) -> dict:
+    """Summarise the compiled routing information (f.i. for capacity planning).
+
+    The report includes the number of routes per data centre (host of the
+    service) and service, the wildcards used in every component of the
+    streams ('all' for "*", 'pattern' for other wildcards and 'exact'), the
+    stations per data centre and the number of streams of every virtual network.
+
+    :param routingtable: Routes indexed by :class:`~Stream`
+    :type routingtable: dict
+    :param stationtable: Stations indexed by data centre and :class:`~Stream`
+    :type stationtable: dict
+    :param vntable: Streams of every virtual network
+    :type vntable: dict
+    :returns: Report which can be serialised as JSON
+    :rtype: dict
+    """
+    routes = dict()
+    fields = ('network', 'station', 'location', 'channel')
+    wildcards = dict((field, {'all': 0, 'pattern': 0, 'exact': 0}) for field in fields)
+    for st, rts in routingtable.items():
+        for field, code in zip(fields, st):
+            kind = 'all' if code == '*' else 'pattern' if haswildcard(code) else 'exact'
+            wildcards[field][kind] += 1
+        for rt in rts:
+            services = routes.setdefault(urlparse(rt.address).netloc, dict())
+            services[rt.service] = services.get(rt.service, 0) + 1
+
+    stations = dict((dc, sum(len(sts) for sts in stationtable[dc].values())) for dc in stationtable)
+
+    return {'streams': len(routingtable),
+            'routes': sum(len(r) for r in routingtable.values()),
+            'stations': sum(stations.values()),
+            'vnets': len(vntable),
+            'routesperdc': routes,
+            'wildcards': wildcards,
+            'stationsperdc': stations,
+            'vnetsizes': dict((str(code), len(streams)) for code, streams in vntable.items())}
+
+
+class RoutingSnapshot(object):
+    """Immutable view of all the routing information loaded at some point.
+
+    A snapshot groups the routing table, the station cache, the virtual
+    networks and the data centre information together with the indexes and
+    rendered responses derived from them. It is built completely before it is
+    made visible to the requests, so that replacing the one in use is a single
+    (atomic) assignment and requests in progress keep working with the
+    snapshot they started with.
+
+    :platform: Any
+
+    """
+
+    def __init__(self, routingtable: dict = None, stationtable: dict = None, vntable: dict = None,
+                 eidadcs: list = None, source: dict = None):
+        """Constructor of RoutingSnapshot.
+
+        :param routingtable: Routes indexed by :class:`~Stream`
+        :type routingtable: dict
+        :param stationtable: Cache of stations indexed by netloc and :class:`~Stream`
+        :type stationtable: dict
+        :param vntable: Virtual networks
+        :type vntable: dict
+        :param eidadcs: Information about the data centres
+        :type eidadcs: list
+        :param source: Description of the file(s) this snapshot was read from
+        :type source: dict
+
+        """
+        self.routingTable = routingtable if routingtable is not None else dict()
+        self.stationTable = stationtable if stationtable is not None else dict()
+        self.vnTable = vntable if vntable is not None else dict()
+        self.eidaDCs = eidadcs if eidadcs is not None else list()
+        # Information about the origin of the data (file, signature, checksum)
+        self.source = source if source is not None else dict()
+        # Time needed to read and prepare this snapshot (in seconds)
+        self.loadTime = None
+        # Responses which depend only on this snapshot (f.i. globalconfig)
+        self.cache = dict()
+
+        # Streams with a network code without wildcards indexed by network
+        self.netIndex = dict()
+        # Streams with wildcards in the network code
+        self.netWildcard = list()
+        self.buildIndex()
+
+    def buildIndex(self):
+        """Index the streams of the routing table by network code."""
+        netIndex = dict()
+        netWildcard = list()
+        for st in self.routingTable.keys():
+            if haswildcard(st.n):
+                netWildcard.append(st)
+            else:
+                netIndex.setdefault(st.n, list()).append(st)
+        self.netIndex = netIndex
+        self.netWildcard = netWildcard
+
+    def candidates(self, stream: Stream) -> list:
+        """Return the streams from the routing table which could overlap the one given.
+
+        This is a fast pre-selection based on the network code. The final
+        decision must still be taken with :meth:`~Stream.overlap`.
+
+        :param stream: Stream requested (wildcards allowed)
+        :type stream: :class:`~Stream`
+        :returns: Streams in the routing table which may overlap the requested one
+        :rtype: list
+        """
+        if haswildcard(stream.n):
+            return list(self.routingTable.keys())
+
+        return self.netIndex.get(stream.n, list()) + self.netWildcard
+
+    def stats(self) -> dict:
+        """Return the number of streams, routes, stations and virtual networks in this snapshot."""
+        try:
+            return self.cache['stats']
+        except KeyError:
+            pass
+
+        self.cache['stats'] = {'streams': len(self.routingTable),
+                               'routes': sum(len(r) for r in self.routingTable.values()),
+                               'stations': sum(len(sts) for dc in self.stationTable.values() for sts in dc.values()),
+                               'vnets': len(self.vnTable)}
+        return self.cache['stats']
+
+    def __len__(self) -> int:
+        """Return the number of streams in the routing table."""
+        return len(self.routingTable)
+
+
 class RoutingCache(object):
     """Manage routing information of streams read from an XML file.
 
@@ -1348,40 +1734,70 @@ class RoutingCache(object):
 
     """
 
-    def __init__(self, routingfile: str = None, config: str = 'routing.cfg'):
+    def __init__(self, routingfile: str = None, config: str = 'routing.cfg', gcfreeze: bool = False):
         """Constructor of RoutingCache.
 
         :param routingfile: XML file with routing information
         :type routingfile: str
         :param config: File where the configuration must be read from
         :type config: str
+        :param gcfreeze: Move the routing information out of the view of the
+            garbage collector (gc.freeze) every time it is loaded
+        :type gcfreeze: bool
 
         """
         # Save the logging object
         self.logs = logging.getLogger('RoutingCache')
 
+        # Freeze the objects after loading the routing information
+        self.gcFreeze = gcfreeze
+        # Process which froze the routing information in use (f.i. the master before forking)
+        self.frozenBy = None
+
         # Routing file in XML format
         self.routingFile = routingfile
 
         # Config file for the service
         self.configFile = config
 
-        # Dictionary with all the routes
-        self.routingTable = dict()
         self.logs.info('Reading routes from %s' % self.routingFile)
         self.logs.info('Reading configuration from %s' % self.configFile)
 
-        # Dictionary with list of stations inside each virtual network
-        self.vnTable = dict()
+        # All the routing information (routes, stations, virtual networks and
+        # data centres) is kept in a snapshot which is replaced as a whole
+        self.snapshot = RoutingSnapshot()
 
-        # Dictionary with list of data centres
-        self.eidaDCs = list()
+        # Serialize the updates of the snapshot
+        self.updateLock = threading.Lock()
+        # Thread checking for new versions of the routing data
+        self.watcher = None
+        self.stopWatching = threading.Event()
 
         if self.routingFile is not None:
             self.logs.info('Wait until the RoutingCache is updated...')
             self.update()
             self.logs.info('RoutingCache finished!')
 
+    @property
+    def routingTable(self) -> dict:
+        """Routing table of the snapshot in use."""
+        return self.snapshot.routingTable
+
+    @property
+    def stationTable(self) -> dict:
+        """Station cache of the snapshot in use."""
+        return self.snapshot.stationTable
+
+    @property
+    def vnTable(self) -> dict:
+        """Virtual networks of the snapshot in use."""
+        return self.snapshot.vnTable
+
+    @property
+    def eidaDCs(self) -> list:
+        """Data centres information of the snapshot in use."""
+        return self.snapshot.eidaDCs
+
     def toXML(self, foutput: str, namespace: str = 'ns0'):
         """Export the RoutingCache to an XML representation."""
         header = """<?xml version="1.0" encoding="utf-8"?>
@@ -1396,14 +1812,17 @@ class RoutingCache(object):
                 fo.write(st.toxmlclose())
             fo.write('</ns0:routing>')
 
-    def virtualNets(self) -> str:
+    def virtualNets(self, snapshot: RoutingSnapshot = None) -> str:
         """Return the virtual networks defined in the system
 
+        :param snapshot: Routing information to use (default: the one in use)
+        :type snapshot: :class:`~RoutingSnapshot`
         :returns: Virtual networks in this system in JSON format
         :rtype: str
 
         """
-        return json.dumps(self.vnTable, default=datetime.datetime.isoformat)
+        snapshot = self.snapshot if snapshot is None else snapshot
+        return json.dumps(dict(snapshot.vnTable), default=datetime.datetime.isoformat)
 
     def localConfig(self, fmt: str = 'xml') -> str:
         """Return the local routing configuration.
@@ -1418,23 +1837,83 @@ class RoutingCache(object):
 
         raise Exception('Format (%s) is not xml.' % fmt)
 
-    def globalConfig(self, fmt: str = 'fdsn') -> str:
+    def globalConfig(self, fmt: str = 'fdsn', snapshot: RoutingSnapshot = None) -> str:
         """Return the global routing configuration.
 
+        The result only depends on the routing information, so it is
+        calculated once per snapshot and cached.
+
+        :param snapshot: Routing information to use (default: the one in use)
+        :type snapshot: :class:`~RoutingSnapshot`
         :returns: Global routing information in FDSN format
         :rtype: str
 
         """
         if fmt == 'fdsn':
+            snapshot = self.snapshot if snapshot is None else snapshot
+            try:
+                result = snapshot.cache['globalconfig']
+                cacheRequests.inc('globalconfig', 'hit')
+                return result
+            except KeyError:
+                cacheRequests.inc('globalconfig', 'miss')
+
             result = self.getRoute(Stream('*', '*', '*', '*'), TW(None, None),
-                                   service='dataselect,wfcatalog,station,availability', alternative=True)
-            fdsnresult = FDSNRules(result, self.eidaDCs)
-            return json.dumps(fdsnresult, default=datetime.datetime.isoformat)
+                                   service='dataselect,wfcatalog,station,availability', alternative=True,
+                                   snapshot=snapshot)
+            fdsnresult = FDSNRules(result, snapshot.eidaDCs)
+            snapshot.cache['globalconfig'] = json.dumps(fdsnresult, default=datetime.datetime.isoformat)
+            return snapshot.cache['globalconfig']
 
         raise Exception('Format (%s) is not fdsn.' % fmt)
 
+    def prepare(self, snapshot: RoutingSnapshot):
+        """Calculate in advance the responses which depend only on the snapshot.
+
+        :param snapshot: Routing information to prepare
+        :type snapshot: :class:`~RoutingSnapshot`
+        """
+        try:
+            snapshot.stats()
+            self.globalConfig(snapshot=snapshot)
+        except Exception as e:
+            # An empty routing table cannot produce a global configuration
+            self.logs.warning('globalconfig could not be prepared: %s' % e)
+
+    def _install(self, snapshot: RoutingSnapshot, freeze: bool = True):
+        """Prepare a snapshot and make it the one in use.
+
+        The routing information lives until the next reload and is made of
+        millions of small objects. If configured (gcfreeze), they are excluded
+        from the (full) collections. gc.freeze() works on the whole process, so
+        the objects of the requests in progress are frozen too.
+
+        The objects frozen by this process with the previous snapshot are
+        examined once more, so that the parts of it kept alive only by
+        reference cycles are released. This is skipped for the objects frozen
+        by another process (f.i. the master preloading before forking). Their
+        pages are kept shared with the master at the cost of keeping their
+        cycles in memory.
+
+        :param snapshot: Routing information to use
+        :type snapshot: :class:`~RoutingSnapshot`
+        :param freeze: Freeze the objects if configured (False if only a small part changed)
+        :type freeze: bool
+        """
+        self.prepare(snapshot)
+        self.snapshot = snapshot
+
+        if self.gcFreeze and freeze:
+            startTime = time.time()
+            if self.frozenBy == os.getpid():
+                gc.unfreeze()
+                gc.collect()
+            gc.freeze()
+            self.frozenBy = os.getpid()
+            self.logs.info('%d objects frozen in %.3f seconds' % (gc.get_freeze_count(), time.time() - startTime))
+
     def getRoute(self, stream: Stream, tw: TW, service: str = 'dataselect', geoloc: GeoRectangle = None,
-                 alternative: bool = False) -> RequestMerge:
+                 alternative: bool = False, snapshot: RoutingSnapshot = None) -> RequestMerge:
         """Return routes to request data for the stream and timewindow provided.
 
         Based on a stream(s) and a timewindow returns all the needed
@@ -1453,13 +1932,20 @@ class RoutingCache(object):
         :param alternative: Specifies whether alternative routes should be
             included
         :type alternative: bool
+        :param snapshot: Routing information to use (default: the one in use)
+        :type snapshot: :class:`~RoutingSnapshot`
         :returns: URLs and parameters to request the data
         :rtype: :class:`~RequestMerge`
         :raises: RoutingException
 
         """
+        # Keep the same snapshot during the whole request even if a new one
+        # is loaded in the meantime
+        snapshot = self.snapshot if snapshot is None else snapshot
+
         # Convert from virtual network to real networks (if needed)
-        strtwList = self.vn2real(stream, tw)
+        with phase('vn2real'):
+            strtwList = self.vn2real(stream, tw, snapshot)
         self.logs.debug('Converting %s to %s' % (stream, strtwList))
 
         if not len(strtwList):
@@ -1470,8 +1956,9 @@ class RoutingCache(object):
         for st, tw in strtwList:
             try:
                 for srv in set([s.lower() for s in service.split(',')]):
-                    result.extend(self.getRouteDS(srv, st, tw, geoloc,
-                                                  alternative))
+                    partial = self.getRouteDS(srv, st, tw, geoloc, alternative, snapshot)
+                    with phase('merge'):
+                        result.extend(partial)
             except ValueError:
                 pass
 
@@ -1484,17 +1971,20 @@ class RoutingCache(object):
 
         return result
 
-    def vn2real(self, stream: Stream, tw: TW) -> list:
+    def vn2real(self, stream: Stream, tw: TW, snapshot: RoutingSnapshot = None) -> list:
         """Transform from a virtual network code to a list of streams.
 
         :param stream: requested stream including virtual network code.
         :type stream: Stream
         :param tw: time window requested.
         :type tw: TW
+        :param snapshot: Routing information to use (default: the one in use)
+        :type snapshot: :class:`~RoutingSnapshot`
         :returns: Streams and time windows of real network-station codes.
         :rtype: list
         """
-        if stream.n not in self.vnTable.keys():
+        snapshot = self.snapshot if snapshot is None else snapshot
+        if stream.n not in snapshot.vnTable:
             return [(stream, tw)]
 
         # If virtual networks are defined with open start or end dates
@@ -1504,7 +1994,7 @@ class RoutingCache(object):
         auxStr = ('*', stream.s, stream.l, stream.c)
 
         result = list()
-        for strtw in self.vnTable[stream.n]:
+        for strtw in snapshot.vnTable[stream.n]:
             try:
                 s = strtw[0].strictmatch(auxStr)
             except Exception:
@@ -1523,7 +2013,7 @@ class RoutingCache(object):
         return result
 
     def getRouteDS(self, service: str, stream: Stream, tw: TW, geolocation: GeoRectangle = None,
-                   alternative: bool = False) -> RequestMerge:
+                   alternative: bool = False, snapshot: RoutingSnapshot = None) -> RequestMerge:
         """Return routes to request data for the parameters specified.
 
         Based on a :class:`~Stream` and a timewindow (:class:`~TW`) returns
@@ -1542,17 +2032,23 @@ class RoutingCache(object):
         :param alternative: Specifies whether alternative routes should be
             included
         :type alternative: bool
+        :param snapshot: Routing information to use (default: the one in use)
+        :type snapshot: :class:`~RoutingSnapshot`
         :returns: URLs and parameters to request the data
         :rtype: :class:`~RequestMerge`
         :raises: RoutingException, ValueError
 
         """
+        snapshot = self.snapshot if snapshot is None else snapshot
+        ptRT = snapshot.routingTable
+
+        since = timing.mark()
         # Create list to store results
         subs = list()
         subs2 = list()
 
         # Filter by stream
-        for stRT in self.routingTable.keys():
+        for stRT in snapshot.candidates(stream):
             if stRT.overlap(stream):
                 subs.append(stRT)
 
@@ -1561,7 +2057,9 @@ class RoutingCache(object):
         # Filter by service and timewindow
         for stRT in subs:
             priorities = list()
-            for rou in self.routingTable[stRT]:
+            # Decoded only once from a compiled table mapped in memory
+            stRoutes = ptRT[stRT]
+            for rou in stRoutes:
                 # If it is the proper service and the timewindow coincides
                 # with the one in the parameter, add the priority to use it
                 # in the last check
@@ -1591,7 +2089,7 @@ class RoutingCache(object):
                     continue
 
                 # Add tuples with (Stream, Route)
-                subs2.append((stRT, self.routingTable[stRT][pos]))
+                subs2.append((stRT, stRoutes[pos]))
 
                 # If I don't want the alternative take only the first one
                 # if not alternative:
@@ -1625,6 +2123,7 @@ class RoutingCache(object):
                 # finalset.add(r1.strictmatch(stream))
                 finalset.append((s1, r1))
                 continue
+        since = timing.record('match', since)
 
         result = RequestMerge()
 
@@ -1664,7 +2163,7 @@ class RoutingCache(object):
 
                     # Check here that the final result is compatible with the
                     # stations in cache
-                    ptST = self.stationTable[urlparse(ro.address).netloc]
+                    ptST = snapshot.stationTable[urlparse(ro.address).netloc]
                     for cacheSt in ptST[st]:
                         # Trying to catch cases like (APE, AP*)
                         # print st
@@ -1702,6 +2201,7 @@ class RoutingCache(object):
                         msg = "Skipping %s as station %s not in its cache"
                         logging.debug(msg % (str(stream.strictmatch(st)),
                                              stream.s))
+        timing.record('stations', since)
 
         # Check the coherency of the routes to set the return code
         if len(result) == 0:
@@ -1724,133 +2224,16 @@ class RoutingCache(object):
 
         """
         self.logs.debug('Entering updateVN()\n')
-        # Just to shorten notation
-        ptVN = self.vnTable
-
-        try:
-            vnHandle = open(self.routingFile, 'r')
-        except Exception:
-            msg = 'Error: %s could not be opened.\n'
-            self.logs.error(msg % self.routingFile)
-            return
-
-        # Traverse through the virtual networks
-        # get an iterable
-        try:
-            context = ET.iterparse(vnHandle, events=("start", "end"))
-        except IOError as e:
-            self.logs.error(str(e))
-            return
-
-        # turn it into an iterator
-        context = iter(context)
-
-        # get the root element
-        if hasattr(context, 'next'):
-            event, root = context.next()
-        else:
-            event, root = next(context)
-
-        # Check that it is really an inventory
-        if root.tag[-len('routing'):] != 'routing':
-            msg = 'The file parsed seems not to be a routing file (XML).\n'
-            self.logs.error(msg)
-            return
+        # The routes of the snapshot in use cannot be replaced by a reload meanwhile
+        with self.updateLock:
+            # Build a new table to replace the one in use at the end
+            ptVN = addvirtualnets(self.routingFile)
 
-        # Extract the namespace from the root node
-        namesp = root.tag[:-len('routing')]
-
-        ptVN.clear()
-
-        for event, vnet in context:
-            # The tag of this node should be "route".
-            # Now it is not being checked because
-            # we need all the data, but if we need to filter, this
-            # is the place.
-            #
-            if event == "end":
-                if vnet.tag == namesp + 'vnetwork':
-
-                    # Extract the network code
-                    try:
-                        vnCode = vnet.get('networkCode')
-                        if len(vnCode) == 0:
-                            vnCode = None
-                    except Exception:
-                        vnCode = None
-
-                    # Traverse through the sources
-                    for stream in vnet:
-                        # Extract the networkCode
-                        msg = 'Only the * wildcard is allowed in virtual nets.'
-                        try:
-                            net = stream.get('networkCode')
-                            if (('?' in net) or
-                                    (('*' in net) and (len(net) > 1))):
-                                self.logs.warning(msg)
-                                continue
-                        except Exception:
-                            net = '*'
-
-                        # Extract the stationCode
-                        try:
-                            sta = stream.get('stationCode')
-                            if (('?' in sta) or
-                                    (('*' in sta) and (len(sta) > 1))):
-                                self.logs.warning(msg)
-                                continue
-                        except Exception:
-                            sta = '*'
-
-                        # Extract the locationCode
-                        try:
-                            loc = stream.get('locationCode')
-                            if (('?' in loc) or
-                                    (('*' in loc) and (len(loc) > 1))):
-                                self.logs.warning(msg)
-                                continue
-                        except Exception:
-                            loc = '*'
-
-                        # Extract the streamCode
-                        try:
-                            cha = stream.get('streamCode')
-                            if (('?' in cha) or
-                                    (('*' in cha) and (len(cha) > 1))):
-                                self.logs.warning(msg)
-                                continue
-                        except Exception:
-                            cha = '*'
-
-                        try:
-                            auxStart = stream.get('start')
-                            startD = str2date(auxStart)
-                        except Exception:
-                            startD = None
-                            msg = 'Error while converting START attribute.\n'
-                            self.logs.error(msg)
-
-                        try:
-                            auxEnd = stream.get('end')
-                            endD = str2date(auxEnd)
-                        except Exception:
-                            endD = None
-                            msg = 'Error while converting END attribute.\n'
-                            self.logs.error(msg)
-
-                        if vnCode not in ptVN:
-                            ptVN[vnCode] = [(Stream(net, sta, loc, cha),
-                                             TW(startD, endD))]
-                        else:
-                            ptVN[vnCode].append((Stream(net, sta, loc, cha),
-                                                 TW(startD, endD)))
-
-                        stream.clear()
-
-                    vnet.clear()
-
-                # FIXME Probably the indentation below is wrong.
-                root.clear()
+            snapshot = self.snapshot
+            newSnapshot = RoutingSnapshot(snapshot.routingTable, snapshot.stationTable, ptVN,
+                                          snapshot.eidaDCs, snapshot.source)
+            # Only the virtual networks are new
+            self._install(newSnapshot, freeze=False)
 
     def endpoints(self) -> str:
         """Read the list of endpoints from the configuration file.
@@ -1896,12 +2279,130 @@ class RoutingCache(object):
         necessary attributes are stored. This relies on the idea that some
         other agent should update the routing data at a regular period of time.
 
+        A complete new :class:`~RoutingSnapshot` is built and only then it
+        replaces the one in use. Requests being processed keep using the
+        previous one until they finish.
+
+        The XML files are parsed only if there is no compiled routing data
+        (f.i. in a new installation). If no generation of the compiled data
+        can be read, the routing information in use is kept.
+
+        :raises: Exception if no routing information could be read at all
         """
+        from .generations import manifestname
+
         self.logs.debug('Entering update()\n')
 
+        with self.updateLock:
+            binFile = self.routingFile + '.bin'
+            if not os.path.lexists(binFile) and not os.path.exists(manifestname(binFile)):
+                snapshot = self.loadxml(binFile)
+            else:
+                try:
+                    snapshot = self.loadcompiled(binFile)
+                except Exception as e:
+                    self.logs.error('No generation of %s could be loaded. %s' % (binFile, e))
+                    if not len(self.snapshot):
+                        raise
+                    return
+
+            self._install(snapshot)
+            tableReloads.inc()
+
+    def loadcompiled(self, binfile: str) -> RoutingSnapshot:
+        """Read the newest generation of the compiled routing data which is valid.
+
+        The generations are tried from the newest to the oldest (see
+        :func:`~routeutils.generations.candidates`). A generation whose
+        checksum differs from the one in the manifest is skipped.
+
+        :param binfile: File with the routing data compiled by updateAll.py
+        :type binfile: str
+        :returns: New snapshot with the routing data read
+        :rtype: :class:`~RoutingSnapshot`
+        :raises: Exception if no generation can be read
+        """
+        from .generations import candidates
+
+        error = None
+        for filename, generation in candidates(binfile):
+            try:
+                return self.loadbin(filename, generation)
+            except Exception as e:
+                self.logs.warning('%s could not be loaded (%s)' % (filename, e))
+                error = e
+        raise error
+
+    def loadbin(self, binfile: str, generation: dict = None) -> RoutingSnapshot:
+        """Read the routing data from the compiled file saved by the off-line process.
+
+        Compiled files in the format of :mod:`~routeutils.artifact` are mapped in
+        memory and SQLite databases (:mod:`~routeutils.sqlitestore`) are queried
+        when needed. Pickled files from previous versions are still accepted.
+
+        :param binfile: File with the routing data compiled by updateAll.py
+        :type binfile: str
+        :param generation: Entry of the manifest with the SHA-1 which the file must have
+        :type generation: dict
+        :returns: New snapshot with the routing data read
+        :rtype: :class:`~RoutingSnapshot`
+        :raises: Exception if the file cannot be read
+        """
+        from .artifact import isartifact
+        from .artifact import RoutingArtifact
+        from .sqlitestore import issqlite
+        from .sqlitestore import SQLiteSnapshot
+
+        startTime = time.time()
+        source = {'file': binfile, 'signature': filesignature(binfile)}
+        expected = None
+        if generation is not None:
+            expected = generation['checksum']
+            source['generation'] = generation['generation']
+            source['built'] = generation['built']
+        artifact = isartifact(binfile)
+        # The content of an artifact is checked with the checksum of its header
+        # if there is no manifest. Otherwise, the file is read only once.
+        if expected is not None or not artifact:
+            checksum = filechecksum(binfile)
+            if expected is not None and checksum != expected:
+                raise ValueError('Checksum of %s is %s instead of %s' % (binfile, checksum, expected))
+            source['checksum'] = checksum
+
+        if artifact:
+            # Routes and stations are decoded from the memory map when needed
+            artifact = RoutingArtifact(binfile, verify=expected is None)
+            source['digest'] = artifact.checksum
+            snapshot = RoutingSnapshot(artifact.routingTable, artifact.stationTable, artifact.vnTable,
+                                       artifact.eidaDCs, source)
+            snapshot.cache['stats'] = artifact.stats()
+        elif issqlite(binfile):
+            # Everything is read from the database when needed
+            snapshot = SQLiteSnapshot(binfile, source)
+        else:
+            # Pickled version saved by previous versions of updateAll.py
+            with open(binfile, 'rb') as rMerged:
+                ptRT, ptST, ptVN, eidaDCs = pickle.load(rMerged)
+            snapshot = RoutingSnapshot(ptRT, ptST, ptVN, eidaDCs, source)
+        snapshot.loadTime = time.time() - startTime
+        self.logs.info('%s loaded in %.3f seconds' % (binfile, snapshot.loadTime))
+        return snapshot
+
+    def loadxml(self, binfile: str) -> RoutingSnapshot:
+        """Read the routing data from the XML files and save a compiled version of it.
+
+        :param binfile: File where the compiled version must be saved
+        :type binfile: str
+        :returns: New snapshot with the routing data read
+        :rtype: :class:`~RoutingSnapshot`
+        """
+        startTime = time.time()
+
         # Otherwise, default value
         synchroList = ''
         allowOverlaps = False
+        storage = 'artifact'
+        generations = 3
 
         config = configparser.RawConfigParser()
         try:
@@ -1911,6 +2412,8 @@ class RoutingCache(object):
 
             if 'synchronize' in config.options('Service'):
                 synchroList = config.get('Service', 'synchronize')
+            storage = config.get('Service', 'storage', fallback=storage)
+            generations = config.getint('Service', 'generations', fallback=generations)
         except Exception:
             pass
 
@@ -1923,55 +2426,131 @@ class RoutingCache(object):
         self.logs.debug(synchroList)
         self.logs.debug('allowOverlaps: %s' % allowOverlaps)
 
-        # Just to shorten notation
-        ptRT = self.routingTable
-        ptVN = self.vnTable
+        # Routes and virtual networks are read in the same pass
+        ptRT = dict()
+        ptVN = dict()
+        transaction = RoutingTransaction(ptRT, ptVN, allowOverlaps=allowOverlaps)
+        routes, vnets = parserouting(self.routingFile)
+        transaction.stage(routes, vnets, filename=self.routingFile)
+        transaction.commit()
+        eidaDCs = list()
+        eidaDCs.append(json.load(open(replacelast(self.routingFile, '.xml', '.json'))))
+
+        # Loop for the data centres which should be integrated
+        for line in synchroList.splitlines():
+            if not len(line):
+                break
+            self.logs.debug(str(line.split(',')))
+            dcid, url = line.split(',')
+
+            if os.path.exists(os.path.join(os.getcwd(), 'data',
+                                           'routing-%s.xml' %
+                                           dcid.strip())):
+                # addroutes should return no Exception ever and skip
+                # a problematic file returning a coherent version of the
+                # routes
+                self.logs.debug('Routes in table: %s' % len(ptRT))
+                self.logs.debug('Adding REMOTE %s' % dcid)
+                remoteFile = os.path.join(os.getcwd(), 'data', 'routing-%s.xml' % dcid.strip())
+                routes, vnets = parserouting(remoteFile)
+                transaction.stage(routes, vnets, filename=remoteFile)
+                transaction.commit()
+
+        ptST = dict()
+        cachestations(ptRT, ptST)
+
+        self.logs.debug('Writing %s\n' % binfile)
+        savecompiled(binfile, ptRT, ptST, ptVN, eidaDCs, storage, generations)
+
+        snapshot = RoutingSnapshot(ptRT, ptST, ptVN, eidaDCs,
+                                   {'file': binfile, 'signature': filesignature(binfile),
+                                    'checksum': filechecksum(binfile)})
+        snapshot.loadTime = time.time() - startTime
+        return snapshot
+
+    def changed(self) -> bool:
+        """Check whether the compiled routing data differs from the one in use.
+
+        The modification time and size of the file are checked first. Only if
+        they differ the checksum is calculated to be sure that the content
+        really changed.
+
+        :returns: True if there is a new version of the routing data to load
+        :rtype: bool
+        """
+        from .artifact import artifactdigest
+
+        if self.routingFile is None:
+            return False
 
-        # Clear all previous information
-        ptRT.clear()
-        ptVN.clear()
         binFile = self.routingFile + '.bin'
+        source = self.snapshot.source
         try:
-            with open(binFile, 'rb') as rMerged:
-                self.routingTable, self.stationTable, self.vnTable, self.eidaDCs = \
-                    pickle.load(rMerged)
-        except Exception:
-            ptRT = addroutes(self.routingFile, allowOverlaps=allowOverlaps)
-            ptVN = addvirtualnets(self.routingFile)
-            self.eidaDCs = list()
-            self.eidaDCs.append(json.load(open(replacelast(self.routingFile, '.xml', '.json'))))
+            signature = filesignature(binFile)
+            if signature == source.get('signature'):
+                return False
 
-            # Loop for the data centres which should be integrated
-            for line in synchroList.splitlines():
-                if not len(line):
-                    break
-                self.logs.debug(str(line.split(',')))
-                dcid, url = line.split(',')
+            if 'checksum' in source:
+                same = filechecksum(binFile) == source['checksum']
+            else:
+                same = artifactdigest(binFile) == source.get('digest')
+            if same:
+                # Same content (f.i. the file was touched)
+                source['signature'] = signature
+                return False
+        except OSError:
+            # The file is missing or being replaced. Keep what we have.
+            return False
 
-                if os.path.exists(os.path.join(os.getcwd(), 'data',
-                                               'routing-%s.xml' %
-                                               dcid.strip())):
-                    # addroutes should return no Exception ever and skip
-                    # a problematic file returning a coherent version of the
-                    # routes
-                    self.logs.debug('Routes in table: %s' % len(ptRT))
-                    self.logs.debug('Adding REMOTE %s' % dcid)
-                    ptRT = addroutes(os.path.join(os.getcwd(), 'data',
-                                                  'routing-%s.xml' %
-                                                  dcid.strip()),
-                                     routingTable=ptRT,
-                                     allowOverlaps=allowOverlaps)
-                    ptVN = addvirtualnets(os.path.join(os.getcwd(), 'data',
-                                                       'routing-%s.xml' %
-                                                       dcid.strip()),
-                                          vnTable=ptVN)
-
-            # Set here self.stationtable
-            self.stationTable = dict()
-            cachestations(ptRT, self.stationTable)
-
-            with open(binFile, 'wb') \
-                    as finalRoutes:
-                self.logs.debug('Writing %s\n' % binFile)
-                pickle.dump((ptRT, self.stationTable, ptVN, self.eidaDCs), finalRoutes)
-                self.routingTable = ptRT
+        return True
+
+    def reload(self) -> bool:
+        """Load the compiled routing data if there is a new version of it.
+
+        The new snapshot is built completely (including its indexes and
+        cached responses) before replacing the one in use. If the file cannot
+        be read the current snapshot is kept.
+
+        :returns: True if a new snapshot is in use
+        :rtype: bool
+        """
+        from .generations import candidates
+
+        with self.updateLock:
+            if not self.changed():
+                return False
+
+            binFile = self.routingFile + '.bin'
+            try:
+                # Only the newest generation. The older ones are not better than the one in use.
+                snapshot = self.loadbin(*candidates(binFile)[0])
+            except Exception as e:
+                self.logs.error('Error reloading %s. Keeping the current routes. %s' % (binFile, e))
+                return False
+
+            self._install(snapshot)
+            tableReloads.inc()
+
+        self.logs.info('New routing information in use: %d streams' % len(snapshot))
+        return True
+
+    def watch(self, interval: float):
+        """Start a thread checking periodically for new routing data.
+
+        :param interval: Seconds between two consecutive checks
+        :type interval: float
+        """
+        if (self.watcher is not None) and self.watcher.is_alive():
+            return
+
+        self.stopWatching.clear()
+        self.watcher = threading.Thread(target=self._watchloop, args=(interval,),
+                                        name='RoutingCacheWatcher', daemon=True)
+        self.watcher.start()
+
+    def _watchloop(self, interval: float):
+        while not self.stopWatching.wait(interval):
+            try:
+                self.reload()
+            except Exception as e:
+                self.logs.error('Error checking for new routing information: %s' % e)
@@ -18,7 +18,9 @@ any later version.
 """
 
 import sys
+import io
 import json
+from wsgiref.util import setup_testing_defaults
 
 response_headers_template = [('Access-Control-Allow-Origin', '*'),
                     ('Access-Control-Allow-Headers', 'Authorization'),
@@ -199,6 +201,30 @@ class WIServiceError(WIError):
         WIError.__init__(self, "503 Service Unavailable", *args, **kwargs)
 
 
+def build_environ(path, query='', method='GET', body=b''):
+    """Build a WSGI environment for a request made without a web server.
+
+    :param path: Path of the function called (f.i. '/query')
+    :type path: str
+    :param query: Query string of the request
+    :type query: str
+    :param method: HTTP method (GET or POST)
+    :type method: str
+    :param body: Body of the request
+    :type body: bytes
+    :returns: WSGI environment
+    :rtype: dict
+
+    """
+    environ = {'PATH_INFO': path,
+               'QUERY_STRING': query,
+               'REQUEST_METHOD': method,
+               'CONTENT_LENGTH': str(len(body)),
+               'wsgi.input': io.BytesIO(body)}
+    setup_testing_defaults(environ)
+    return environ
+
+
 ##################################################################
 #
 # Functions to send a response to the client
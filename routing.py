@@ -16,7 +16,10 @@ any later version.
 """
 
 import os
+import gc
 import cgi
+import argparse
+import time
 import datetime
 import logging
 import configparser
@@ -30,6 +33,7 @@ from routeutils.wsgicomm import send_json_response
 from routeutils.wsgicomm import send_html_response
 from routeutils.wsgicomm import send_xml_response
 from routeutils.wsgicomm import send_error_response
+from routeutils.wsgicomm import build_environ
 from routeutils.utils import Stream
 from routeutils.utils import TW
 from routeutils.utils import GeoRectangle
@@ -39,6 +43,12 @@ from routeutils.utils import RoutingException
 from routeutils.utils import str2date
 from routeutils.routing import lsNSLC
 from routeutils.routing import applyFormat
+from routeutils import metrics
+from routeutils import timing
+from routeutils.timing import phase
+from routeutils.profiling import RequestProfiler
+from routeutils.prefork import freeze
+from routeutils.prefork import serve
 from typing import Union
 from typing import List
 
@@ -84,6 +94,7 @@ def makeQueryGET(parameters: Union[cgi.FieldStorage, dict]) -> RequestMerge:
                      'service', 'format',
                      'alternative', 'nodata']
 
+    since = timing.mark()
     for param in parameters:
         if param not in allowedParams:
             msg = 'Unknown parameter: %s' % param
@@ -172,6 +183,10 @@ def makeQueryGET(parameters: Union[cgi.FieldStorage, dict]) -> RequestMerge:
         geoLoc = None
     else:
         geoLoc = GeoRectangle(minlat, maxlat, minlon, maxlon)
+    timing.record('parse', since)
+
+    # Use the same routing information for the whole request
+    snapshot = routes.snapshot
 
     result = RequestMerge()
     # Expand lists in parameters (f.i., cha=BHZ,HHN) and yield all possible
@@ -180,7 +195,9 @@ def makeQueryGET(parameters: Union[cgi.FieldStorage, dict]) -> RequestMerge:
         try:
             st = Stream(n, s, l, c)
             tw = TW(start, endt)
-            result.extend(routes.getRoute(st, tw, ser, geoLoc, alt))
+            partial = routes.getRoute(st, tw, ser, geoLoc, alt, snapshot)
+            with phase('merge'):
+                result.extend(partial)
         except RoutingException:
             pass
 
@@ -214,6 +231,9 @@ def makeQueryPOST(postText) -> RequestMerge:
     minlon = -180.0
     maxlon = 180.0
 
+    # Use the same routing information for the whole request
+    snapshot = routes.snapshot
+
     filterdefined = False
     for line in postText.splitlines():
         if not len(line):
@@ -254,6 +274,7 @@ def makeQueryPOST(postText) -> RequestMerge:
         # specified
         filterdefined = True
 
+        since = timing.mark()
         net, sta, loc, cha, start, endt = line.split()
         net = net.upper()
         sta = sta.upper()
@@ -281,11 +302,14 @@ def makeQueryPOST(postText) -> RequestMerge:
             geoLoc = None
         else:
             geoLoc = GeoRectangle(minlat, maxlat, minlon, maxlon)
+        timing.record('parse', since)
 
         try:
             st = Stream(net, sta, loc, cha)
             tw = TW(start, endt)
-            result.extend(routes.getRoute(st, tw, ser, geoLoc, alt))
+            partial = routes.getRoute(st, tw, ser, geoLoc, alt, snapshot)
+            with phase('merge'):
+                result.extend(partial)
         except RoutingException:
             pass
 
@@ -293,7 +317,7 @@ def makeQueryPOST(postText) -> RequestMerge:
         st = Stream('*', '*', '*', '*')
         tw = TW(None, None)
         geoLoc = None
-        result.extend(routes.getRoute(st, tw, ser, geoLoc, alt))
+        result.extend(routes.getRoute(st, tw, ser, geoLoc, alt, snapshot))
 
     if len(result) == 0:
         raise WIContentError()
@@ -303,21 +327,269 @@ def makeQueryPOST(postText) -> RequestMerge:
 # This variable will be treated as GLOBAL by all the other functions
 routes = None
 
+# Responses which do not depend on the request (f.i. help page)
+staticResponses = dict()
 
-def application(environ, start_response):
-    """Main WSGI handler. Process requests and calls proper functions."""
-    global routes
-    fname = environ['PATH_INFO']
+# Profiler of a sample of the requests (if configured)
+profiler = None
 
+
+def readConfig() -> configparser.RawConfigParser:
+    """Read the configuration file of the service and set the logging level."""
     config = configparser.RawConfigParser()
     here = os.path.dirname(__file__)
     config.read(os.path.join(here, 'routing.cfg'))
     verbo = config.get('Service', 'verbosity')
-    baseURL = config.get('Service', 'baseURL')
     # Warning is the default value
     verboNum = getattr(logging, verbo.upper(), 30)
     logging.info('Verbosity configured with %s' % verboNum)
     logging.basicConfig(level=verboNum)
+    return config
+
+
+def loadRoutes(config: configparser.RawConfigParser, watch: bool = True) -> RoutingCache:
+    """Create the RoutingCache shared by all the requests if it does not exist yet.
+
+    :param config: Configuration of the service
+    :type config: configparser.RawConfigParser
+    :param watch: Start the thread checking for new routing tables. Threads do
+        not survive a fork, so this must be False in a process which will fork
+        its workers. The workers start the thread with their first request.
+    :type watch: bool
+    """
+    global routes
+
+    if routes is None:
+        here = os.path.dirname(__file__)
+        # Add routing cache here, to be accessible to all modules
+        routesFile = os.path.join(here, 'data', 'routing.xml')
+        configFile = os.path.join(here, 'routing.cfg')
+
+        # Thresholds of the garbage collector (see gc.set_threshold)
+        try:
+            thresholds = config.get('Service', 'gcthresholds', fallback='')
+            if len(thresholds.strip()):
+                gc.set_threshold(*[int(x) for x in thresholds.split(',')])
+        except Exception as e:
+            logging.error('Wrong value in gcthresholds: %s' % e)
+
+        routes = RoutingCache(routesFile, configFile,
+                              gcfreeze=config.getboolean('Service', 'gcfreeze', fallback=False))
+
+    # Check periodically if updateAll.py compiled a new routing table
+    if watch and ((routes.watcher is None) or not routes.watcher.is_alive()):
+        try:
+            reloadInterval = config.getfloat('Service', 'reloadinterval')
+        except Exception:
+            reloadInterval = 0
+        if reloadInterval > 0:
+            routes.watch(reloadInterval)
+
+    return routes
+
+
+def loadProfiler(config: configparser.RawConfigParser) -> Union[RequestProfiler, None]:
+    """Create the profiler of the requests if it is configured and does not exist yet."""
+    global profiler
+
+    if profiler is None:
+        try:
+            sample = config.getint('Service', 'profilesample', fallback=0)
+            threshold = config.getfloat('Service', 'profilethreshold', fallback=0.0)
+            if (sample > 0) or (threshold > 0):
+                here = os.path.dirname(__file__)
+                directory = config.get('Service', 'profiledir', fallback=os.path.join(here, 'profiles'))
+                profiler = RequestProfiler(directory, sample, threshold)
+        except Exception as e:
+            logging.error('Profiling could not be configured: %s' % e)
+
+    return profiler
+
+
+def helpPage() -> str:
+    """Return the help page of the service."""
+    try:
+        result = staticResponses['help']
+        metrics.cacheRequests.inc('help', 'hit')
+        return result
+    except KeyError:
+        metrics.cacheRequests.inc('help', 'miss')
+
+    here = os.path.dirname(__file__)
+    with open(os.path.join(here, 'help.html'), 'r') as helpHandle:
+        staticResponses['help'] = helpHandle.read()
+    return staticResponses['help']
+
+
+def applicationWadl(baseURL: str) -> str:
+    """Return the application.wadl of the service.
+
+    The document includes the date of tomorrow, so it is rendered again when
+    the date changes.
+    """
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    try:
+        wadlDate, wadlURL, iterObj = staticResponses['application.wadl']
+        if (wadlDate == tomorrow) and (wadlURL == baseURL):
+            metrics.cacheRequests.inc('application.wadl', 'hit')
+            return iterObj
+    except KeyError:
+        pass
+    metrics.cacheRequests.inc('application.wadl', 'miss')
+
+    here = os.path.dirname(__file__)
+    with open(os.path.join(here, 'application.wadl'), 'r') as appFile:
+        iterObj = appFile.read() % (baseURL, tomorrow)
+    staticResponses['application.wadl'] = (tomorrow, baseURL, iterObj)
+    return iterObj
+
+
+def warmup(queries: List[str] = None, watch: bool = True) -> dict:
+    """Prepare this process to serve requests before the first one arrives.
+
+    The routing information is loaded (indexes included), the responses which
+    do not depend on the request are rendered and the queries listed in the
+    *warmupqueries* option of the configuration file are replayed. The time
+    spent in each step is logged to know the cost of a cold start.
+
+    :param queries: Queries to replay (f.i. 'query?net=GE&format=post').
+        If not given, the ones from the configuration file are used.
+    :type queries: list
+    :param watch: Start the thread checking for new routing tables
+    :type watch: bool
+    :returns: Seconds spent in each step
+    :rtype: dict
+    """
+    logs = logging.getLogger('warmup')
+    timings = dict()
+
+    startTime = time.time()
+    config = readConfig()
+    loadRoutes(config, watch)
+    loadProfiler(config)
+    timings['load'] = time.time() - startTime
+
+    stepTime = time.time()
+    helpPage()
+    applicationWadl(config.get('Service', 'baseURL'))
+    routes.prepare(routes.snapshot)
+    timings['prepare'] = time.time() - stepTime
+
+    if queries is None:
+        try:
+            queries = config.get('Service', 'warmupqueries').split()
+        except Exception:
+            queries = list()
+
+    stepTime = time.time()
+    for query in queries:
+        path, _, qs = query.partition('?')
+        queryTime = time.time()
+        status = list()
+        # Not through application(), so that it is not counted in the metrics nor profiled
+        environ = build_environ('/' + path, qs)
+        environ['routing.watch'] = watch
+        try:
+            body = handleRequest(environ, lambda st, hd: status.append(st))
+        finally:
+            timing.stop()
+        status = status[0] if len(status) else '-'
+        size = sum(len(b) for b in body) if isinstance(body, list) else 0
+        if status.startswith('200'):
+            logs.debug('%s replayed in %.3f seconds (%s, %d bytes)' % (query, time.time() - queryTime, status, size))
+        else:
+            logs.warning('%s replayed in %.3f seconds (%s)' % (query, time.time() - queryTime, status))
+    timings['queries'] = time.time() - stepTime
+    timings['total'] = time.time() - startTime
+
+    logs.info('Process %d ready in %.3f seconds (load: %.3f, prepare: %.3f, %d queries: %.3f)' %
+              (os.getpid(), timings['total'], timings['load'], timings['prepare'], len(queries),
+               timings['queries']))
+    return timings
+
+
+def preload(queries: List[str] = None) -> dict:
+    """Prepare the master process of a pre-fork server before forking the workers.
+
+    Everything is loaded as in :func:`warmup` and then all the objects are
+    frozen (see :func:`~routeutils.prefork.freeze`), so that the workers
+    share the pages with the routing table instead of copying them.
+
+    :param queries: Queries to replay. If not given, the ones from the
+        configuration file are used.
+    :type queries: list
+    :returns: Seconds spent in each step
+    :rtype: dict
+    """
+    # The thread checking for new routing tables is started by each worker
+    timings = warmup(queries, watch=False)
+    logging.getLogger('warmup').info('%d objects frozen in process %d' % (freeze(), os.getpid()))
+    return timings
+
+
+# Functions and formats used to classify the requests in the metrics
+knownFunctions = ('query', 'application.wadl', 'localconfig', 'globalconfig', 'version', 'info', '',
+                  'virtualnets', 'endpoints', 'dc', 'metrics')
+knownFormats = ('xml', 'json', 'get', 'post', 'fdsn')
+
+
+def application(environ, start_response):
+    """Main WSGI handler. Process requests and keep statistics about them."""
+    startTime = time.perf_counter()
+    status = ['500 Internal Server Error']
+
+    def startResponse(st, headers, *args):
+        status[0] = st
+        timer = timing.current()
+        if timer is not None:
+            headers.append(('Server-Timing', timer.header()))
+        return start_response(st, headers, *args)
+
+    prof = profiler.start() if profiler is not None else None
+    try:
+        body = handleRequest(environ, startResponse)
+    finally:
+        duration = time.perf_counter() - startTime
+        fname = environ.get('PATH_INFO', '').split('/')[-1]
+        fname = fname if fname in knownFunctions else 'other'
+        outForm = environ.get('routing.format', '')
+        outForm = outForm if outForm in knownFormats else 'other'
+
+        if prof is not None:
+            profiler.stop(prof, duration, fname, outForm,
+                          environ.get('routing.body', environ.get('QUERY_STRING', '')))
+
+        metrics.requestDuration.observe(duration, fname, outForm)
+        metrics.requests.inc(fname, outForm, status[0].split()[0])
+        timer = timing.stop()
+
+    size = sum(len(b) for b in body) if isinstance(body, list) else None
+    if size is not None:
+        metrics.responseSize.observe(size, fname, outForm)
+
+    if timer is not None:
+        logging.getLogger('access').info(json.dumps({'function': fname, 'format': outForm,
+                                                     'method': environ.get('REQUEST_METHOD'),
+                                                     'query': environ.get('QUERY_STRING', ''),
+                                                     'status': int(status[0].split()[0]), 'size': size,
+                                                     'duration': round(duration * 1000, 3),
+                                                     'phases': {k: round(v * 1000, 3)
+                                                                for k, v in timer.phases.items()}}))
+    return body
+
+
+def handleRequest(environ, start_response):
+    """Process requests and calls proper functions."""
+    fname = environ['PATH_INFO']
+
+    config = readConfig()
+    here = os.path.dirname(__file__)
+    baseURL = config.get('Service', 'baseURL')
+    loadProfiler(config)
+
+    # Measure the phases of the request if configured
+    if config.getboolean('Service', 'servertiming', fallback=False):
+        timing.start()
 
     # Among others, this will filter wrong function names,
     # but also the favicon.ico request, for instance.
@@ -335,6 +607,7 @@ def application(environ, start_response):
             form = cgi.FieldStorage(fp=environ['wsgi.input'], environ=environ)
             try:
                 outForm = getParam(form, ['format'], default='xml').lower()
+                environ['routing.format'] = outForm
             except Exception:
                 message = "Error while parsing parameter 'format': %s" % str(form['format'])
                 return send_error_response("400 Bad Request", message, start_response)
@@ -350,6 +623,7 @@ def application(environ, start_response):
                 form = environ['wsgi.input'].read(length).decode()
             else:
                 form = environ['wsgi.input'].read().decode()
+            environ['routing.body'] = form
 
             for line in form.splitlines():
                 if not len(line):
@@ -360,6 +634,7 @@ def application(environ, start_response):
                 k, v = line.split('=')
                 if k.strip() == 'format':
                     outForm = v.strip()
+                    environ['routing.format'] = outForm
 
         else:
             raise Exception
@@ -377,13 +652,9 @@ def application(environ, start_response):
     # Check whether the function called is implemented
     implementedFunctions = ['query', 'application.wadl', 'localconfig',
                             'globalconfig', 'version', 'info', '',
-                            'virtualnets', 'endpoints', 'dc']
+                            'virtualnets', 'endpoints', 'dc', 'metrics']
 
-    if routes is None:
-        # Add routing cache here, to be accessible to all modules
-        routesFile = os.path.join(here, 'data', 'routing.xml')
-        configFile = os.path.join(here, 'routing.cfg')
-        routes = RoutingCache(routesFile, configFile)
+    loadRoutes(config, environ.get('routing.watch', True))
 
     fname = environ['PATH_INFO'].split('/')[-1]
     if fname not in implementedFunctions:
@@ -392,29 +663,22 @@ def application(environ, start_response):
                                    start_response)
 
     if fname == '':
-        # here = os.path.dirname(__file__)
-        helpFile = os.path.join(here, 'help.html')
-        with open(helpFile, 'r') as helpHandle:
-            iterObj = helpHandle.read()
-            status = '200 OK'
-            return send_html_response(status, iterObj, start_response)
+        iterObj = helpPage()
+        status = '200 OK'
+        return send_html_response(status, iterObj, start_response)
 
     elif fname == 'application.wadl':
-        # here = os.path.dirname(__file__)
-        appWadl = os.path.join(here, 'application.wadl')
-        with open(appWadl, 'r') \
-                as appFile:
-            tomorrow = datetime.date.today() + datetime.timedelta(days=1)
-            iterObj = appFile.read() % (baseURL, tomorrow)
-            status = '200 OK'
-            return send_xml_response(status, iterObj, start_response)
+        iterObj = applicationWadl(baseURL)
+        status = '200 OK'
+        return send_xml_response(status, iterObj, start_response)
 
     elif fname == 'query':
         makeQuery = globals()['makeQuery%s' % environ['REQUEST_METHOD']]
         try:
             iterObj = makeQuery(form)
 
-            iterObj = applyFormat(iterObj, outForm)
+            with phase('format'):
+                iterObj = applyFormat(iterObj, outForm)
 
             status = '200 OK'
             if outForm == 'xml':
@@ -466,6 +730,10 @@ def application(environ, start_response):
         return send_json_response('200 OK', result,
                                   start_response)
 
+    elif fname == 'metrics':
+        text = metrics.render(routes)
+        return send_plain_response('200 OK', text, start_response)
+
     elif fname == 'version':
         text = "1.2.3"
         return send_plain_response('200 OK', text, start_response)
@@ -479,3 +747,21 @@ def application(environ, start_response):
         return send_plain_response('200 OK', text, start_response)
 
     raise Exception('This point should have never been reached!')
+
+
+def main():
+    # Pre-fork server sharing the routing table among the workers
+    msg = 'Run the Routing Service in a pre-fork HTTP server.'
+    parser = argparse.ArgumentParser(description=msg)
+    parser.add_argument('-H', '--host', default='', help='Address to listen on.')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on.')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Number of worker processes.')
+    args = parser.parse_args()
+
+    # serve() freezes everything before forking. The workers start the thread
+    # checking for new routing tables.
+    serve(application, args.host, args.port, args.workers, preload=lambda: warmup(watch=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""Tests to check that the routing table is shared by pre-forked workers
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import gc
+import json
+import datetime
+import unittest
+
+here = os.path.dirname(__file__)
+sys.path.append(os.path.join(here, '..'))
+
+import routing
+from routeutils.unittestTools import WITestRunner
+from routeutils import metrics
+from routeutils.utils import RoutingCache
+from routeutils.utils import RoutingSnapshot
+from routeutils.utils import Stream
+from routeutils.utils import TW
+from routeutils.utils import Route
+from routeutils.utils import Station
+from routeutils.prefork import freeze
+from routeutils.prefork import memoryusage
+
+
+def childMemory(rc: RoutingCache) -> dict:
+    """Fork a process which routes some requests and runs the garbage collector.
+
+    :returns: Memory usage of the child (kB)
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        try:
+            for net in range(0, 200, 20):
+                rc.getRoute(Stream('N%d' % net, 'S1', '*', '*'), TW(None, None))
+            gc.collect()
+            os.write(wfd, json.dumps(memoryusage()).encode())
+        finally:
+            os._exit(0)
+
+    os.close(wfd)
+    with os.fdopen(rfd) as fin:
+        result = json.loads(fin.read())
+    os.waitpid(pid, 0)
+    return result
+
+
+class PreforkTests(unittest.TestCase):
+    """Test the memory shared by a master process and its workers
+
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        "Setting up test"
+        try:
+            memoryusage()
+        except OSError:
+            raise unittest.SkipTest('Memory usage per process not available')
+
+        # A routing table with many small objects as the one of EIDA
+        ptRT = dict()
+        ptST = dict()
+        start = datetime.datetime(1993, 1, 1)
+        for net in range(200):
+            host = 'dc%d.eida.org' % (net % 10)
+            for sta in range(100):
+                st = Stream('N%d' % net, 'S%d' % sta, '*', '*')
+                ptRT[st] = [Route('dataselect', 'https://%s/fdsnws/dataselect/1/query' % host, TW(start, None), 1),
+                            Route('station', 'https://%s/fdsnws/station/1/query' % host, TW(start, None), 1)]
+                ptST.setdefault(host, dict())[st] = [Station('S%d' % sta, float(net), float(sta), start, None)
+                                                     for _ in range(3)]
+
+        cls.rc = RoutingCache()
+        cls.rc.snapshot = RoutingSnapshot(ptRT, ptST)
+
+    @classmethod
+    def tearDownClass(cls):
+        gc.unfreeze()
+
+    def test_freeze(self):
+        """Workers do not copy the routing table if it was frozen before forking"""
+
+        gc.collect()
+        normal = childMemory(self.rc)
+
+        self.assertGreater(freeze(), 0, 'No objects frozen')
+        frozen = childMemory(self.rc)
+        gc.unfreeze()
+
+        self.assertLess(frozen['Private_Dirty'], normal['Private_Dirty'] / 2,
+                        'Private memory of the worker not reduced (%d kB, %d kB before)' %
+                        (frozen['Private_Dirty'], normal['Private_Dirty']))
+        self.assertGreater(frozen['Rss'] - frozen['Private_Dirty'], frozen['Private_Dirty'],
+                           'Worker does not share most of its memory')
+
+
+class WarmupTests(unittest.TestCase):
+    """Test the preparation of a process before it serves requests
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        start = datetime.datetime(1993, 1, 1)
+        st = Stream('GE', '*', '*', '*')
+        ptRT = {st: [Route('dataselect', 'https://geofon.gfz-potsdam.de/fdsnws/dataselect/1/query',
+                           TW(start, None), 1)]}
+        ptST = {'geofon.gfz-potsdam.de': {st: [Station('APE', 37.07, 25.53, start, None)]}}
+        self.routes = routing.routes
+        routing.routes = RoutingCache()
+        routing.routes.snapshot = RoutingSnapshot(ptRT, ptST)
+
+    def tearDown(self):
+        routing.routes = self.routes
+
+    def test_warmup(self):
+        """Replay the warm-up queries without counting them as requests"""
+
+        before = metrics.requests.get('query', 'post', '200')
+        with self.assertLogs('warmup', level='DEBUG') as logs:
+            timings = routing.warmup(['query?net=GE&format=post'], watch=False)
+        self.assertIn('queries', timings, 'Queries not replayed')
+        replayed = [r.getMessage() for r in logs.records if r.getMessage().startswith('query?net=GE')]
+        self.assertEqual(len(replayed), 1, 'Query not replayed')
+        self.assertRegex(replayed[0], r'\(200 OK, [1-9]\d* bytes\)$', 'Query replayed without routes')
+        self.assertEqual(metrics.requests.get('query', 'post', '200'), before, 'Warm-up counted as a request')
+        self.assertIsNone(routing.routes.watcher, 'Thread checking for new routing tables started')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print('testPrefork [-h] [-p]')
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind in range(len(sys.argv)-1, -1, -1):
+        if ind == 0:
+            break
+        if sys.argv[ind] in ('-p', '--plain'):
+            sys.argv.pop(ind)
+            mode = 0
+        elif sys.argv[ind] in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
@@ -19,21 +19,67 @@ any later version.
 
 import sys
 import os
+import gc
+import weakref
+import threading
 import datetime
+import json
+import pickle
+import shutil
+import tempfile
 import urllib.request as ul
 import unittest
+from xml.etree.ElementTree import ParseError
 
 here = os.path.dirname(__file__)
 sys.path.append(os.path.join(here, '..'))
+# Previous parser of the routing files to compare the results
+sys.path.append(os.path.join(here, '..', 'bench'))
 
+import routing
 from routeutils.unittestTools import WITestRunner
 from routeutils.utils import RoutingCache
+from routeutils.utils import RoutingSnapshot
 from routeutils.utils import RequestMerge
 from routeutils.utils import FDSNRules
 from routeutils.utils import Stream
 from routeutils.utils import TW
 from routeutils.utils import GeoRectangle
 from routeutils.utils import RoutingException
+from routeutils.utils import Route
+from routeutils.utils import Station
+from routeutils.metrics import Counter
+from routeutils.metrics import Histogram
+from routeutils.metrics import render
+from routeutils import timing
+from routeutils.profiling import RequestProfiler
+from routeutils.wsgicomm import build_environ
+from routeutils.artifact import writeartifact
+from routeutils.artifact import RoutingArtifact
+from routeutils.artifact import artifactdigest
+from routeutils.sqlitestore import writesqlite
+from routeutils.sqlitestore import SQLiteSnapshot
+from routeutils.utils import addroutes
+from routeutils.utils import addvirtualnets
+from routeutils.utils import insertroutes
+from routeutils.utils import parserouting
+from parserET import parseroutingET
+from routeutils.utils import str2date
+from routeutils.utils import parseroutes
+from routeutils.utils import insertvirtualnets
+from routeutils.utils import OverlapIndex
+from routeutils.utils import RoutingTransaction
+from routeutils.fragments import FragmentCache
+from routeutils.generations import candidates
+from routeutils.generations import readmanifest
+from routeutils.utils import savecompiled
+from routeutils.utils import filechecksum
+from routeutils.utils import filesignature
+from routeutils.utils import routingreport
+from routeutils.expatparser import RoutingHandler
+from routeutils.synthetic import RoutingGenerator
+from routeutils.utils import parsestations
+from routeutils.utils import stationquery
 
 
 class RouteCacheTests(unittest.TestCase):
@@ -367,6 +413,1001 @@ class RouteCacheTests(unittest.TestCase):
                          'Wrong service name!')
 
 
+def writeTable(binfile, dcs):
+    """Save a small routing table with one route per data centre in binfile.
+
+    :param binfile: File where the compiled routing table must be saved
+    :param dcs: List of tuples (network, host)
+    """
+    ptRT = dict()
+    ptST = dict()
+    for net, host in dcs:
+        st = Stream(net, '*', '*', '*')
+        ptRT[st] = [Route('dataselect', 'https://%s/fdsnws/dataselect/1/query' % host,
+                          TW(datetime.datetime(1993, 1, 1), None), 1)]
+        ptST.setdefault(host, dict())[st] = [Station('STA01', 52.0, 13.0, datetime.datetime(1993, 1, 1), None)]
+
+    with open(binfile, 'wb') as fout:
+        pickle.dump((ptRT, ptST, dict(), list()), fout)
+
+
+def sampleTables() -> tuple:
+    """Return a small routing table, station cache, virtual networks and data centres."""
+    d = datetime.datetime
+    ge = Stream('GE', '*', '*', '*')
+    ch = Stream('CH', 'LIENZ', '', 'HH?')
+    ptRT = {ge: [Route('dataselect', 'https://geofon.gfz-potsdam.de/fdsnws/dataselect/1/query',
+                       TW(d(1993, 1, 1), None), 1),
+                 Route('station', 'https://geofon.gfz-potsdam.de/fdsnws/station/1/query',
+                       TW(None, d(2030, 1, 1, 0, 0, 0, 5)), 2)],
+            ch: [Route('dataselect', 'https://eida.ethz.ch/fdsnws/dataselect/1/query',
+                       TW(d(1980, 1, 1), None), 1)]}
+    stations = [Station('APE', 37.07, 25.53, d(1993, 1, 1), None),
+                Station('ÅRE', 63.4, 13.1, d(1960, 1, 1), d(1970, 1, 1))]
+    ptST = {'geofon.gfz-potsdam.de': {ge: stations},
+            'eida.ethz.ch': {ch: list()},
+            'other.dc': {ge: stations}}
+    ptVN = {'_GEALL': [(ge, TW(None, None))], None: [(ch, TW(d(2000, 1, 1), None))]}
+    eidaDCs = [{'name': 'GEOFON', 'website': 'https://geofon.gfz-potsdam.de'}]
+    return ptRT, ptST, ptVN, eidaDCs
+
+
+class RoutingSnapshotTests(unittest.TestCase):
+    """Test the replacement of the routing information while in use
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.routingFile = os.path.join(self.tmpdir, 'routing.xml')
+        writeTable(self.routingFile + '.bin', [('GE', 'geofon.gfz-potsdam.de')])
+        self.rc = RoutingCache(self.routingFile, os.path.join(self.tmpdir, 'routing.cfg'))
+
+    def tearDown(self):
+        self.rc.stopWatching.set()
+        shutil.rmtree(self.tmpdir)
+
+    def test_reload(self):
+        """Reload a new routing table keeping the old one for requests in progress"""
+
+        self.assertFalse(self.rc.reload(), 'Nothing should be reloaded if the file did not change')
+        oldSnapshot = self.rc.snapshot
+
+        writeTable(self.routingFile + '.bin', [('GE', 'geofon.gfz-potsdam.de'), ('RO', 'eida-sc3.infp.ro')])
+        # Force a different signature even if the file system has a coarse timestamp resolution
+        os.utime(self.routingFile + '.bin', ns=(0, 0))
+        self.assertTrue(self.rc.reload(), 'New routing table was not loaded')
+
+        result = self.rc.getRoute(Stream('RO', '*', '*', '*'), TW(None, None))
+        self.assertEqual(result[0]['url'], 'https://eida-sc3.infp.ro/fdsnws/dataselect/1/query',
+                         'Wrong URL for RO.*.*.*')
+
+        # The old snapshot must be still usable and unchanged
+        self.assertEqual(len(oldSnapshot.routingTable), 1, 'Old snapshot was modified')
+        with self.assertRaises(RoutingException):
+            self.rc.getRoute(Stream('RO', '*', '*', '*'), TW(None, None), snapshot=oldSnapshot)
+
+    def test_updatevn(self):
+        """Do not replace the virtual networks while a routing table is being reloaded"""
+
+        shutil.copy(os.path.join(here, '..', 'data', 'routing.sample.xml'), self.routingFile)
+        oldSnapshot = self.rc.snapshot
+        thread = threading.Thread(target=self.rc.updateVN)
+        with self.rc.updateLock:
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive(), 'Virtual networks updated during a reload')
+            self.assertIs(self.rc.snapshot, oldSnapshot, 'Snapshot replaced during a reload')
+        thread.join()
+        self.assertIn('_GEALL', self.rc.snapshot.vnTable, 'Virtual networks not updated')
+        self.assertIs(self.rc.snapshot.routingTable, oldSnapshot.routingTable, 'Routes not kept')
+
+    def test_reload_same_content(self):
+        """Do not reload a routing table if only the timestamp changed"""
+
+        os.utime(self.routingFile + '.bin', ns=(0, 0))
+        self.assertFalse(self.rc.reload(), 'Routing table reloaded although the content did not change')
+
+    def test_gcfreeze(self):
+        """Freeze the routing information after loading it"""
+
+        try:
+            rc = RoutingCache(self.routingFile, os.path.join(self.tmpdir, 'routing.cfg'), gcfreeze=True)
+            self.assertGreater(gc.get_freeze_count(), 0, 'Routing information not frozen')
+            result = rc.getRoute(Stream('GE', '*', '*', '*'), TW(None, None))
+            self.assertEqual(len(result), 1, 'Wrong routes with a frozen routing table')
+        finally:
+            gc.unfreeze()
+
+    def test_gcfreeze_reload(self):
+        """Release the cycles of the previous snapshot when freezing a new one"""
+
+        class Node(object):
+            pass
+
+        try:
+            rc = RoutingCache(self.routingFile, os.path.join(self.tmpdir, 'routing.cfg'), gcfreeze=True)
+            node = Node()
+            node.cycle = node
+            ref = weakref.ref(node)
+            # Frozen with the routing information in use
+            rc.snapshot.cache['node'] = node
+            del node
+            gc.freeze()
+            rc._install(RoutingSnapshot())
+            self.assertIsNone(ref(), 'Cycle of the previous snapshot kept frozen')
+        finally:
+            gc.unfreeze()
+
+    def test_gcfreeze_inherited(self):
+        """Keep frozen the objects frozen by the master process before forking"""
+
+        class Node(object):
+            pass
+
+        try:
+            rc = RoutingCache(self.routingFile, os.path.join(self.tmpdir, 'routing.cfg'), gcfreeze=True)
+            # As if the routing information had been loaded before forking
+            rc.frozenBy = os.getppid()
+            node = Node()
+            node.cycle = node
+            ref = weakref.ref(node)
+            rc.snapshot.cache['node'] = node
+            del node
+            gc.freeze()
+            rc._install(RoutingSnapshot())
+            self.assertIsNotNone(ref(), 'Objects frozen by the master unfrozen and collected')
+            self.assertEqual(rc.frozenBy, os.getpid(), 'New snapshot not frozen by this process')
+        finally:
+            gc.unfreeze()
+
+    def test_reload_missing(self):
+        """Keep the routing table if the compiled file is missing"""
+
+        os.remove(self.routingFile + '.bin')
+        self.assertFalse(self.rc.reload(), 'Routing table reloaded from a missing file')
+        result = self.rc.getRoute(Stream('GE', '*', '*', '*'), TW(None, None))
+        self.assertEqual(len(result), 1, 'Routing table lost after a failed reload')
+
+
+class ArtifactTests(unittest.TestCase):
+    """Test the compiled routing table mapped in memory
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.binFile = os.path.join(self.tmpdir, 'routing.xml.bin')
+
+        self.ptRT, self.ptST, self.ptVN, self.eidaDCs = sampleTables()
+        writeartifact(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        """Read exactly the same information which was saved"""
+
+        art = RoutingArtifact(self.binFile)
+        self.assertEqual(list(art.routingTable.keys()), list(self.ptRT.keys()), 'Wrong streams')
+        self.assertEqual(dict(art.routingTable), self.ptRT, 'Wrong routes')
+        self.assertEqual({k: dict(v) for k, v in art.stationTable.items()}, self.ptST, 'Wrong stations')
+        self.assertEqual(art.vnTable, self.ptVN, 'Wrong virtual networks')
+        self.assertEqual(art.eidaDCs, self.eidaDCs, 'Wrong data centres')
+        self.assertEqual(art.stats(), {'streams': 2, 'routes': 3, 'stations': 4, 'vnets': 2}, 'Wrong statistics')
+
+    def test_release(self):
+        """Release the memory map without the garbage collector"""
+
+        art = RoutingArtifact(self.binFile)
+        ptRT = art.routingTable
+        records = weakref.ref(art.records)
+        gc.disable()
+        try:
+            del art
+            self.assertIsNotNone(records(), 'Records released while the routing table is in use')
+            del ptRT
+            self.assertIsNone(records(), 'Records kept in memory by a reference cycle')
+        finally:
+            gc.enable()
+
+    def test_corrupted(self):
+        """Reject a file with a wrong checksum"""
+
+        with open(self.binFile, 'r+b') as fout:
+            fout.seek(-1, os.SEEK_END)
+            fout.write(b'#')
+        with self.assertRaises(ValueError):
+            RoutingArtifact(self.binFile)
+
+    def test_loadbin(self):
+        """Check the content of the file only once"""
+
+        rc = RoutingCache()
+        # Without manifest only the checksum in the header is checked
+        snapshot = rc.loadbin(self.binFile)
+        self.assertNotIn('checksum', snapshot.source, 'Whole file read to calculate its checksum')
+        self.assertEqual(snapshot.source['digest'], artifactdigest(self.binFile), 'Wrong digest')
+
+        # The checksum of the manifest is enough
+        snapshot = rc.loadbin(self.binFile, {'generation': 1, 'checksum': filechecksum(self.binFile),
+                                             'built': '2023-05-02T03:52:00Z'})
+        self.assertEqual(snapshot.source['checksum'], filechecksum(self.binFile), 'Wrong checksum')
+
+        with open(self.binFile, 'r+b') as fout:
+            fout.seek(-1, os.SEEK_END)
+            fout.write(b'#')
+        with self.assertRaises(ValueError):
+            rc.loadbin(self.binFile)
+
+    def test_routingcache(self):
+        """Route a request with the compiled table mapped in memory"""
+
+        rc = RoutingCache(os.path.join(self.tmpdir, 'routing.xml'), os.path.join(self.tmpdir, 'routing.cfg'))
+        self.assertNotIsInstance(rc.routingTable, dict, 'Routing table not mapped in memory')
+        result = rc.getRoute(Stream('GE', 'APE', '*', '*'), TW(None, None))
+        self.assertEqual(result[0]['url'], 'https://geofon.gfz-potsdam.de/fdsnws/dataselect/1/query',
+                         'Wrong URL for GE.APE.*.*')
+        self.assertEqual(rc.snapshot.stats()['stations'], 4, 'Wrong statistics')
+
+
+class SQLiteTests(unittest.TestCase):
+    """Test the routing information stored in SQLite
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.binFile = os.path.join(self.tmpdir, 'routing.xml.bin')
+        self.ptRT, self.ptST, self.ptVN, self.eidaDCs = sampleTables()
+        writesqlite(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        """Read exactly the same information which was saved"""
+
+        snapshot = SQLiteSnapshot(self.binFile)
+        self.assertEqual(list(snapshot.routingTable.keys()), list(self.ptRT.keys()), 'Wrong streams')
+        self.assertEqual(dict(snapshot.routingTable), self.ptRT, 'Wrong routes')
+        self.assertEqual({k: dict(v) for k, v in snapshot.stationTable.items()}, self.ptST, 'Wrong stations')
+        self.assertEqual(dict(snapshot.vnTable), self.ptVN, 'Wrong virtual networks')
+        self.assertEqual(snapshot.eidaDCs, self.eidaDCs, 'Wrong data centres')
+        self.assertNotIn(Stream('XX', '*', '*', '*'), snapshot.routingTable, 'Unknown stream found')
+        self.assertEqual(snapshot.stats(), {'streams': 2, 'routes': 3, 'stations': 4, 'vnets': 2},
+                         'Wrong statistics')
+
+    def test_generation(self):
+        """Read the same generation from all threads after a new one is published"""
+
+        binFile = os.path.join(self.tmpdir, 'generations.bin')
+        savecompiled(binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs, 'sqlite')
+        snapshot = SQLiteSnapshot(binFile)
+        savecompiled(binFile, {Stream('XX', '*', '*', '*'): self.ptRT[Stream('GE', '*', '*', '*')]}, dict(),
+                     dict(), self.eidaDCs, 'sqlite')
+
+        def inthread(function):
+            result = list()
+
+            def run():
+                try:
+                    result.append(function())
+                except Exception as e:
+                    result.append(e)
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+            return result[0]
+
+        self.assertEqual(inthread(lambda: list(snapshot.routingTable.keys())), list(self.ptRT.keys()),
+                         'New generation read by another thread')
+
+        # A file replaced in place cannot be used by new connections
+        snapshot = SQLiteSnapshot(self.binFile)
+        writesqlite(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+        self.assertIsInstance(inthread(lambda: snapshot.db.count('streams')), ValueError,
+                              'Replaced file read by another thread')
+
+    def test_routingcache(self):
+        """Route requests with the routing information in SQLite"""
+
+        rc = RoutingCache(os.path.join(self.tmpdir, 'routing.xml'), os.path.join(self.tmpdir, 'routing.cfg'))
+        self.assertIsInstance(rc.snapshot, SQLiteSnapshot, 'Database not used')
+        result = rc.getRoute(Stream('GE', 'APE', '*', '*'), TW(None, None))
+        self.assertEqual(result[0]['url'], 'https://geofon.gfz-potsdam.de/fdsnws/dataselect/1/query',
+                         'Wrong URL for GE.APE.*.*')
+        result = rc.getRoute(Stream('_GEALL', 'APE', '*', '*'), TW(None, None))
+        self.assertEqual(result[0]['params'][0]['net'], 'GE', 'Wrong expansion of virtual network _GEALL')
+        self.assertEqual(json.loads(rc.virtualNets()), json.loads(RoutingCache().virtualNets(
+            RoutingSnapshot(vntable=self.ptVN))), 'Wrong virtual networks')
+
+
+class GenerationTests(unittest.TestCase):
+    """Test the generations of the compiled routing table
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.binFile = os.path.join(self.tmpdir, 'routing.xml.bin')
+        self.ptRT, self.ptST, self.ptVN, self.eidaDCs = sampleTables()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_publish(self):
+        """Publish new generations and keep only the last ones"""
+
+        for storage in ('artifact', 'sqlite', 'artifact', 'artifact'):
+            entry = savecompiled(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs, storage, 2)
+        self.assertEqual(entry['generation'], 4, 'Wrong generation')
+        self.assertEqual(entry['routes'], 3, 'Wrong statistics')
+        self.assertTrue(os.path.islink(self.binFile), 'Compiled table is not a link')
+        self.assertEqual(os.readlink(self.binFile), 'routing.xml.bin.4', 'Link to a wrong generation')
+        self.assertEqual([e['generation'] for e in readmanifest(self.binFile)], [4, 3], 'Wrong manifest')
+        self.assertEqual(sorted(f for f in os.listdir(self.tmpdir) if f.startswith('routing.xml.bin.')),
+                         ['routing.xml.bin.3', 'routing.xml.bin.4', 'routing.xml.bin.manifest'],
+                         'Old generations not removed')
+
+    def test_link(self):
+        """Load the generation pointed by the link before it is in the manifest"""
+
+        entry = savecompiled(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+        self.assertTrue(entry['built'].endswith('Z'), 'Build time not in UTC')
+        # A new generation is being published. The link is replaced before the manifest.
+        shutil.copy(self.binFile + '.1', self.binFile + '.2')
+        os.remove(self.binFile)
+        os.symlink('routing.xml.bin.2', self.binFile)
+        self.assertEqual(candidates(self.binFile), [(self.binFile + '.2', None),
+                                                    (self.binFile + '.1', entry)], 'Wrong candidates')
+
+    def test_interrupted(self):
+        """Do not overwrite a generation published without updating the manifest"""
+
+        savecompiled(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+        # The link was replaced but the process stopped before writing the manifest
+        shutil.copy(self.binFile + '.1', self.binFile + '.2')
+        os.remove(self.binFile)
+        os.symlink('routing.xml.bin.2', self.binFile)
+        entry = savecompiled(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+        self.assertEqual(entry['generation'], 3, 'Generation on disk reused')
+        self.assertEqual(os.readlink(self.binFile), 'routing.xml.bin.3', 'Link to a wrong generation')
+
+    def test_no_xml(self):
+        """Do not parse the XML files if the compiled routing table cannot be read"""
+
+        savecompiled(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+        shutil.copy(os.path.join(here, '..', 'data', 'routing.sample.xml'), os.path.join(self.tmpdir, 'routing.xml'))
+        rc = RoutingCache(os.path.join(self.tmpdir, 'routing.xml'), os.path.join(self.tmpdir, 'routing.cfg'))
+        snapshot = rc.snapshot
+        with open(self.binFile + '.1', 'r+b') as fout:
+            fout.seek(-1, os.SEEK_END)
+            fout.write(b'#')
+
+        # The routing information in use is kept
+        rc.update()
+        self.assertIs(rc.snapshot, snapshot, 'Routing information replaced')
+        # There is nothing to keep in a new process
+        with self.assertRaises(ValueError):
+            RoutingCache(os.path.join(self.tmpdir, 'routing.xml'), os.path.join(self.tmpdir, 'routing.cfg'))
+
+    def test_metrics(self):
+        """Export the generation in use and its build time"""
+
+        entry = savecompiled(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+        rc = RoutingCache(os.path.join(self.tmpdir, 'routing.xml'), os.path.join(self.tmpdir, 'routing.cfg'))
+        # The file is modified later than the build time in the manifest
+        os.utime(self.binFile + '.1', (0, 0))
+        built = datetime.datetime.strptime(entry['built'], '%Y-%m-%dT%H:%M:%SZ')
+        text = render(rc)
+        self.assertIn('routing_table_generation 1\n', text, 'Wrong generation')
+        self.assertIn('routing_table_build_timestamp_seconds %s\n'
+                      % built.replace(tzinfo=datetime.timezone.utc).timestamp(), text, 'Wrong build time')
+
+    def test_fallback(self):
+        """Load the previous generation if the newest one is corrupted"""
+
+        savecompiled(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs, 'sqlite')
+        savecompiled(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs, 'artifact')
+        with open(self.binFile + '.2', 'r+b') as fout:
+            fout.seek(-1, os.SEEK_END)
+            fout.write(b'#')
+
+        # There is no routing.xml to parse
+        rc = RoutingCache(os.path.join(self.tmpdir, 'routing.xml'), os.path.join(self.tmpdir, 'routing.cfg'))
+        self.assertIsInstance(rc.snapshot, SQLiteSnapshot, 'Previous generation not used')
+        self.assertEqual(rc.snapshot.source['file'], self.binFile + '.1', 'Wrong generation loaded')
+        result = rc.getRoute(Stream('GE', 'APE', '*', '*'), TW(None, None))
+        self.assertEqual(result[0]['url'], 'https://geofon.gfz-potsdam.de/fdsnws/dataselect/1/query',
+                         'Wrong URL for GE.APE.*.*')
+
+    def test_report(self):
+        """Summarise the compiled routing information"""
+
+        report = routingreport(self.ptRT, self.ptST, self.ptVN)
+        self.assertEqual((report['streams'], report['routes'], report['stations'], report['vnets']), (2, 3, 4, 2),
+                         'Wrong statistics')
+        self.assertEqual(report['routesperdc'], {'geofon.gfz-potsdam.de': {'dataselect': 1, 'station': 1},
+                                                 'eida.ethz.ch': {'dataselect': 1}}, 'Wrong routes per data centre')
+        self.assertEqual(report['wildcards']['channel'], {'all': 1, 'pattern': 1, 'exact': 0}, 'Wrong wildcards')
+        self.assertEqual(report['wildcards']['station'], {'all': 1, 'pattern': 0, 'exact': 1}, 'Wrong wildcards')
+        self.assertEqual(report['stationsperdc']['other.dc'], 2, 'Wrong stations per data centre')
+        self.assertEqual(report['vnetsizes'], {'_GEALL': 1, 'None': 1}, 'Wrong sizes of virtual networks')
+        json.dumps(report)
+
+    def test_legacy(self):
+        """Read a compiled table saved without generations"""
+
+        writeartifact(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+        self.assertEqual(candidates(self.binFile), [(self.binFile, None)], 'Wrong candidates')
+        rc = RoutingCache(os.path.join(self.tmpdir, 'routing.xml'), os.path.join(self.tmpdir, 'routing.cfg'))
+        self.assertEqual(rc.snapshot.stats()['routes'], 3, 'Wrong statistics')
+
+        # The regular file is replaced by a link to the first generation
+        savecompiled(self.binFile, self.ptRT, self.ptST, self.ptVN, self.eidaDCs)
+        self.assertEqual(candidates(self.binFile), [(self.binFile + '.1', readmanifest(self.binFile)[0])],
+                         'Wrong candidates')
+        # Same content in the new generation
+        self.assertFalse(rc.reload(), 'Same routing data loaded again')
+
+
+class SyntheticTests(unittest.TestCase):
+    """Test the generator of synthetic routing information
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.generator = RoutingGenerator(3000, datacentres=4, seed=7)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_deterministic(self):
+        """Same routing files from the same seed"""
+
+        contents = list()
+        for seed in (7, 7, 8):
+            filename = os.path.join(self.tmpdir, 'routing-%d.xml' % len(contents))
+            RoutingGenerator(3000, datacentres=4, seed=seed).writerouting(filename)
+            with open(filename, 'rb') as fin:
+                contents.append(fin.read())
+        self.assertEqual(contents[0], contents[1], 'Different files from the same seed')
+        self.assertNotEqual(contents[0], contents[2], 'Same file from different seeds')
+
+    def test_routingfiles(self):
+        """Read the routing files of all data centres as the tables generated"""
+
+        synchronize = self.generator.write(self.tmpdir)
+        files = ['routing.xml'] + [line.split(',')[1].strip() for line in synchronize.splitlines()]
+        self.assertEqual(files, ['routing.xml', 'routing-DC1.xml', 'routing-DC2.xml', 'routing-DC3.xml'],
+                         'Wrong routing files')
+
+        ptRT = dict()
+        ptVN = dict()
+        transaction = RoutingTransaction(ptRT, ptVN)
+        for filename in files:
+            routes, vnets = parserouting(os.path.join(self.tmpdir, filename))
+            transaction.stage(routes, vnets, filename=filename)
+            transaction.commit()
+
+        expected = self.generator.routingtable()
+        self.assertGreaterEqual(sum(len(r) for r in expected.values()), 3000, 'Not enough routes')
+        self.assertEqual(set(ptRT), set(expected), 'Wrong streams')
+        for st, routes in ptRT.items():
+            self.assertEqual(sorted(routes, key=repr), sorted(expected[st], key=repr), 'Wrong routes for %s' % (st,))
+        self.assertEqual(ptVN, self.generator.vntable(), 'Wrong virtual networks')
+        with open(os.path.join(self.tmpdir, 'routing-DC2.json')) as fin:
+            self.assertEqual(json.load(fin)['name'], 'DC2', 'Wrong data centre')
+
+    def test_stations(self):
+        """Answer queries to a station-WS"""
+
+        st, routes, _ = self.generator.streams[0]
+        rt = [r for r in routes if r.service == 'station'][0]
+        params = dict((k, v) for k, v in (p.split('=') for p in stationquery(st, rt).split('?')[1].split('&')))
+        stations = parsestations(self.generator.stationtext(params).splitlines(), st, rt)
+        self.assertGreater(len(stations), 0, 'No stations found')
+        self.assertEqual(stations, [sta for _, sta in self.generator.querystations(params)], 'Wrong stations')
+        self.assertEqual(self.generator.stationtable()[rt.address.split('/')[2]][st], stations,
+                         'Wrong station cache')
+
+        status = list()
+        self.generator.stationapp({'PATH_INFO': '/fdsnws/station/1/query', 'QUERY_STRING': 'net=XX&format=text'},
+                                  lambda s, headers: status.append(s))
+        self.generator.stationapp({'PATH_INFO': '/wrong', 'QUERY_STRING': ''}, lambda s, headers: status.append(s))
+        self.assertEqual(status, ['204 No Content', '404 Not Found'], 'Wrong status')
+
+
+class FragmentTests(unittest.TestCase):
+    """Test the incremental parsing of the routing files
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.xmlFile = os.path.join(self.tmpdir, 'routing.xml')
+        shutil.copy(os.path.join(here, '..', 'data', 'routing.sample.xml'), self.xmlFile)
+        self.cacheDir = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_same_tables(self):
+        """Fragments produce the same tables as parsing the file"""
+
+        fragment = FragmentCache(self.cacheDir).get(self.xmlFile)
+        self.assertEqual(insertroutes(fragment.routes, dict()), addroutes(self.xmlFile), 'Wrong routes')
+        self.assertEqual(insertvirtualnets(fragment.vnets, dict()), addvirtualnets(self.xmlFile),
+                         'Wrong virtual networks')
+
+    def test_single_pass(self):
+        """Routes and virtual networks are read from the file once"""
+
+        opened = list()
+        handlerParse = RoutingHandler.parse
+
+        def parse(handler, fin):
+            opened.append(fin)
+            return handlerParse(handler, fin)
+
+        RoutingHandler.parse = parse
+        try:
+            routes, vnets = parserouting(self.xmlFile)
+        finally:
+            RoutingHandler.parse = handlerParse
+        self.assertEqual(len(opened), 1, 'File parsed more than once')
+        self.assertEqual(routes, parseroutes(self.xmlFile), 'Wrong routes')
+        self.assertEqual([vn[0] for vn in vnets], ['_GEALL'] * 3, 'Wrong virtual networks')
+        self.assertEqual(vnets[0][1], Stream('GE', 'APE', '*', '*'), 'Wrong stream in virtual network')
+
+    def test_unchanged(self):
+        """Only the files which changed are parsed again"""
+
+        fc = FragmentCache(self.cacheDir)
+        first = fc.get(self.xmlFile)
+        self.assertIn(self.xmlFile, fc.changed, 'File not parsed the first time')
+        fc.commit()
+
+        fc = FragmentCache(self.cacheDir)
+        self.assertEqual(fc.get(self.xmlFile), first, 'Different fragment for the same file')
+        self.assertEqual(len(fc.changed), 0, 'File parsed again without changes')
+
+        with open(self.xmlFile, 'a') as fout:
+            fout.write('\n')
+        fc = FragmentCache(self.cacheDir)
+        self.assertEqual(fc.get(self.xmlFile).routes, first.routes, 'Wrong routes after changing the file')
+        self.assertIn(self.xmlFile, fc.changed, 'Changed file not parsed')
+
+        fc = FragmentCache(self.cacheDir, full=True)
+        fc.get(self.xmlFile)
+        self.assertIn(self.xmlFile, fc.changed, 'File not parsed in a full rebuild')
+
+    def test_previous(self):
+        """The last fragment is used if the file cannot be parsed"""
+
+        fc = FragmentCache(self.cacheDir)
+        first = fc.get(self.xmlFile)
+        self.assertIsNone(fc.previous(self.xmlFile), 'Previous fragment of a file parsed the first time')
+        fc.commit()
+
+        # Broken after the root element, so that its backup is not read
+        with open(self.xmlFile, 'w') as fout:
+            fout.write('<ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/"><ns0:rou')
+        fc = FragmentCache(self.cacheDir)
+        with self.assertRaises(Exception):
+            fc.get(self.xmlFile)
+        self.assertEqual(fc.previous(self.xmlFile), first, 'Wrong previous fragment')
+        fc.commit()
+
+        # The file is parsed again in the next run
+        shutil.copy(os.path.join(here, '..', 'data', 'routing.sample.xml'), self.xmlFile)
+        fc = FragmentCache(self.cacheDir)
+        fc.get(self.xmlFile)
+        self.assertEqual(len(fc.changed), 0, 'Fragment of the broken file saved')
+        # A fragment parsed in this run can be replaced by the previous one
+        with open(self.xmlFile, 'a') as fout:
+            fout.write('\n')
+        fc = FragmentCache(self.cacheDir)
+        fc.get(self.xmlFile)
+        self.assertEqual(fc.previous(self.xmlFile), first, 'Previous fragment not kept')
+        fc.commit()
+        self.assertEqual(len([f for f in os.listdir(self.cacheDir) if f.endswith('.fragment')]), 1,
+                         'Fragments not removed')
+
+    def test_prefetch(self):
+        """Files parsed in parallel give the same fragments"""
+
+        files = [self.xmlFile]
+        for dcid in ('A', 'B'):
+            files.append(os.path.join(self.tmpdir, 'routing-%s.xml' % dcid))
+            with open(self.xmlFile) as fin, open(files[-1], 'w') as fout:
+                fout.write(fin.read().replace('networkCode="GE"', 'networkCode="%s"' % dcid))
+        broken = os.path.join(self.tmpdir, 'routing-C.xml')
+        with open(broken, 'w') as fout:
+            fout.write('<ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/"><ns0:rou')
+
+        serial = FragmentCache(os.path.join(self.tmpdir, 'serial'))
+        fc = FragmentCache(self.cacheDir)
+        # Use the pool also on hosts with a single core
+        cpuCount = os.cpu_count
+        os.cpu_count = lambda: 2
+        try:
+            fc.prefetch(files + [broken], workers=2)
+        finally:
+            os.cpu_count = cpuCount
+        self.assertEqual(sorted(fc.prefetched), sorted(files + [broken]), 'Files not parsed in parallel')
+        for filename in files:
+            self.assertEqual(fc.get(filename), serial.get(filename), 'Different fragment for %s' % filename)
+        self.assertEqual(sorted(fc.changed), sorted(files), 'Files parsed not reported')
+        with self.assertRaises(ParseError):
+            fc.get(broken)
+        fc.commit()
+
+        # Nothing to parse in parallel if the files did not change
+        fc = FragmentCache(self.cacheDir)
+        fc.prefetch(files, workers=2)
+        self.assertEqual(len(fc.prefetched), 0, 'Files parsed again')
+        self.assertEqual(fc.get(self.xmlFile), serial.get(self.xmlFile), 'Wrong fragment of unchanged file')
+
+    def test_checksum(self):
+        """The checksum of a file is calculated only once while it does not change"""
+
+        fc = FragmentCache(self.cacheDir)
+        fc.get(self.xmlFile)
+        fc.commit()
+
+        fc = FragmentCache(self.cacheDir)
+        fc.prefetch([self.xmlFile], workers=2)
+        self.assertEqual(fc.checksums[self.xmlFile][1], filechecksum(self.xmlFile), 'Wrong checksum')
+        # The checksum calculated by prefetch is the one used by get
+        fc.checksums[self.xmlFile] = (filesignature(self.xmlFile), '0' * 40)
+        fc.get(self.xmlFile)
+        self.assertIn(self.xmlFile, fc.changed, 'Checksum calculated again')
+
+        with open(self.xmlFile, 'a') as fout:
+            fout.write('\n')
+        self.assertEqual(fc.checksum(self.xmlFile), filechecksum(self.xmlFile), 'Modified file not read again')
+
+
+class ParserTests(unittest.TestCase):
+    """Test the parser of routing files based on expat
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.xmlFile = os.path.join(self.tmpdir, 'routing.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def writeFile(self, body):
+        with open(self.xmlFile, 'w') as fout:
+            fout.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                       '<ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/">\n%s\n'
+                       '</ns0:routing>\n' % body)
+
+    def test_sample(self):
+        """Same routes and virtual networks as with ElementTree"""
+
+        sample = os.path.join(here, '..', 'data', 'routing.sample.xml')
+        self.assertEqual(parserouting(sample), parseroutingET(sample), 'Different result with expat')
+
+    def test_checks(self):
+        """Wrong routes are discarded as with ElementTree"""
+
+        self.writeFile('''<ns0:route networkCode="GE" streamCode="BH?">
+  <ns0:dataselect address="http://a" start="2000-01-01T00:00:00" priority="1"/>
+</ns0:route>
+<ns0:route networkCode="GE" stationCode="" locationCode="">
+  <ns0:dataselect address="" priority="1"/>
+  <ns0:dataselect priority="1"/>
+  <ns0:station address="http://s" start="2005-01-01T00:00:00" end="2001-01-01T00:00:00"/>
+  <ns0:station address="http://s2" start="wrong" end="2001-01-01T00:00:00" priority=""/>
+  <ns0:wfcatalog address="http://w" priority="x"/>
+</ns0:route>
+<ns0:vnetwork networkCode="_V">
+  <ns0:stream networkCode="GE" stationCode="A*"/>
+  <ns0:stream networkCode="GE" start="wrong" end="2010-01-01T00:00:00"/>
+</ns0:vnetwork>''')
+
+        routes, vnets = parserouting(self.xmlFile)
+        self.assertEqual((routes, vnets), parseroutingET(self.xmlFile), 'Different result with expat')
+        st = Stream('GE', '*', '*', '*')
+        self.assertEqual(routes, [(st, Route('station', 'http://s2', TW(None, datetime.datetime(2001, 1, 1)), 99)),
+                                  (st, Route('wfcatalog', 'http://w', TW(None, None), 99))], 'Wrong routes')
+        self.assertEqual(vnets, [('_V', Stream('GE', '*', '*', '*'), TW(None, datetime.datetime(2010, 1, 1)))],
+                         'Wrong virtual networks')
+
+    def test_backup(self):
+        """The backup is read if the file cannot be parsed"""
+
+        self.writeFile('<ns0:route networkCode="GE"><ns0:station address="http://s"/></ns0:route>')
+        os.rename(self.xmlFile, self.xmlFile + '.bck')
+        with open(self.xmlFile, 'w') as fout:
+            fout.write('Not found')
+
+        routes, vnets = parserouting(self.xmlFile)
+        self.assertEqual(routes, [(Stream('GE', '*', '*', '*'), Route('station', 'http://s', TW(None, None), 99))],
+                         'Wrong routes from backup')
+        self.assertTrue(os.path.exists(self.xmlFile + '.wrong'), 'Wrong file not kept')
+
+        # Errors after the root element are not hidden
+        self.writeFile('<ns0:route networkCode="GE"><ns0:station address="http://s"/></ns0:rou')
+        with self.assertRaises(ParseError):
+            parserouting(self.xmlFile)
+
+
+class DateTests(unittest.TestCase):
+    """Test the conversion of strings to datetime
+
+    """
+
+    def test_formats(self):
+        """Dates with and without fast path"""
+
+        self.assertIsNone(str2date(None), 'Wrong date for None')
+        self.assertIsNone(str2date(''), 'Wrong date for empty string')
+        self.assertEqual(str2date('2001-02-03'), datetime.datetime(2001, 2, 3), 'Wrong date')
+        self.assertEqual(str2date('2001-02-03T04:05:06Z'), datetime.datetime(2001, 2, 3, 4, 5, 6),
+                         'Wrong date with Z')
+        self.assertEqual(str2date('2001-02-03T04:05:06.000007'), datetime.datetime(2001, 2, 3, 4, 5, 6, 7),
+                         'Wrong microseconds')
+        self.assertEqual(str2date('2001-2-3T4'), datetime.datetime(2001, 2, 3, 4), 'Wrong short date')
+        # The fraction of a second is read as microseconds
+        self.assertEqual(str2date('2001-02-03T04:05:06.5'), datetime.datetime(2001, 2, 3, 4, 5, 6, 5),
+                         'Wrong fraction of second')
+        self.assertIsNone(str2date('2001-02-03T04:05:06').tzinfo, 'Date with time zone')
+        for wrong in ('20010203', '2001-W05-6', '2001-02-30', 'now'):
+            with self.assertRaises((TypeError, ValueError), msg=wrong):
+                str2date(wrong)
+
+    def test_shared(self):
+        """The same datetime is returned for the same string"""
+
+        self.assertIs(str2date('2003-01-01T00:00:00'), str2date('2003-01-01T00:00:00'), 'Datetime not shared')
+
+
+class OverlapTests(unittest.TestCase):
+    """Test the detection of overlapping routes
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        start = datetime.datetime(2000, 1, 1)
+        self.ds = Route('dataselect', 'https://geofon.gfz-potsdam.de/fdsnws/dataselect/1/query', TW(start, None), 1)
+        self.ds2 = Route('dataselect', 'https://eida.ethz.ch/fdsnws/dataselect/1/query', TW(start, None), 1)
+        self.ptRT = insertroutes([(Stream('GE', 'APE', '*', '*'), self.ds),
+                                  (Stream('G*', '*', '*', '*'), self.ds._replace(priority=2)),
+                                  (Stream('CH', '*', '*', '*'), self.ds)], dict())
+
+    def test_candidates(self):
+        """Candidates in the order of the routing table"""
+
+        index = OverlapIndex(self.ptRT)
+        self.assertEqual(index.candidates(Stream('GE', 'APE', '', 'HHZ')),
+                         [Stream('GE', 'APE', '*', '*'), Stream('G*', '*', '*', '*')], 'Wrong candidates')
+        self.assertEqual(index.candidates(Stream('XX', 'APE', '', 'HHZ')),
+                         [Stream('G*', '*', '*', '*')], 'Wrong candidates')
+        self.assertEqual(index.candidates(Stream('*', 'APE', '', 'HHZ')), list(self.ptRT), 'Wrong candidates')
+        self.assertIsNone(index.overlap(Stream('XX', 'APE', '', 'HHZ'), self.ds), 'Wrong overlap')
+
+    def test_skip(self):
+        """Overlapping routes are skipped and reported"""
+
+        st = Stream('GE', 'APE', '00', 'BHZ')
+        with self.assertLogs('addroutes', level='ERROR') as cm:
+            insertroutes([(st, self.ds2)], self.ptRT, filename='routing-ETH.xml')
+        self.assertIn('ERROR:addroutes:routing-ETH.xml: Overlap between %s and %s!\n' %
+                      (st, Stream('GE', 'APE', '*', '*')), cm.output, 'Wrong error message')
+        self.assertNotIn(st, self.ptRT, 'Overlapping route added')
+
+        insertroutes([(st, self.ds2)], self.ptRT, allowOverlaps=True)
+        self.assertEqual(self.ptRT[st], [self.ds2], 'Overlapping route not added')
+
+    def test_transaction(self):
+        """The tables are only modified when the transaction is committed"""
+
+        ptVN = dict()
+        transaction = RoutingTransaction(self.ptRT, ptVN)
+        before = dict(self.ptRT)
+        st = Stream('XX', 'ABC', '*', '*')
+        transaction.stage([(st, self.ds2), (Stream('CH', '*', '*', '*'), self.ds2._replace(priority=2))],
+                          [('_VN', st, TW(None, None))])
+        self.assertEqual(self.ptRT, before, 'Routing table modified before commit')
+        self.assertEqual(ptVN, dict(), 'Virtual networks modified before commit')
+        transaction.commit()
+        self.assertEqual(self.ptRT[st], [self.ds2], 'New stream not added')
+        self.assertEqual(self.ptRT[Stream('CH', '*', '*', '*')], [self.ds, self.ds2._replace(priority=2)],
+                         'Route not added to existing stream')
+        self.assertEqual(ptVN, {'_VN': [(st, TW(None, None))]}, 'Virtual network not added')
+        self.assertIn(st, transaction.index.candidates(st), 'New stream not indexed')
+
+    def test_discard(self):
+        """Nothing is added from a source which cannot be staged completely"""
+
+        transaction = RoutingTransaction(self.ptRT, allowOverlaps=True)
+        before = {k: list(v) for k, v in self.ptRT.items()}
+        st = Stream('XX', 'ABC', '*', '*')
+        # A route without priority cannot be sorted together with the existing ones
+        with self.assertRaises(TypeError):
+            transaction.stage([(st, self.ds2), (Stream('GE', 'APE', '*', '*'), self.ds2._replace(priority=None))])
+        transaction.discard()
+        transaction.commit()
+        self.assertEqual(self.ptRT, before, 'Routing table modified')
+        self.assertNotIn(st, transaction.index.candidates(Stream('*', '*', '*', '*')), 'Discarded stream indexed')
+
+
+class MetricsTests(unittest.TestCase):
+    """Test the counters and histograms of the service
+
+    """
+
+    def test_application(self):
+        """Export the metrics of the service with the method metrics"""
+
+        routes = routing.routes
+        routing.routes = RoutingCache()
+        routing.routes.snapshot = RoutingSnapshot(*sampleTables())
+        headers = list()
+        status = list()
+        try:
+            routing.application(build_environ('/version'), lambda st, hd: None)
+            body = routing.application(build_environ('/metrics'),
+                                       lambda st, hd: status.append(st) or headers.extend(hd))
+        finally:
+            routing.routes = routes
+
+        self.assertEqual(status, ['200 OK'], 'Wrong status')
+        self.assertEqual(dict(headers)['Content-Type'], 'text/plain', 'Wrong content type')
+        text = b''.join(body).decode()
+        for line in text.splitlines():
+            self.assertRegex(line, r'^(# (HELP|TYPE) \w+ .+|\w+(\{[^}]*\})? [-+.\deE]+)$',
+                             'Wrong line in the exposition format')
+        self.assertRegex(text, r'routing_requests_total\{function="version",format="xml",status="200"\} \d+',
+                         'Request not counted')
+        self.assertIn('routing_table_routes 3\n', text, 'Wrong size of the routing table')
+
+    def test_counter_threads(self):
+        """Counter incremented from many threads"""
+
+        cnt = Counter('test_total', 'Test counter', ('function',))
+
+        def work():
+            for _ in range(1000):
+                cnt.inc('query')
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertEqual(cnt.get('query'), 8000, 'Increments lost by the counter')
+        self.assertIn('test_total{function="query"} 8000', cnt.render(), 'Wrong export of the counter')
+
+    def test_histogram(self):
+        """Histogram with cumulative buckets"""
+
+        hist = Histogram('test_seconds', 'Test histogram', ('function',), (0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 5.0):
+            hist.observe(value, 'query')
+
+        lines = hist.render()
+        self.assertIn('test_seconds_bucket{function="query",le="0.1"} 1', lines, 'Wrong first bucket')
+        self.assertIn('test_seconds_bucket{function="query",le="1.0"} 3', lines, 'Wrong second bucket')
+        self.assertIn('test_seconds_bucket{function="query",le="+Inf"} 4', lines, 'Wrong last bucket')
+        self.assertIn('test_seconds_count{function="query"} 4', lines, 'Wrong number of observations')
+
+
+class TimingTests(unittest.TestCase):
+    """Test the measurement of the phases of a request
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.routingFile = os.path.join(self.tmpdir, 'routing.xml')
+        writeTable(self.routingFile + '.bin', [('GE', 'geofon.gfz-potsdam.de')])
+        self.rc = RoutingCache(self.routingFile, os.path.join(self.tmpdir, 'routing.cfg'))
+
+    def tearDown(self):
+        timing.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_phases(self):
+        """Phases of getRoute are measured if a timer was started"""
+
+        timer = timing.start()
+        self.rc.getRoute(Stream('GE', '*', '*', '*'), TW(None, None))
+        self.assertIs(timing.stop(), timer, 'Wrong timer for this thread')
+        for name in ('vn2real', 'match', 'stations', 'merge'):
+            self.assertIn(name, timer.phases, 'Phase %s was not measured' % name)
+        self.assertIn('match;dur=', timer.header(), 'Wrong Server-Timing header')
+
+    def test_application(self):
+        """Phases of a request sent in the Server-Timing header and in the access log"""
+
+        config = routing.readConfig()
+        config.set('Service', 'servertiming', 'true')
+        readConfig, routes = routing.readConfig, routing.routes
+        routing.readConfig = lambda: config
+        routing.routes = self.rc
+        headers = list()
+        try:
+            with self.assertLogs('access', level='INFO') as logs:
+                body = routing.application(build_environ('/query', 'net=GE&format=post'),
+                                           lambda st, hd: headers.extend(hd))
+        finally:
+            routing.readConfig, routing.routes = readConfig, routes
+
+        self.assertIn('geofon.gfz-potsdam.de', b''.join(body).decode(), 'Wrong response')
+        self.assertIn('match;dur=', dict(headers).get('Server-Timing', ''), 'Wrong Server-Timing header')
+        entry = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((entry['function'], entry['format'], entry['status']), ('query', 'post', 200),
+                         'Wrong request logged')
+        for name in ('parse', 'vn2real', 'match', 'stations', 'merge', 'format'):
+            self.assertIn(name, entry['phases'], 'Phase %s was not logged' % name)
+
+    def test_disabled(self):
+        """Nothing is measured without a timer"""
+
+        self.assertIs(timing.phase('match'), timing.noPhase, 'A phase was measured without a timer')
+        since = timing.mark()
+        self.assertGreaterEqual(timing.record('match', since), since, 'Wrong time returned')
+        self.rc.getRoute(Stream('GE', '*', '*', '*'), TW(None, None))
+        self.assertIsNone(timing.current(), 'A timer was started')
+
+
+class ProfilingTests(unittest.TestCase):
+    """Test the profiling of a sample of the requests
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sample(self):
+        """One of every N requests is profiled and saved"""
+
+        prof = RequestProfiler(self.tmpdir, sample=3)
+        saved = list()
+        for ind in range(6):
+            p = prof.start()
+            if p is not None:
+                saved.append(prof.stop(p, 0.1, 'query', 'json', 'net=GE&sta=%d' % ind))
+        self.assertEqual(len(saved), 2, 'Wrong number of requests profiled')
+        self.assertEqual(sorted(saved), sorted(os.path.join(self.tmpdir, f) for f in os.listdir(self.tmpdir)),
+                         'Profiles not saved')
+        self.assertTrue(os.path.basename(saved[0]).startswith('query-json-'), 'Wrong name of the profile')
+
+    def test_threshold(self):
+        """Only the profiles of slow requests are saved"""
+
+        prof = RequestProfiler(self.tmpdir, threshold=1.0)
+        p = prof.start()
+        self.assertIsNotNone(p, 'Request was not profiled')
+        self.assertIsNone(prof.stop(p, 0.5, 'query', 'xml', ''), 'Profile of a fast request saved')
+        p = prof.start()
+        self.assertIsNotNone(prof.stop(p, 1.5, 'query', 'xml', ''), 'Profile of a slow request not saved')
+        self.assertEqual(len(os.listdir(self.tmpdir)), 1, 'Wrong number of profiles saved')
+
+
 # ----------------------------------------------------------------------
 def usage():
     print('testRoute [-h] [-p]')
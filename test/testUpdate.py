@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+
+"""Tests to check the download of the routing information from remote data centres
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2014-2023 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences, Potsdam, Germany
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import time
+import gzip
+import hashlib
+import shutil
+import tempfile
+import threading
+import datetime
+import unittest
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer
+from http.server import BaseHTTPRequestHandler
+
+here = os.path.dirname(__file__)
+sys.path.append(os.path.join(here, '..'))
+
+from routeutils.unittestTools import WITestRunner
+from routeutils.utils import addremote
+from routeutils.utils import addremotes
+from routeutils.utils import remotemeta
+from routeutils.utils import getStationCache
+from routeutils.utils import cachestations
+from routeutils.utils import Stream
+from routeutils.utils import Route
+from routeutils.utils import TW
+from routeutils.stationws import harvest
+from routeutils.stationws import StationCache
+
+with open(os.path.join(here, '..', 'data', 'routing.sample.xml'), 'rb') as fin:
+    sampleXML = fin.read()
+with open(os.path.join(here, '..', 'data', 'routing.sample.json'), 'rb') as fin:
+    sampleJSON = fin.read()
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    """Routing Service answering after a delay (seconds) defined in the server, with ETag and gzip"""
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path.endswith('/localconfig'):
+            body, ctype = sampleXML, 'text/xml'
+        elif self.path.endswith('/dc'):
+            body, ctype = sampleJSON, 'application/json'
+        else:
+            self.send_error(404)
+            return
+
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('ETag', etag)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StationHandler(BaseHTTPRequestHandler):
+    """Station-WS (format=text) keeping the connections open"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        self.server.requests.append((self.path, self.client_address))
+        query = parse_qs(urlsplit(self.path).query)
+        if not self.path.startswith('/fdsnws/station/1/query'):
+            body = b''
+            self.send_response(404)
+        elif 'updatedafter' in query and not self.server.delta:
+            body = b'Unknown parameter updatedafter'
+            self.send_response(400)
+        else:
+            net = query['net'][0]
+            # Only the new stations were updated
+            stations = self.server.new if 'updatedafter' in query else ['S0', 'S1', 'S2'] + self.server.new
+            lines = ['#Network|Station|Latitude|Longitude|Elevation|SiteName|StartTime|EndTime']
+            for sta in stations:
+                lines.append('%s|%s|1.5|10.25|100|Site Ä|2000-01-01T00:00:00|' % (net, sta))
+            body = ('\n'.join(lines) + '\n').encode('utf-8') if len(stations) else b''
+            self.send_response(200 if len(stations) else 204)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def startServer(delay: float, handler: type = _SlowHandler) -> ThreadingHTTPServer:
+    """Start a Routing Service in a thread answering after *delay* seconds."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.requests = list()
+    # Support of updatedafter and stations added to the station-WS
+    server.delta = True
+    server.new = list()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def baseURL(server: ThreadingHTTPServer) -> str:
+    return 'http://127.0.0.1:%d/eidaws/routing/1' % server.server_address[1]
+
+
+class DownloadTests(unittest.TestCase):
+    """Test the parallel download of the files from remote data centres
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.servers = list()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def server(self, delay: float) -> str:
+        self.servers.append(startServer(delay))
+        return baseURL(self.servers[-1])
+
+    def test_parallel(self):
+        """Slow data centres are contacted at the same time"""
+
+        remotes = dict(('DC%d' % i, self.server(0.5)) for i in range(4))
+        for dcid in remotes:
+            with open(os.path.join(self.tmpdir, 'routing-%s.xml' % dcid), 'w') as fout:
+                fout.write('old')
+
+        startTime = time.time()
+        result = addremotes(remotes, self.tmpdir, workers=4, timeout=10)
+        elapsed = time.time() - startTime
+
+        # Two requests per data centre, i.e. 4 seconds one after the other
+        self.assertLess(elapsed, 2.5, 'Downloads not in parallel (%.2f s)' % elapsed)
+        self.assertEqual(result, dict.fromkeys(remotes), 'Unexpected failures')
+        for dcid in remotes:
+            with open(os.path.join(self.tmpdir, 'routing-%s.xml' % dcid), 'rb') as fin:
+                self.assertEqual(fin.read(), sampleXML, 'Wrong routes from %s' % dcid)
+            with open(os.path.join(self.tmpdir, 'routing-%s.json' % dcid), 'rb') as fin:
+                self.assertEqual(fin.read(), sampleJSON, 'Wrong data centre information from %s' % dcid)
+            with open(os.path.join(self.tmpdir, 'routing-%s.xml.bck' % dcid)) as fin:
+                self.assertEqual(fin.read(), 'old', 'No backup of the previous routes of %s' % dcid)
+
+    def test_timeout(self):
+        """A data centre which does not answer does not stall the others"""
+
+        remotes = {'SLOW': self.server(3), 'FAST': self.server(0)}
+        with open(os.path.join(self.tmpdir, 'routing-SLOW.xml'), 'w') as fout:
+            fout.write('old')
+
+        startTime = time.time()
+        result = addremotes(remotes, self.tmpdir, workers=2, timeout=0.5)
+        elapsed = time.time() - startTime
+
+        self.assertLess(elapsed, 2, 'Timeout not applied (%.2f s)' % elapsed)
+        self.assertIsNone(result['FAST'], 'Failure with FAST')
+        with open(os.path.join(self.tmpdir, 'routing-FAST.xml'), 'rb') as fin:
+            self.assertEqual(fin.read(), sampleXML, 'Wrong routes from FAST')
+        with open(os.path.join(self.tmpdir, 'routing-SLOW.xml')) as fin:
+            self.assertEqual(fin.read(), 'old', 'Routes from SLOW not kept')
+
+
+class ConditionalTests(unittest.TestCase):
+    """Test the conditional and compressed download of the files
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = startServer(0)
+        self.filename = os.path.join(self.tmpdir, 'routing-DC.xml')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_gzip(self):
+        """Compressed data is decompressed while saving it"""
+
+        addremote(self.filename, baseURL(self.server))
+        self.assertIn('gzip', self.server.requests[-1][1].get('Accept-Encoding'), 'Compression not requested')
+        with open(self.filename, 'rb') as fin:
+            self.assertEqual(fin.read(), sampleXML, 'Wrong routes')
+
+    def test_not_modified(self):
+        """Files are not downloaded again if they did not change"""
+
+        with open(self.filename, 'w') as fout:
+            fout.write('old')
+        addremote(self.filename, baseURL(self.server))
+        self.assertEqual(remotemeta(self.filename)['etag'], '"%s"' % hashlib.sha1(sampleXML).hexdigest(),
+                         'ETag not saved')
+
+        addremote(self.filename, baseURL(self.server))
+        self.assertIn('If-None-Match', self.server.requests[-1][1], 'Request not conditional')
+        with open(self.filename, 'rb') as fin:
+            self.assertEqual(fin.read(), sampleXML, 'Routes not kept')
+        with open(self.filename + '.bck') as fin:
+            self.assertEqual(fin.read(), 'old', 'Backup replaced')
+
+        # Without the file the request cannot be conditional
+        os.remove(self.filename)
+        addremote(self.filename, baseURL(self.server))
+        self.assertNotIn('If-None-Match', self.server.requests[-1][1], 'Request conditional without a file')
+        self.assertTrue(os.path.exists(self.filename), 'Routes not downloaded')
+
+
+class HarvestTests(unittest.TestCase):
+    """Test the concurrent retrieval of stations from the station-WS
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.server = startServer(0.1, _StationHandler)
+        url = 'http://127.0.0.1:%d/fdsnws/station/1/query' % self.server.server_address[1]
+        start = datetime.datetime(1990, 1, 1)
+        self.ptRT = dict()
+        for net in range(10):
+            self.ptRT[Stream('N%d' % net, '*', '*', '*')] = [Route('station', url, TW(start, None), 1),
+                                                            Route('dataselect', url, TW(start, None), 1)]
+        # Same query as N0.*.*.*
+        self.ptRT[Stream('N0', '*', '00', 'HH?')] = [Route('station', url, TW(start, None), 1)]
+        self.ptRT[Stream('N1', '*', '*', '*')].append(Route('station', url, TW(start, None), 2))
+        self.tmpdir = tempfile.mkdtemp()
+        self.cacheFile = os.path.join(self.tmpdir, 'stations.pickle')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_same_stations(self):
+        """Same stations as requesting them one by one"""
+
+        stationTable = dict()
+        cachestations(self.ptRT, stationTable, workers=8, perhost=2)
+
+        expected = dict()
+        for st, routes in self.ptRT.items():
+            expected[st] = list()
+            for rt in routes:
+                if rt.service == 'station':
+                    expected[st].extend(getStationCache(st, rt))
+        self.assertEqual(list(stationTable), ['127.0.0.1:%d' % self.server.server_address[1]], 'Wrong hosts')
+        self.assertEqual(stationTable['127.0.0.1:%d' % self.server.server_address[1]], expected,
+                         'Wrong stations')
+        self.assertEqual(expected[Stream('N1', '*', '*', '*')][0].name, 'S0', 'Wrong station name')
+
+    def test_connections(self):
+        """Identical queries sent once through a few connections"""
+
+        pairs = [(st, rt) for st, routes in self.ptRT.items() for rt in routes if rt.service == 'station']
+        startTime = time.time()
+        result = harvest(pairs, workers=8, perhost=2)
+        elapsed = time.time() - startTime
+
+        self.assertEqual(len(result), 10, 'Wrong number of queries')
+        self.assertEqual(len(self.server.requests), 10, 'Repeated queries sent')
+        self.assertLessEqual(len(set(client for _, client in self.server.requests)), 2,
+                             'Connections not reused')
+        # 10 queries of 0.1 seconds through 2 connections
+        self.assertLess(elapsed, 0.9, 'Queries not in parallel (%.2f s)' % elapsed)
+
+    def test_error(self):
+        """Errors answered by a station-WS give no stations"""
+
+        rt = Route('station', 'http://127.0.0.1:%d/wrong' % self.server.server_address[1],
+                   TW(datetime.datetime(1990, 1, 1), None), 1)
+        with self.assertLogs(level='WARNING'):
+            result = harvest([(Stream('N0', '*', '*', '*'), rt)])
+        self.assertEqual(list(result.values()), [[]], 'Stations from a wrong URL')
+
+    def test_cache(self):
+        """Stations cached are not requested again"""
+
+        first = dict()
+        cache = StationCache(self.cacheFile, ttl=3600)
+        cachestations(self.ptRT, first, cache)
+        cache.save()
+        self.assertEqual(cache.counters['full'], 10, 'Wrong number of queries')
+        requests = len(self.server.requests)
+
+        second = dict()
+        cache = StationCache(self.cacheFile, ttl=3600)
+        cachestations(self.ptRT, second, cache)
+        self.assertEqual(cache.counters['cached'], 10, 'Stations not cached')
+        self.assertEqual(len(self.server.requests), requests, 'Stations requested again')
+        self.assertEqual(first, second, 'Different stations from the cache')
+
+    def test_delta(self):
+        """Only the stations updated are requested after the TTL"""
+
+        cache = StationCache(self.cacheFile, ttl=0)
+        cachestations(self.ptRT, dict(), cache)
+        cache.save()
+
+        self.server.new.append('S9')
+        stationTable = dict()
+        cache = StationCache(self.cacheFile, ttl=0)
+        cachestations(self.ptRT, stationTable, cache)
+        self.assertEqual(cache.counters['delta'], 10, 'Stations not updated')
+        self.assertIn('updatedafter=', self.server.requests[-1][0], 'Not only the stations updated requested')
+        stations = list(stationTable.values())[0][Stream('N3', '*', '*', '*')]
+        self.assertEqual([sta.name for sta in stations], ['S0', 'S1', 'S2', 'S9'], 'New station not added')
+
+        # Without updatedafter every query is sent again completely
+        self.server.delta = False
+        cache = StationCache(self.cacheFile, ttl=0)
+        cachestations(self.ptRT, stationTable, cache)
+        self.assertEqual(cache.counters['full'], 10, 'Stations not requested completely')
+        self.assertEqual(len(cache.nodelta), 1, 'Server without support of updatedafter not detected')
+
+    def test_error_cached(self):
+        """Stations cached are used if the station-WS fails"""
+
+        cache = StationCache(self.cacheFile, ttl=0)
+        cachestations(self.ptRT, dict(), cache)
+        cache.save()
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = startServer(0, _StationHandler)
+        stationTable = dict()
+        with self.assertLogs('StationCache', level='WARNING'):
+            cache = StationCache(self.cacheFile, ttl=0)
+            cachestations(self.ptRT, stationTable, cache)
+        stations = list(stationTable.values())[0][Stream('N3', '*', '*', '*')]
+        self.assertEqual([sta.name for sta in stations], ['S0', 'S1', 'S2'], 'Stations cached not used')
+
+    def test_offline(self):
+        """Only the stations cached are used offline"""
+
+        cache = StationCache(self.cacheFile, ttl=0)
+        cachestations(self.ptRT, dict(), cache)
+        cache.save()
+        requests = len(self.server.requests)
+
+        url = 'http://127.0.0.1:%d/fdsnws/station/1/query' % self.server.server_address[1]
+        self.ptRT[Stream('XX', '*', '*', '*')] = [Route('station', url, TW(datetime.datetime(1990, 1, 1), None), 1)]
+        stationTable = dict()
+        cache = StationCache(self.cacheFile, ttl=0, offline=True)
+        cachestations(self.ptRT, stationTable, cache)
+        self.assertEqual(len(self.server.requests), requests, 'Stations requested offline')
+        self.assertEqual((cache.counters['cached'], cache.counters['missing']), (10, 1), 'Wrong queries')
+        stations = list(stationTable.values())[0]
+        self.assertEqual([sta.name for sta in stations[Stream('N3', '*', '*', '*')]], ['S0', 'S1', 'S2'],
+                         'Stations cached not used')
+        self.assertEqual(stations[Stream('XX', '*', '*', '*')], [], 'Stations of a query not cached')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print('testUpdate [-h] [-p]')
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind in range(len(sys.argv)-1, -1, -1):
+        if ind == 0:
+            break
+        if sys.argv[ind] in ('-p', '--plain'):
+            sys.argv.pop(ind)
+            mode = 0
+        elif sys.argv[ind] in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))